@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+'''Compare the address codecs with the original per-character implementations.
+
+usage: bench_codecs.py [count]
+
+Encodes and decodes count random P2PKH addresses (default 1,000,000) in
+Base58Check and cashaddr form with both implementations, checks they agree,
+and prints the time each took.
+'''
+
+import os
+import sys
+import time
+
+from electrumsv import cashaddr
+from electrumsv.address import Address, Base58
+from electrumsv.crypto import sha256d
+from electrumsv.networks import Net
+
+
+# The original implementations, kept here for reference.
+
+B58_CHARS = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+B58_MAP = {c: n for n, c in enumerate(B58_CHARS)}
+CASHADDR_CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+
+
+def ref_b58_encode_check(payload):
+    be_bytes = payload + sha256d(payload)[:4]
+    value = int.from_bytes(be_bytes, 'big')
+    txt = ''
+    while value:
+        value, mod = divmod(value, 58)
+        txt += B58_CHARS[mod]
+    for byte in be_bytes:
+        if byte != 0:
+            break
+        txt += '1'
+    return txt[::-1]
+
+
+def ref_char_value(c):
+    val = B58_MAP.get(c)
+    if val is None:
+        raise ValueError('invalid base 58 character "{}"'.format(c))
+    return val
+
+
+def ref_b58_decode_check(txt):
+    value = 0
+    for c in txt:
+        value = value * 58 + ref_char_value(c)
+    result = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    count = 0
+    for c in txt:
+        if c != '1':
+            break
+        count += 1
+    be_bytes = bytes(count) + result
+    result, check = be_bytes[:-4], be_bytes[-4:]
+    assert check == sha256d(result)[:4]
+    return result
+
+
+def ref_polymod(values):
+    c = 1
+    for d in values:
+        c0 = c >> 35
+        c = ((c & 0x07ffffffff) << 5) ^ d
+        if c0 & 0x01:
+            c ^= 0x98f2bc8e61
+        if c0 & 0x02:
+            c ^= 0x79b76d99e2
+        if c0 & 0x04:
+            c ^= 0xf33e5fb3c4
+        if c0 & 0x08:
+            c ^= 0xae2eabe2a8
+        if c0 & 0x10:
+            c ^= 0x1e4f43e470
+    return c ^ 1
+
+
+def ref_convertbits(data, frombits, tobits, pad=True):
+    acc = 0
+    bits = 0
+    ret = bytearray()
+    maxv = (1 << tobits) - 1
+    max_acc = (1 << (frombits + tobits - 1)) - 1
+    for value in data:
+        acc = ((acc << frombits) | value) & max_acc
+        bits += frombits
+        while bits >= tobits:
+            bits -= tobits
+            ret.append((acc >> bits) & maxv)
+    if pad and bits:
+        ret.append((acc << (tobits - bits)) & maxv)
+    return ret
+
+
+def ref_prefix_expand(prefix):
+    return bytearray(ord(x) & 0x1f for x in prefix) + bytearray(1)
+
+
+def ref_cashaddr_encode(prefix, kind, addr_hash):
+    payload = ref_convertbits(bytes([kind << 3]) + addr_hash, 8, 5, True)
+    polymod = ref_polymod(ref_prefix_expand(prefix) + payload + bytes(8))
+    checksum = bytes((polymod >> 5 * (7 - i)) & 31 for i in range(8))
+    return ''.join([CASHADDR_CHARSET[d] for d in payload + checksum])
+
+
+def ref_cashaddr_decode(prefix, payload):
+    data = bytes(CASHADDR_CHARSET.find(x) for x in payload)
+    assert not ref_polymod(ref_prefix_expand(prefix) + data)
+    decoded = ref_convertbits(data[:-8], 5, 8, False)
+    return decoded[0] >> 3, bytes(decoded[1:])
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    print(f'  {label:<10} {time.perf_counter() - start:8.2f}s')
+    return result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    prefix = Net.CASHADDR_PREFIX
+    hashes = [os.urandom(20) for _ in range(count)]
+    payloads = [bytes([Net.ADDRTYPE_P2PKH]) + h for h in hashes]
+    print(f'{count:,d} addresses')
+
+    print('Base58Check encode')
+    ref = timed('original', lambda: [ref_b58_encode_check(p) for p in payloads])
+    new = timed('current', lambda: Base58.encode_check_many(payloads))
+    assert ref == new
+    strings = new
+
+    print('Base58Check decode')
+    ref = timed('original', lambda: [ref_b58_decode_check(s) for s in strings])
+    new = timed('current', lambda: Base58.decode_check_many(strings))
+    assert ref == new
+
+    items = [(cashaddr.PUBKEY_TYPE, h) for h in hashes]
+    print('cashaddr encode')
+    ref = timed('original', lambda: [ref_cashaddr_encode(prefix, k, h) for k, h in items])
+    new = timed('current', lambda: cashaddr.encode_many(prefix, items))
+    assert ref == new
+    full = [':'.join([prefix, s]) for s in new]
+
+    print('cashaddr decode')
+    ref = timed('original', lambda: [ref_cashaddr_decode(prefix, s) for s in new])
+    new = timed('current', lambda: [(k, h) for _, k, h in cashaddr.decode_many(full)])
+    assert ref == new
+
+    print('Address.from_strings (first parse, then interned)')
+    timed('first', lambda: Address.from_strings(strings))
+    addresses = Address.from_strings(strings)
+    timed('interned', lambda: Address.from_strings(strings))
+    del addresses
+
+
+if __name__ == '__main__':
+    main()
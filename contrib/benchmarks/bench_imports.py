@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+'''Report the time taken importing ElectrumSV modules, using python -X importtime.
+
+usage: bench_imports.py [options] [module ...]
+
+Imports each module (by default electrumsv.main, which every command line
+invocation imports) in a fresh interpreter --repeat times, and reports the
+best total time and the modules contributing most to it.  --json writes the
+results to a file; --compare reads a file of earlier results and reports
+modules whose import became slower by more than --threshold, or that are
+newly imported, exiting with status 1 if the total regressed.
+
+Run from the repository root with PYTHONPATH=.
+'''
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+
+def import_times(module):
+    '''Import module in a new interpreter.  Returns a dict mapping each module
+    imported to its (self, cumulative) import time in seconds.'''
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [os.getcwd()] + os.environ.get('PYTHONPATH', '').split(os.pathsep)))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            stderr=subprocess.PIPE, env=env, universal_newlines=True)
+    if result.returncode:
+        sys.exit(f'importing {module} failed:\n{result.stderr}')
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+    return times
+
+
+def measure(module, repeat):
+    '''The best of repeat runs, keeping each module's fastest times.'''
+    best = {}
+    for _ in range(repeat):
+        for name, (self_time, cumulative) in import_times(module).items():
+            old = best.get(name)
+            if old is None or cumulative < old[1]:
+                best[name] = (self_time, cumulative)
+    return {
+        'total': best[module][1],
+        'modules': {name: {'self': times[0], 'cumulative': times[1]}
+                    for name, times in best.items()},
+    }
+
+
+def report(module, result, top):
+    print(f'{module}: {result["total"] * 1000:.1f} ms, '
+          f'{len(result["modules"])} modules imported')
+    heaviest = sorted(result['modules'].items(), key=lambda item: -item[1]['self'])
+    print(f'  {"module":48} {"self":>9} {"cumulative":>11}')
+    for name, times in heaviest[:top]:
+        print(f'  {name:48} {times["self"] * 1000:7.1f}ms {times["cumulative"] * 1000:9.1f}ms')
+
+
+def compare(module, result, baseline, threshold):
+    '''Print the changes from baseline and return True if the total regressed.'''
+    old = baseline.get(module)
+    if old is None:
+        print(f'{module}: not in the baseline')
+        return False
+    ratio = result['total'] / old['total']
+    regressed = ratio > threshold
+    print(f'{module}: {old["total"] * 1000:.1f} ms -> {result["total"] * 1000:.1f} ms '
+          f'({ratio:.2f}){"  REGRESSION" if regressed else ""}')
+    added = sorted(set(result['modules']) - set(old['modules']),
+                   key=lambda name: -result['modules'][name]['cumulative'])
+    for name in added:
+        print(f'  newly imported: {name} '
+              f'{result["modules"][name]["cumulative"] * 1000:.1f} ms')
+    for name, times in result['modules'].items():
+        old_times = old['modules'].get(name)
+        # Ignore noise in modules that are cheap to import
+        if old_times and times['self'] > 0.002 and times['self'] > old_times['self'] * threshold:
+            print(f'  slower: {name} {old_times["self"] * 1000:.1f} ms -> '
+                  f'{times["self"] * 1000:.1f} ms')
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('modules', nargs='*', default=['electrumsv.main'])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=20, help='how many modules to list')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='compare against results in this file')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='slowdown ratio reported as a regression (default 1.2)')
+    args = parser.parse_args()
+
+    results = {module: measure(module, args.repeat) for module in args.modules}
+    for module, result in results.items():
+        report(module, result, args.top)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'time': int(time.time()), 'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressed = [compare(module, result, baseline, args.threshold)
+                     for module, result in results.items()]
+        if any(regressed):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+'''Benchmark the wallet's hot paths on a synthetic wallet.
+
+usage: bench_wallet.py [options]
+
+Builds a standard wallet with the given number of receiving addresses and
+transactions, some of whose outputs are left unspent, then times:
+
+  load, save                  opening the wallet file and writing it back
+  get_balance, get_history    over the whole wallet
+  get_utxos
+  make_unsigned_transaction   choosing coins for a payment
+  sign_transaction            signing that payment
+  add_transaction             adding and removing a wallet transaction
+  remove_transaction
+  connect_chunk               connecting a chunk of 2016 headers
+  header_at_height            looking up that chunk's headers one at a time
+  headers_at_heights          and all at once through the (warm) header index
+  verify_merkle               checking a merkle branch against a root
+
+Each benchmark runs --repeat times and the best and median times are
+reported.  --json writes the results to a file; --compare reads a file of
+earlier results and reports benchmarks that became slower by more than
+--threshold, exiting with status 1 if there are any.  Compare only results
+from the same machine and wallet size.
+
+Run from the repository root with PYTHONPATH=.
+'''
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import struct
+import sys
+import tempfile
+import time
+
+from bitcoinx import Headers
+
+from electrumsv import keystore
+from electrumsv.address import Address
+from electrumsv.app_state import app_state, AppStateProxy
+from electrumsv.bitcoin import TYPE_ADDRESS
+from electrumsv.blockchain import Blockchain
+from electrumsv.crypto import sha256d
+from electrumsv.networks import Net
+from electrumsv.simple_config import SimpleConfig
+from electrumsv.storage import WalletStorage
+from electrumsv.transaction import Transaction
+from electrumsv.verifier import SPV
+from electrumsv.wallet import Standard_Wallet
+
+
+SEED = 'cycle rocket west magnet parrot shuffle foot correct salt library feed song'
+# An arbitrary compressed public key for inputs from outside the wallet
+EXTERNAL_PUBKEY = bytes.fromhex(
+    '0279be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798')
+# Standing in for a signature; parsing transactions does not verify them
+DUMMY_SIGNATURE = bytes(70) + b'\x41'
+BASE_HEIGHT = 500000
+
+
+def var_int(n):
+    if n < 0xfd:
+        return bytes([n])
+    if n <= 0xffff:
+        return b'\xfd' + struct.pack('<H', n)
+    return b'\xfe' + struct.pack('<I', n)
+
+
+def push(data):
+    return bytes([len(data)]) + data
+
+
+def raw_tx(inputs, outputs):
+    '''Serialize a transaction.  inputs are (prevout_hash, prevout_n, pubkey)
+    triples spent with a P2PKH script; outputs are (script, value) pairs.'''
+    parts = [struct.pack('<i', 1), var_int(len(inputs))]
+    for prevout_hash, prevout_n, pubkey in inputs:
+        script = push(DUMMY_SIGNATURE) + push(pubkey)
+        parts += [bytes.fromhex(prevout_hash)[::-1], struct.pack('<I', prevout_n),
+                  var_int(len(script)), script, b'\xff\xff\xff\xff']
+    parts.append(var_int(len(outputs)))
+    for script, value in outputs:
+        parts += [struct.pack('<Q', value), var_int(len(script)), script]
+    parts.append(struct.pack('<I', 0))
+    return b''.join(parts).hex()
+
+
+def tx_hash_of(raw):
+    return sha256d(bytes.fromhex(raw))[::-1].hex()
+
+
+def random_bytes(rand, n):
+    return rand.getrandbits(8 * n).to_bytes(n, 'big')
+
+
+def make_wallet(path, n_addresses, n_transactions, n_utxos, rand):
+    '''Create and save a synthetic wallet at path.  n_utxos funding transactions
+    are left unspent; the remaining transactions are pairs of a funding
+    transaction and one spending it to an outside address.  Returns the
+    wallet.'''
+    storage = WalletStorage(path)
+    storage.put('keystore', keystore.from_seed(SEED, '', False).dump())
+    storage.put('gap_limit', n_addresses)
+    storage.put('stored_height', BASE_HEIGHT + n_transactions + 10)
+    wallet = Standard_Wallet(storage)
+    wallet.synchronize()
+    addresses = wallet.get_receiving_addresses()
+    outside = Address.from_P2PKH_hash(bytes(20))
+
+    histories = {address: [] for address in addresses}
+    height = BASE_HEIGHT
+    n_spent = max(0, n_transactions - n_utxos) // 2
+
+    def add(raw, address, height):
+        tx_hash = tx_hash_of(raw)
+        histories[address].append((tx_hash, height))
+        wallet.verified_tx[tx_hash] = (height, 1500000000 + height * 600, 1)
+        return tx_hash, raw
+
+    txs = []
+    for n in range(n_utxos + n_spent):
+        address = addresses[n % len(addresses)]
+        value = rand.randrange(10000, 10000000)
+        raw = raw_tx([(random_bytes(rand, 32).hex(), 0, EXTERNAL_PUBKEY)],
+                     [(address.to_script(), value), (outside.to_script(), 5000)])
+        height += 1
+        txs.append(add(raw, address, height))
+        if n >= n_utxos:
+            pubkey = bytes.fromhex(wallet.get_public_keys(address)[0])
+            spend = raw_tx([(txs[-1][0], 0, pubkey)], [(outside.to_script(), value - 1000)])
+            height += 1
+            txs.append(add(spend, address, height))
+
+    for tx_hash, raw in txs:
+        wallet.add_transaction(tx_hash, Transaction(raw))
+    for address, hist in histories.items():
+        wallet.receive_history_callback(address, hist, {})
+    wallet.save_transactions()
+    wallet.save_verified_tx()
+    storage.write()
+    return wallet
+
+
+def make_headers(path, rand):
+    '''Install a headers store at path and return a chunk of 2016 raw headers
+    ending below the checkpoint, linked by their prev_hash fields.'''
+    app_state.headers = Headers.from_file(Net.COIN, path, Net.CHECKPOINT)
+    for chain in app_state.headers.chains():
+        Blockchain.from_chain(chain)
+    prev_hash = bytes(32)
+    headers = []
+    for n in range(2016):
+        raw = (struct.pack('<I', 4) + prev_hash + random_bytes(rand, 32) +
+               struct.pack('<III', 1500000000 + n * 600, 0x18015ddc, n))
+        headers.append(raw)
+        prev_hash = sha256d(raw)
+    start_height = Net.CHECKPOINT.height - 10 * 2016
+    return start_height, b''.join(headers)
+
+
+def make_merkle_branch(depth, rand):
+    tx_hash = random_bytes(rand, 32).hex()
+    branch = [random_bytes(rand, 32).hex() for _ in range(depth)]
+    pos = rand.randrange(1 << depth)
+    return tx_hash, branch, pos
+
+
+def run(name, func, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'best': min(times), 'median': statistics.median(times), 'runs': repeat}
+
+
+def benchmarks(args, work_dir):
+    rand = random.Random(args.seed)
+    path = os.path.join(work_dir, 'wallet')
+    config = SimpleConfig({'electrum_path': work_dir, 'fee_per_kb': 1000})
+    AppStateProxy(config, 'cmdline')
+    start = time.perf_counter()
+    wallet = make_wallet(path, args.addresses, args.transactions, args.utxos, rand)
+    print(f'built wallet in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+
+    def load():
+        loaded = Standard_Wallet(WalletStorage(path))
+        # Wait for the background part of loading
+        loaded.invoices
+
+    def save():
+        wallet.storage.modified = True
+        wallet.save_transactions()
+        wallet.storage.write()
+
+    payee = Address.from_P2PKH_hash(bytes(20))
+    coins = wallet.get_utxos()
+    amount = sum(coin['value'] for coin in coins) // 4
+    outputs = [(TYPE_ADDRESS, payee, amount)]
+    state = {}
+
+    def make_tx():
+        state['tx'] = wallet.make_unsigned_transaction(coins, list(outputs), config)
+
+    def sign():
+        wallet.sign_transaction(state['tx'], None)
+
+    spend_hash, spend_tx = None, None
+    for tx_hash in wallet.transactions:
+        if wallet.txi.has_records(tx_hash):
+            spend_hash, spend_tx = tx_hash, wallet.transactions[tx_hash]
+            break
+
+    start_height, chunk = make_headers(os.path.join(work_dir, 'headers'), rand)
+    merkle_tx, merkle_branch, merkle_pos = make_merkle_branch(12, rand)
+
+    results = {}
+    def bench(name, func, setup=None, repeat=args.repeat):
+        if args.only and name not in args.only:
+            return
+        results[name] = run(name, func, repeat, setup)
+        print(f'{name:28} best {results[name]["best"] * 1000:10.3f} ms', file=sys.stderr)
+
+    bench('load', load)
+    bench('save', save)
+    bench('get_balance', wallet.get_balance)
+    bench('get_history', wallet.get_history)
+    bench('get_utxos', wallet.get_utxos)
+    bench('make_unsigned_transaction', make_tx)
+    if 'tx' not in state:
+        make_tx()
+    bench('sign_transaction', sign, setup=make_tx)
+    if spend_hash is not None:
+        def ensure_added():
+            if spend_hash not in wallet.txi:
+                wallet.add_transaction(spend_hash, spend_tx)
+        def ensure_removed():
+            if spend_hash in wallet.txi:
+                wallet.remove_transaction(spend_hash)
+        bench('remove_transaction', lambda: wallet.remove_transaction(spend_hash),
+              setup=ensure_added)
+        bench('add_transaction', lambda: wallet.add_transaction(spend_hash, spend_tx),
+              setup=ensure_removed)
+    bench('connect_chunk',
+          lambda: Blockchain.connect_chunk(start_height, chunk, True))
+    Blockchain.connect_chunk(start_height, chunk, True)
+    blockchain = Blockchain.longest()
+    heights = list(range(start_height, start_height + 2016))
+    bench('header_at_height', lambda: [blockchain.header_at_height(height)
+                                       for height in heights])
+    bench('headers_at_heights', lambda: blockchain.headers_at_heights(heights))
+    bench('verify_merkle', lambda: [SPV.hash_merkle_root(merkle_branch, merkle_tx, merkle_pos)
+                                    for _ in range(1000)])
+    return results
+
+
+def compare(results, baseline, threshold):
+    '''Print a comparison and return the names of benchmarks that regressed.'''
+    regressions = []
+    print(f'{"benchmark":28} {"baseline":>12} {"current":>12} {"ratio":>7}')
+    for name, result in results['benchmarks'].items():
+        old = baseline['benchmarks'].get(name)
+        if old is None:
+            print(f'{name:28} {"-":>12} {result["best"] * 1000:10.3f}ms')
+            continue
+        ratio = result['best'] / old['best'] if old['best'] else float('inf')
+        flag = ''
+        if ratio > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:28} {old["best"] * 1000:10.3f}ms {result["best"] * 1000:10.3f}ms '
+              f'{ratio:7.2f}{flag}')
+    if baseline.get('parameters') != results['parameters']:
+        print('warning: the baseline was run with different parameters', file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--addresses', type=int, default=200)
+    parser.add_argument('--transactions', type=int, default=2000)
+    parser.add_argument('--utxos', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1, help='seeds all the synthetic data')
+    parser.add_argument('--only', type=lambda s: s.split(','), default=None,
+                        help='comma-separated benchmarks to run')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='compare against results in this file')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='slowdown ratio reported as a regression (default 1.2)')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        results = {
+            'parameters': {'addresses': args.addresses, 'transactions': args.transactions,
+                           'utxos': args.utxos, 'seed': args.seed},
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'time': int(time.time()),
+            'benchmarks': benchmarks(args, work_dir),
+        }
+    finally:
+        shutil.rmtree(work_dir)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+    elif not args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -25,7 +25,9 @@
 # Many of the functions in this file are copied from ElectrumX
 
 from collections import namedtuple
+import itertools
 import struct
+import weakref
 
 from . import cashaddr
 from .bitcoin import is_minikey, minikey_to_private_key
@@ -276,18 +278,65 @@ class ScriptOutput(namedtuple("ScriptAddressTuple", "script")):
         return ScriptOutput(bytes(script))
 
 
-# A namedtuple for easy comparison and unique hashing
-class Address(namedtuple("AddressTuple", "hash160 kind")):
+class Address(object):
+    '''A P2PKH or P2SH address.  Compares and hashes by (hash160, kind).
+
+    Addresses are immutable, so their string and script hash forms are computed
+    once and cached.  Parsing the same string twice with from_string() returns
+    the same object while it is alive.
+    '''
+
+    __slots__ = ('hash160', 'kind', '_net', '_string', '_cashaddr',
+                 '_scripthash', '_scripthash_hex', '__weakref__')
 
     # Address kinds
     ADDR_P2PKH = 0
     ADDR_P2SH = 1
 
+    # (network, string) -> Address
+    _interned = weakref.WeakValueDictionary()
+
     def __new__(cls, hash160value, kind):
         assert kind in (cls.ADDR_P2PKH, cls.ADDR_P2SH)
         hash160value = to_bytes(hash160value)
         assert len(hash160value) == 20
-        return super().__new__(cls, hash160value, kind)
+        self = super().__new__(cls)
+        self.hash160 = hash160value
+        self.kind = kind
+        # The network the cached strings were encoded for
+        self._net = None
+        self._string = None
+        self._cashaddr = None
+        self._scripthash = None
+        self._scripthash_hex = None
+        return self
+
+    def __eq__(self, other):
+        if not isinstance(other, Address):
+            return NotImplemented
+        return self.hash160 == other.hash160 and self.kind == other.kind
+
+    def __ne__(self, other):
+        if not isinstance(other, Address):
+            return NotImplemented
+        return self.hash160 != other.hash160 or self.kind != other.kind
+
+    def __lt__(self, other):
+        if not isinstance(other, Address):
+            return NotImplemented
+        return (self.hash160, self.kind) < (other.hash160, other.kind)
+
+    def __hash__(self):
+        return hash((self.hash160, self.kind))
+
+    def __reduce__(self):
+        return (self.__class__, (self.hash160, self.kind))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
     @classmethod
     def from_cashaddr_string(cls, string):
@@ -311,6 +360,15 @@ class Address(namedtuple("AddressTuple", "hash160 kind")):
     @classmethod
     def from_string(cls, string):
         '''Construct from an address string.'''
+        key = (Net._net, string)
+        address = cls._interned.get(key)
+        if address is None:
+            address = cls._from_string(string)
+            cls._interned[key] = address
+        return address
+
+    @classmethod
+    def _from_string(cls, string):
         if len(string) > 35:
             try:
                 return cls.from_cashaddr_string(string)
@@ -334,7 +392,11 @@ class Address(namedtuple("AddressTuple", "hash160 kind")):
         else:
             raise AddressError('unknown version byte: {}'.format(verbyte))
 
-        return cls(hash160_, kind)
+        address = cls(hash160_, kind)
+        # The string is the canonical encoding; no need to encode it again
+        address._net = Net._net
+        address._string = string
+        return address
 
     @classmethod
     def is_valid(cls, string):
@@ -372,14 +434,34 @@ class Address(namedtuple("AddressTuple", "hash160 kind")):
     def from_multisig_script(cls, script):
         return cls(hash_160(script), cls.ADDR_P2SH)
 
+    def _check_net(self):
+        # Cached strings are only valid for the network they were encoded for
+        if self._net is not Net._net:
+            self._net = Net._net
+            self._string = None
+            self._cashaddr = None
+
     def to_string(self):
         '''Converts to a string of the given format.'''
-        if self.kind == self.ADDR_P2PKH:
-            verbyte = Net.ADDRTYPE_P2PKH
-        else:
-            verbyte = Net.ADDRTYPE_P2SH
-
-        return Base58.encode_check(bytes([verbyte]) + self.hash160)
+        self._check_net()
+        if self._string is None:
+            if self.kind == self.ADDR_P2PKH:
+                verbyte = Net.ADDRTYPE_P2PKH
+            else:
+                verbyte = Net.ADDRTYPE_P2SH
+            self._string = Base58.encode_check(bytes([verbyte]) + self.hash160)
+        return self._string
+
+    def to_cashaddr(self):
+        '''Converts to a cashaddr string, without prefix.'''
+        self._check_net()
+        if self._cashaddr is None:
+            if self.kind == self.ADDR_P2PKH:
+                kind = cashaddr.PUBKEY_TYPE
+            else:
+                kind = cashaddr.SCRIPT_TYPE
+            self._cashaddr = cashaddr.encode(Net.CASHADDR_PREFIX, kind, self.hash160)
+        return self._cashaddr
 
     def to_script(self):
         '''Return a binary script to pay to the address.'''
@@ -394,11 +476,15 @@ class Address(namedtuple("AddressTuple", "hash160 kind")):
 
     def to_scripthash(self):
         '''Returns the hash of the script in binary.'''
-        return sha256(self.to_script())
+        if self._scripthash is None:
+            self._scripthash = sha256(self.to_script())
+        return self._scripthash
 
     def to_scripthash_hex(self):
         '''Like other bitcoin hashes this is reversed when written in hex.'''
-        return hash_to_hex_str(self.to_scripthash())
+        if self._scripthash_hex is None:
+            self._scripthash_hex = hash_to_hex_str(self.to_scripthash())
+        return self._scripthash_hex
 
     def __str__(self):
         return self.to_string()
@@ -515,6 +601,14 @@ class Base58(object):
     chars = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
     assert len(chars) == 58
     cmap = {c: n for n, c in enumerate(chars)}
+    # Encoding produces two digits at a time, halving the big integer steps
+    pairs = [a + b for a, b in itertools.product(chars, repeat=2)]
+    # Decoding translates ASCII to digit values; 255 for invalid characters
+    byte_values = bytearray(b'\xff' * 256)
+    for n, c in enumerate(chars):
+        byte_values[ord(c)] = n
+    byte_values = bytes(byte_values)
+    del n, c
 
     @staticmethod
     def char_value(c):
@@ -532,18 +626,20 @@ class Base58(object):
         if not txt:
             raise Base58Error('string cannot be empty')
 
+        digits = txt.encode('ascii', 'replace').translate(Base58.byte_values)
+        if max(digits) >= 58:
+            # Raise for the offending character
+            for c in txt:
+                Base58.char_value(c)
+
         value = 0
-        for c in txt:
-            value = value * 58 + Base58.char_value(c)
+        for digit in digits:
+            value = value * 58 + digit
 
         result = int_to_bytes(value)
 
         # Prepend leading zero bytes if necessary
-        count = 0
-        for c in txt:
-            if c != '1':
-                break
-            count += 1
+        count = len(txt) - len(txt.lstrip('1'))
         if count:
             result = bytes(count) + result
 
@@ -554,17 +650,28 @@ class Base58(object):
         """Converts a big-endian bytearray into a base58 string."""
         value = bytes_to_int(be_bytes)
 
-        txt = ''
+        pairs = Base58.pairs
+        parts = []
         while value:
-            value, mod = divmod(value, 58)
-            txt += Base58.chars[mod]
+            value, mod = divmod(value, 3364)
+            parts.append(pairs[mod])
+        parts.reverse()
+        txt = ''.join(parts).lstrip('1')
 
-        for byte in be_bytes:
-            if byte != 0:
-                break
-            txt += '1'
+        count = len(be_bytes) - len(be_bytes.lstrip(b'\0'))
+        return '1' * count + txt
 
-        return txt[::-1]
+    @staticmethod
+    def decode_many(txts):
+        '''Decode each string in txts; returns a list of bytes.'''
+        decode = Base58.decode
+        return [decode(txt) for txt in txts]
+
+    @staticmethod
+    def encode_many(items):
+        '''Encode each bytes object in items; returns a list of strings.'''
+        encode = Base58.encode
+        return [encode(item) for item in items]
 
     @staticmethod
     def decode_check(txt):
@@ -582,3 +689,15 @@ class Base58(object):
         into a Base58Check string."""
         be_bytes = payload + sha256d(payload)[:4]
         return Base58.encode(be_bytes)
+
+    @staticmethod
+    def decode_check_many(txts):
+        '''Like decode_check() for each string in txts; returns a list.'''
+        decode_check = Base58.decode_check
+        return [decode_check(txt) for txt in txts]
+
+    @staticmethod
+    def encode_check_many(payloads):
+        '''Like encode_check() for each payload; returns a list of strings.'''
+        encode_check = Base58.encode_check
+        return [encode_check(payload) for payload in payloads]
@@ -38,7 +38,6 @@ import threading
 
 from bitcoinx import Headers
 
-from .dnssec import resolve_openalias
 from .logs import logs
 from .networks import Net
 
@@ -97,6 +96,7 @@ class AppStateProxy(object):
         if alias:
             alias = str(alias)
             def f():
+                from .dnssec import resolve_openalias
                 self.alias_info = resolve_openalias(alias)
                 self.alias_resolved()
             t = threading.Thread(target=f)
@@ -192,6 +192,10 @@ assert len(__b58chars) == 58
 __b43chars = b'0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ$*+-./:'
 assert len(__b43chars) == 43
 
+# Character to digit value maps for decoding
+__b58values = {c: n for n, c in enumerate(__b58chars)}
+__b43values = {c: n for n, c in enumerate(__b43chars)}
+
 
 def base_encode(v, base):
     """ encode v, which is a string of bytes, to base58."""
@@ -200,23 +204,15 @@ def base_encode(v, base):
     chars = __b58chars
     if base == 43:
         chars = __b43chars
-    long_value = 0
-    for (i, c) in enumerate(v[::-1]):
-        long_value += (256**i) * c
+    long_value = int.from_bytes(v, 'big')
     result = bytearray()
     while long_value >= base:
-        div, mod = divmod(long_value, base)
+        long_value, mod = divmod(long_value, base)
         result.append(chars[mod])
-        long_value = div
     result.append(chars[long_value])
     # Bitcoin does a little leading-zero-compression:
     # leading 0-bytes in the input become leading-1s
-    nPad = 0
-    for c in v:
-        if c == 0x00:
-            nPad += 1
-        else:
-            break
+    nPad = len(v) - len(bytes(v).lstrip(b'\x00'))
     result.extend([chars[0]] * nPad)
     result.reverse()
     return result.decode('ascii')
@@ -227,29 +223,21 @@ def base_decode(v, length, base):
     # assert_bytes(v)
     v = to_bytes(v, 'ascii')
     assert base in (58, 43)
-    chars = __b58chars
+    chars, values = __b58chars, __b58values
     if base == 43:
-        chars = __b43chars
+        chars, values = __b43chars, __b43values
     long_value = 0
-    for (i, c) in enumerate(v[::-1]):
-        long_value += chars.find(bytes([c])) * (base**i)
-    result = bytearray()
-    while long_value >= 256:
-        div, mod = divmod(long_value, 256)
-        result.append(mod)
-        long_value = div
-    result.append(long_value)
-    nPad = 0
     for c in v:
-        if c == chars[0]:
-            nPad += 1
-        else:
-            break
-    result.extend(b'\x00' * nPad)
+        # Unknown characters count as -1, as they always have
+        long_value = long_value * base + values.get(c, -1)
+    if long_value < 0:
+        raise ValueError('invalid base {} string'.format(base))
+    nPad = len(v) - len(v.lstrip(chars[:1]))
+    result = b'\x00' * nPad + long_value.to_bytes(
+        max(1, (long_value.bit_length() + 7) // 8), 'big')
     if length is not None and len(result) != length:
         return None
-    result.reverse()
-    return bytes(result)
+    return result
 
 
 def EncodeBase58Check(vchIn):
@@ -21,6 +21,11 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import array
+from collections import namedtuple, OrderedDict
+import struct
+import threading
+
 from bitcoinx import Chain, MissingHeader, hash_to_hex_str
 
 from .app_state import app_state
@@ -28,6 +33,12 @@ from .crypto import sha256d
 
 
 HEADER_SIZE = 80 # bytes
+# Heights read into the header index at a time, and how many such segments it keeps
+SEGMENT_SIZE = 2016
+MAX_SEGMENTS = 64
+
+HeaderInfo = namedtuple('HeaderInfo', 'hash merkle_root timestamp')
+_Segment = namedtuple('_Segment', 'first end hashes merkle_roots timestamps')
 
 
 # Called by network.py:Network._validate_checkpoint_result()
@@ -44,6 +55,103 @@ def root_from_proof(hash_, branch, index):
     return hash_
 
 
+class HeaderIndex(object):
+    '''The hash, merkle root and timestamp of the headers of chains by height.
+
+    Headers are read from the memory-mapped headers file a segment of SEGMENT_SIZE
+    heights at a time into flat arrays, so that looking up many heights neither
+    deserializes a header for each nor allocates a Header object.  A segment read
+    before headers were added to the tip of its chain is read again when a later height
+    is asked for; headers set before the checkpoint must be passed to invalidate().
+    Segments are kept per chain, so a reorganisation reads the new chain's headers.
+    Thread-safe.
+    '''
+
+    def __init__(self, headers, max_segments=MAX_SEGMENTS):
+        self.headers = headers
+        self.max_segments = max_segments
+        self._lock = threading.Lock()
+        # (chain, first height) => _Segment, least recently used first
+        self._segments = OrderedDict()
+
+    def _read_segment(self, chain, first):
+        end = min(first + SEGMENT_SIZE, chain.height + 1)
+        count = end - first
+        hashes = bytearray(32 * count)
+        merkle_roots = bytearray(32 * count)
+        # A timestamp of zero marks a missing header
+        timestamps = array.array('I', bytes(4 * count))
+        raw_header_at_height = self.headers.raw_header_at_height
+        header_hash = self.headers.coin.header_hash
+        unpack_timestamp = struct.Struct('<I').unpack_from
+        for n in range(count):
+            try:
+                raw_header = raw_header_at_height(chain, first + n)
+            except MissingHeader:
+                continue
+            hashes[n * 32: n * 32 + 32] = header_hash(raw_header)
+            merkle_roots[n * 32: n * 32 + 32] = raw_header[36:68]
+            timestamps[n] = unpack_timestamp(raw_header, 68)[0]
+        return _Segment(first, end, hashes, merkle_roots, timestamps)
+
+    def _segment(self, chain, height):
+        if not 0 <= height <= chain.height:
+            raise MissingHeader(f'no header at height {height}')
+        key = (chain, height - height % SEGMENT_SIZE)
+        with self._lock:
+            segment = self._segments.get(key)
+            if segment is not None and height < segment.end:
+                self._segments.move_to_end(key)
+                return segment
+        segment = self._read_segment(*key)
+        with self._lock:
+            self._segments[key] = segment
+            self._segments.move_to_end(key)
+            while len(self._segments) > self.max_segments:
+                self._segments.popitem(last=False)
+        return segment
+
+    @staticmethod
+    def _info(segment, height):
+        n = height - segment.first
+        timestamp = segment.timestamps[n]
+        if not timestamp:
+            return None
+        return HeaderInfo(bytes(segment.hashes[n * 32: n * 32 + 32]),
+                          bytes(segment.merkle_roots[n * 32: n * 32 + 32]), timestamp)
+
+    def lookup(self, chain, height):
+        '''The HeaderInfo of the header at height on chain.  Raises MissingHeader.'''
+        info = self._info(self._segment(chain, height), height)
+        if info is None:
+            raise MissingHeader(f'no header at height {height}')
+        return info
+
+    def lookup_many(self, chain, heights):
+        '''A list of the HeaderInfo of the header at each height on chain, with None for
+        heights without a header.'''
+        result = []
+        segment = None
+        for height in heights:
+            if segment is None or not segment.first <= height < segment.end:
+                try:
+                    segment = self._segment(chain, height)
+                except MissingHeader:
+                    result.append(None)
+                    continue
+            result.append(self._info(segment, height))
+        return result
+
+    def invalidate(self, start_height, end_height):
+        '''Forget what is known of the heights in [start_height, end_height) on every
+        chain.'''
+        with self._lock:
+            for key in list(self._segments):
+                first = key[1]
+                if first < end_height and start_height < first + SEGMENT_SIZE:
+                    del self._segments[key]
+
+
 class Blockchain:
     """
     Manages blockchain headers and their verification
@@ -51,6 +159,7 @@ class Blockchain:
 
     blockchains = []
     needs_checkpoint_headers = True
+    _header_index = None
 
     def __init__(self, chain):
         self.chain = chain
@@ -127,6 +236,25 @@ class Blockchain:
     def header_at_height(self, height):
         return app_state.headers.header_at_height(self.chain, height)
 
+    @classmethod
+    def header_index(cls):
+        '''The HeaderIndex of the application's headers.'''
+        index = cls._header_index
+        if index is None or index.headers is not app_state.headers:
+            index = cls._header_index = HeaderIndex(app_state.headers)
+        return index
+
+    # Called by verifier.py:SPV.verify_merkle()
+    def header_info_at_height(self, height):
+        '''The HeaderInfo of the header at height.  Raises MissingHeader.'''
+        return self.header_index().lookup(self.chain, height)
+
+    # Called by verifier.py:SPV.run()
+    def headers_at_heights(self, heights):
+        '''A list of the HeaderInfo of the header at each height, with None for heights
+        without a header.'''
+        return self.header_index().lookup_many(self.chain, heights)
+
     def common_height(self, other_blockchain):
         chain, height = self.chain.common_chain_and_height(other_blockchain.chain)
         return height
@@ -139,6 +267,7 @@ class Blockchain:
         if height < checkpoint.height:
             assert proof_was_provided
             headers_obj.set_one(height, raw_header)
+            cls.header_index().invalidate(height, height + 1)
             return headers_obj.coin.deserialized_header(raw_header), cls.longest()
         else:
             header, chain = app_state.headers.connect(raw_header)
@@ -175,10 +304,12 @@ class Blockchain:
             last_header = extract_header(end_height - 1)
             headers_obj.set_one(end_height - 1, last_header)
             verify_chunk_contiguous_and_set(last_header, end_height - 1)
+            cls.header_index().invalidate(start_height, end_height)
             return cls.longest()
 
         # For chunks prior to but connecting to the checkpoint, no proof is required
         verify_chunk_contiguous_and_set(checkpoint.raw_header, checkpoint.height)
+        cls.header_index().invalidate(start_height, checkpoint.height)
 
         # Process any remaining headers forwards from the checkpoint
         chain = None
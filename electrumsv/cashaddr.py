@@ -19,26 +19,33 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+from functools import lru_cache
+
 _CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+# Maps 5-bit values to charset bytes, and charset characters to 5-bit values.
+# Other characters below 256 map to 255; those above become '?' when encoded.
+_ENCODE_TABLE = bytes(_CHARSET.encode()[n & 31] for n in range(256))
+_DECODE_TABLE = dict.fromkeys(range(256), 255)
+_DECODE_TABLE.update((ord(c), n) for n, c in enumerate(_CHARSET))
+
+_GENERATORS = (0x98f2bc8e61, 0x79b76d99e2, 0xf33e5fb3c4, 0xae2eabe2a8, 0x1e4f43e470)
+# The XOR of the generators selected by each value of the top 5 bits
+_GENERATOR_TABLE = tuple(
+    _GENERATORS[0] * (n & 1) ^ _GENERATORS[1] * ((n >> 1) & 1)
+    ^ _GENERATORS[2] * ((n >> 2) & 1) ^ _GENERATORS[3] * ((n >> 3) & 1)
+    ^ _GENERATORS[4] * ((n >> 4) & 1)
+    for n in range(32))
+
+def _polymod_state(values, c=1):
+    """Feed values into the checksum state c and return the new state."""
+    table = _GENERATOR_TABLE
+    for d in values:
+        c = ((c & 0x07ffffffff) << 5) ^ d ^ table[c >> 35]
+    return c
 
 def _polymod(values):
     """Internal function that computes the cashaddr checksum."""
-    c = 1
-    for d in values:
-        c0 = c >> 35
-        c = ((c & 0x07ffffffff) << 5) ^ d
-        if c0 & 0x01:
-            c ^= 0x98f2bc8e61
-        if c0 & 0x02:
-            c ^= 0x79b76d99e2
-        if c0 & 0x04:
-            c ^= 0xf33e5fb3c4
-        if c0 & 0x08:
-            c ^= 0xae2eabe2a8
-        if c0 & 0x10:
-            c ^= 0x1e4f43e470
-    retval= c ^ 1
-    return retval
+    return _polymod_state(values) ^ 1
 
 def _prefix_expand(prefix):
     """Expand the prefix into values for checksum computation."""
@@ -47,31 +54,38 @@ def _prefix_expand(prefix):
     retval.append(0)
     return retval
 
+@lru_cache()
+def _prefix_state(prefix):
+    """The checksum state after the expanded prefix; it is the same for every
+    address with that prefix."""
+    return _polymod_state(_prefix_expand(prefix))
+
 def _create_checksum(prefix, data):
     """Compute the checksum values given prefix and data."""
-    values = _prefix_expand(prefix) + data + bytes(8)
-    polymod = _polymod(values)
+    polymod = _polymod_state(data + bytes(8), _prefix_state(prefix)) ^ 1
     # Return the polymod expanded into eight 5-bit elements
     return bytes((polymod >> 5 * (7 - i)) & 31 for i in range(8))
 
 def _convertbits(data, frombits, tobits, pad=True):
     """General power-of-2 base conversion."""
-    acc = 0
-    bits = 0
-    ret = bytearray()
+    if frombits == 8:
+        acc = int.from_bytes(data, 'big')
+    else:
+        acc = 0
+        for value in data:
+            acc = (acc << frombits) | value
+    count, bits = divmod(len(data) * frombits, tobits)
+    if bits:
+        if pad:
+            acc <<= tobits - bits
+            count += 1
+        else:
+            acc >>= bits
+    if tobits == 8:
+        return bytearray(acc.to_bytes(count, 'big'))
     maxv = (1 << tobits) - 1
-    max_acc = (1 << (frombits + tobits - 1)) - 1
-    for value in data:
-        acc = ((acc << frombits) | value ) & max_acc
-        bits += frombits
-        while bits >= tobits:
-            bits -= tobits
-            ret.append((acc >> bits) & maxv)
-
-    if pad and bits:
-        ret.append((acc << (tobits - bits)) & maxv)
-
-    return ret
+    return bytearray((acc >> shift) & maxv
+                     for shift in range((count - 1) * tobits, -1, -tobits))
 
 def _pack_addr_data(kind, addr_hash):
     """Pack addr data with version byte"""
@@ -121,13 +135,12 @@ def _decode_payload(addr):
     if not 8 <= len(payload) <= 124:
         raise ValueError('address payload has invalid length: {}'
                          .format(len(addr)))
-    try:
-        data = bytes(_CHARSET.find(x) for x in payload)
-    except ValueError:
+    data = payload.translate(_DECODE_TABLE).encode('latin-1', 'replace')
+    if max(data) > 31:
         raise ValueError('invalid characters in address: {}'
                             .format(payload))
 
-    if _polymod(_prefix_expand(prefix) + data):
+    if _polymod_state(data, _prefix_state(prefix)) ^ 1:
         raise ValueError('invalid checksum in address: {}'.format(addr))
 
     if lower != addr:
@@ -193,9 +206,21 @@ def encode(prefix, kind, addr_hash):
 
     payload = _pack_addr_data(kind, addr_hash)
     checksum = _create_checksum(prefix, payload)
-    return ''.join([ _CHARSET[d] for d in payload + checksum ])
+    return bytes(payload + checksum).translate(_ENCODE_TABLE).decode()
 
 
 def encode_full(prefix, kind, addr_hash):
     """Encode a full cashaddr address, with prefix and separator."""
     return ':'.join([prefix, encode(prefix, kind, addr_hash)])
+
+
+def decode_many(addresses):
+    """Decode each of a list of cashaddr addresses; returns a list of
+    (prefix, kind, hash) triples."""
+    return [decode(address) for address in addresses]
+
+
+def encode_many(prefix, items):
+    """Encode each (kind, addr_hash) pair in items with the given prefix,
+    without prefix and separator; returns a list of strings."""
+    return [encode(prefix, kind, addr_hash) for kind, addr_hash in items]
@@ -30,15 +30,18 @@ import datetime
 from decimal import Decimal
 from functools import wraps
 import json
+import os
 import sys
 
 from . import bitcoin
 from . import ecc
 from .address import Address
+from .app_state import app_state
 from .bitcoin import COIN, TYPE_ADDRESS
 from .crypto import hash_160
 from .i18n import _
 from .logs import logs
+from .metrics import metrics
 from .paymentrequest import PR_PAID, PR_UNPAID, PR_UNKNOWN, PR_EXPIRED
 from .transaction import Transaction, multisig_script
 from .util import bfh, bh2u, format_satoshis, json_decode, to_bytes
@@ -60,6 +63,8 @@ class Command:
         self.requires_network = 'n' in s
         self.requires_wallet = 'w' in s
         self.requires_password = 'p' in s
+        # Read-only commands do not change wallet state and may run concurrently
+        self.read_only = 'r' in s
         self.description = func.__doc__
         self.help = self.description.split('.')[0] if self.description else None
         varnames = func.__code__.co_varnames[1:func.__code__.co_argcount]
@@ -147,7 +152,7 @@ class Commands:
                 if hasattr(nt, 'to_string'): return nt.to_string()
                 return nt
 
-            if isinstance(v, tuple): v = EncodeNamedTupleObject(v)
+            if isinstance(v, (tuple, Address)): v = EncodeNamedTupleObject(v)
             elif isinstance(v, list): v = ChkList(v) # may recurse
             elif isinstance(v, dict): v = Commands._EnsureDictNamedTuplesAreJSONSafe(v) # recurse
             return v
@@ -171,7 +176,8 @@ class Commands:
         """Restore a wallet from text. Text can be a seed phrase, a master
         public key, a master private key, a list of bitcoin cash addresses
         or bitcoin cash private keys. If you want to be prompted for your
-        seed, type '?' or ':' (concealed) """
+        seed, type '?' or ':' (concealed). For a BIP39 seed phrase the first
+        account with history is restored."""
         raise Exception('Not a JSON-RPC command')
 
     @command('wp')
@@ -182,6 +188,22 @@ class Commands:
         self.wallet.storage.write()
         return {'password':self.wallet.has_password()}
 
+    @command('wp')
+    def unlockwallet(self, timeout=None, password=None):
+        """Keep the decrypted wallet keys in memory for a time, so that signing with the
+        same password is faster. The timeout in seconds defaults to the
+        signing_session_timeout config variable, or 300."""
+        if timeout is None:
+            timeout = self.config.get('signing_session_timeout', 300)
+        self.wallet.unlock_keystores(password, float(timeout))
+        return True
+
+    @command('w')
+    def lockwallet(self):
+        """Clear decrypted wallet keys kept in memory by unlockwallet."""
+        self.wallet.lock_keystores()
+        return True
+
     @command('')
     def getconfig(self, key):
         """Return a configuration variable. """
@@ -212,7 +234,7 @@ class Commands:
         s = Mnemonic(language).make_seed(t, nbits)
         return s
 
-    @command('n')
+    @command('nr')
     def getaddresshistory(self, address):
         """Return the transaction history of any address. Note: This is a
         walletless server query, results are not checked by SPV.
@@ -220,7 +242,18 @@ class Commands:
         sh = Address.from_string(address).to_scripthash_hex()
         return self.network.synchronous_get(('blockchain.scripthash.get_history', [sh]))
 
-    @command('w')
+    @command('nr')
+    def getaddresshistories(self, addresses):
+        """Return the transaction histories of a list of addresses, requested from
+        the server together. Note: This is a walletless server query, results are
+        not checked by SPV.
+        """
+        hashes = [Address.from_string(address).to_scripthash_hex() for address in addresses]
+        results = self.network.synchronous_get_many(
+            [('blockchain.scripthash.get_history', [sh]) for sh in hashes])
+        return dict(zip(addresses, results))
+
+    @command('wr')
     def listunspent(self):
         """List unspent outputs. Returns the list of unspent transaction
         outputs in your wallet."""
@@ -231,7 +264,7 @@ class Commands:
             i["address"] = i["address"].to_string()
         return l
 
-    @command('n')
+    @command('nr')
     def getaddressunspent(self, address):
         """Returns the UTXO list of any address. Note: This
         is a walletless server query, results are not checked by SPV.
@@ -329,7 +362,7 @@ class Commands:
         else:
             return [get_pk(addr) for addr in address]
 
-    @command('w')
+    @command('wr')
     def ismine(self, address):
         """Check if address is in wallet. Return true if and only address is in wallet"""
         address = Address.from_string(address)
@@ -341,18 +374,18 @@ class Commands:
         return ("This command is deprecated. Use a pipe instead: "
                 "'electrum-sv listaddresses | electrum-sv getprivatekeys - '")
 
-    @command('')
+    @command('r')
     def validateaddress(self, address):
         """Check that an address is valid. """
         return Address.is_valid(address)
 
-    @command('w')
+    @command('wr')
     def getpubkeys(self, address):
         """Return the public keys for a wallet address. """
         address = Address.from_string(address)
         return self.wallet.get_public_keys(address)
 
-    @command('w')
+    @command('wr')
     def getbalance(self):
         """Return the balance of your wallet. """
         c, u, x = self.wallet.get_balance()
@@ -363,7 +396,7 @@ class Commands:
             out["unmatured"] = str(Decimal(x)/COIN)
         return out
 
-    @command('n')
+    @command('nr')
     def getaddressbalance(self, address):
         """Return the balance of any address. Note: This is a walletless
         server query, results are not checked by SPV.
@@ -374,7 +407,24 @@ class Commands:
         out["unconfirmed"] =  str(Decimal(out["unconfirmed"])/COIN)
         return out
 
-    @command('n')
+    @command('nr')
+    def getaddressbalances(self, addresses):
+        """Return the balances of a list of addresses, requested from the server
+        together. Note: This is a walletless server query, results are not
+        checked by SPV.
+        """
+        hashes = [Address.from_string(address).to_scripthash_hex() for address in addresses]
+        results = self.network.synchronous_get_many(
+            [('blockchain.scripthash.get_balance', [sh]) for sh in hashes])
+        out = {}
+        for address, result in zip(addresses, results):
+            out[address] = {
+                "confirmed": str(Decimal(result["confirmed"])/COIN),
+                "unconfirmed": str(Decimal(result["unconfirmed"])/COIN),
+            }
+        return out
+
+    @command('nr')
     def getmerkle(self, txid, height):
         """Get Merkle branch of a transaction included in a block. Electrum
         uses this to verify transactions (Simple Payment Verification)."""
@@ -392,7 +442,7 @@ class Commands:
         from .version import PACKAGE_VERSION
         return PACKAGE_VERSION
 
-    @command('w')
+    @command('wr')
     def getmpk(self):
         """Get master public key. Return your wallet\'s master public key"""
         return self.wallet.get_master_public_key()
@@ -500,9 +550,12 @@ class Commands:
                         password, locktime)
         return tx.as_dict()
 
-    @command('w')
-    def history(self, year=None, show_addresses=False, show_fiat=False):
-        """Wallet history. Returns the transaction history of your wallet."""
+    @command('wr')
+    def history(self, year=None, show_addresses=False, show_fiat=False, output=None,
+                output_format='json'):
+        """Wallet history. Returns the transaction history of your wallet. With
+        --output the history is written to that file as it is produced and a
+        summary is returned instead."""
         kwargs = {'show_addresses': show_addresses}
         if year:
             import time
@@ -513,7 +566,18 @@ class Commands:
         if show_fiat:
             from .exchange_rate import FxThread
             FxThread(self.config, None)
-        return self.wallet.export_history(**kwargs)
+        if output is None:
+            return self.wallet.export_history(**kwargs)
+        from .history_export import FORMATS, write_history
+        if output_format not in FORMATS:
+            raise Exception('output format must be one of: ' + ', '.join(FORMATS))
+        # Relative to the directory the command was run in, like wallet paths
+        output = os.path.join(self.config.get('cwd') or os.getcwd(),
+                              os.path.expanduser(output))
+        with open(output, 'w') as f:
+            count = write_history(self.wallet.iter_export_history(**kwargs), f,
+                                  output_format, show_addresses, show_fiat)
+        return {'path': output, 'format': output_format, 'transactions': count}
 
     @command('w')
     def setlabel(self, key, label):
@@ -521,7 +585,7 @@ class Commands:
         transaction ID"""
         self.wallet.set_label(key, label)
 
-    @command('w')
+    @command('wr')
     def listcontacts(self):
         """Show your list of contacts"""
         return self.wallet.contacts
@@ -531,7 +595,7 @@ class Commands:
         """Retrieve alias. Lookup in your list of contacts, and for an OpenAlias DNS record."""
         return self.wallet.contacts.resolve(key)
 
-    @command('w')
+    @command('wr')
     def searchcontacts(self, query):
         """Search through contacts, return matching entries. """
         results = {}
@@ -540,7 +604,7 @@ class Commands:
                 results[key] = value
         return results
 
-    @command('w')
+    @command('wr')
     def listaddresses(self, receiving=False, change=False, labels=False, frozen=False,
                       unused=False, funded=False, balance=False):
         """List wallet addresses. Returns the list of all addresses in your wallet. Use optional
@@ -568,7 +632,7 @@ class Commands:
             out.append(item)
         return out
 
-    @command('n')
+    @command('nr')
     def gettransaction(self, txid):
         """Retrieve a transaction. """
         if self.wallet and txid in self.wallet.transactions:
@@ -581,6 +645,25 @@ class Commands:
                 raise Exception("Unknown transaction")
         return tx.as_dict()
 
+    @command('nr')
+    def gettransactions(self, txids):
+        """Retrieve a list of transactions.  Those not in the wallet are requested
+        from the server together."""
+        txs = {}
+        if self.wallet:
+            for txid in txids:
+                tx = self.wallet.transactions.get(txid)
+                if tx is not None:
+                    txs[txid] = tx
+        missing = [txid for txid in txids if txid not in txs]
+        raws = self.network.synchronous_get_many(
+            [('blockchain.transaction.get', [txid]) for txid in missing])
+        for txid, raw in zip(missing, raws):
+            if not raw:
+                raise Exception("Unknown transaction", txid)
+            txs[txid] = Transaction(raw)
+        return [txs[txid].as_dict() for txid in txids]
+
     @command('')
     def encrypt(self, pubkey, message):
         """Encrypt a message with a public key. Use quotes if the message contains whitespaces."""
@@ -605,7 +688,7 @@ class Commands:
         out['status'] = pr_str[out.get('status', PR_UNKNOWN)]
         return out
 
-    @command('w')
+    @command('wr')
     def getrequest(self, key):
         """Return a payment request"""
         r = self.wallet.get_payment_request(Address.from_string(key), self.config)
@@ -613,7 +696,7 @@ class Commands:
             raise Exception("Request not found")
         return self._format_request(r)
 
-    @command('w')
+    @command('wr')
     def listrequests(self, pending=False, expired=False, paid=False):
         """List the payment requests you made."""
         out = self.wallet.get_sorted_requests(self.config)
@@ -685,26 +768,31 @@ class Commands:
     @command('n')
     def notify(self, address, URL):
         """Watch an address. Everytime the address changes, a http POST is sent to the URL."""
+        webhooks = app_state.daemon.webhooks
         def callback(x):
-            import urllib.request
-            headers = {'content-type':'application/json'}
-            data = {'address':address, 'status':x.get('result')}
-            serialized_data = to_bytes(json.dumps(data))
-            try:
-                req = urllib.request.Request(URL, serialized_data, headers)
-                response_stream = urllib.request.urlopen(req, timeout=5)
-                logger.debug('Got Response for %s', address)
-            except Exception as e:
-                logger.error("exception processing response %s", e)
+            # Runs on the network thread; delivery happens on the webhook workers
+            webhooks.post(URL, {'address':address, 'status':x.get('result')})
         h = Address.from_string(address).to_scripthash_hex()
         self.network.send([('blockchain.scripthash.subscribe', [h])], callback)
         return True
 
-    @command('wn')
+    @command('wnr')
     def is_synchronized(self):
         """ return wallet synchronization status """
         return self.wallet.is_up_to_date()
 
+    @command('wr')
+    def getloadreport(self):
+        """Time taken by each step of loading the wallet, in seconds."""
+        return self.wallet.get_load_report()
+
+    @command('')
+    def getmetrics(self, prometheus=False):
+        """Request counts, queue sizes and timings of the daemon."""
+        if prometheus:
+            return metrics.to_prometheus()
+        return metrics.to_json()
+
     @command('n')
     def getfeerate(self):
         """Return current optimal fee rate per kilobyte, according
@@ -722,6 +810,8 @@ param_descriptions = {
     'address': 'Bitcoin SV address',
     'seed': 'Seed phrase',
     'txid': 'Transaction ID',
+    'txids': 'list of transaction IDs',
+    'addresses': 'list of Bitcoin SV addresses',
     'pos': 'Position',
     'height': 'Block height',
     'tx': 'Serialized transaction (hexadecimal)',
@@ -769,6 +859,9 @@ command_options = {
     'show_addresses': (None, "Show input and output addresses"),
     'show_fiat':   (None, "Show fiat value of transactions"),
     'year':        (None, "Show history for a given year"),
+    'output':      (None, "Write the result to this file"),
+    'output_format': (None, "Format of the output file: csv, json or ndjson"),
+    'prometheus':  (None, "Output in the Prometheus text format"),
 }
 
 
@@ -785,9 +878,12 @@ arg_types = {
     'jsontx': json_loads,
     'inputs': json_loads,
     'outputs': json_loads,
+    'addresses': json_loads,
+    'txids': json_loads,
     'fee': lambda x: str(Decimal(x)) if x is not None else None,
     'amount': lambda x: str(Decimal(x)) if x != '!' else '!',
     'locktime': int,
+    'timeout': float,
 }
 
 config_variables = {
@@ -922,6 +1018,9 @@ def get_parser():
         if cmdname == 'restore':
             p.add_argument("-o", "--offline", action="store_true", dest="offline", default=False,
                            help="Run offline")
+            p.add_argument("--accounts", type=int, dest="restore_accounts", default=3,
+                           help="Number of accounts to look for on each derivation path "
+                           "of a BIP39 seed")
         for optname, default in zip(cmd.options, cmd.defaults):
             a, help = command_options[optname]
             b = '--' + optname
@@ -24,7 +24,6 @@
 import json
 
 from .address import Address
-from .dnssec import resolve_openalias
 from .exceptions import FileImportFailed, FileImportFailedEncrypted
 from .logs import logs
 
@@ -89,6 +88,7 @@ class Contacts(dict):
                     'address': addr,
                     'type': 'contact'
                 }
+        from .dnssec import resolve_openalias
         out = resolve_openalias(k)
         if out:
             address, name, validated = out
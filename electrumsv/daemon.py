@@ -24,23 +24,25 @@
 # SOFTWARE.
 
 import ast
+from contextlib import contextmanager
+from functools import partial
 import os
+import threading
 import time
 
 import jsonrpclib
 
 from .app_state import app_state
 from .commands import known_commands, Commands
-from .exchange_rate import FxThread
-from .jsonrpc import VerifyingJSONRPCServer
 from .logs import logs
-from .network import Network
 from .simple_config import SimpleConfig
-from .storage import WalletStorage
-from .util import json_decode, DaemonThread
+from .util import json_decode, DaemonThread, ReadWriteLock
 from .util import to_string
 from .version import PACKAGE_VERSION
-from .wallet import Wallet
+
+# Modules only the daemon process needs, such as the network, wallet and RPC server, are
+# imported where the Daemon uses them so that command line clients of a running daemon
+# start quickly.
 
 
 logger = logs.get_logger("daemon")
@@ -125,6 +127,11 @@ def get_rpc_credentials(config):
 class Daemon(DaemonThread):
 
     def __init__(self, fd, is_gui):
+        from .exchange_rate import FxThread
+        from .metrics import start_http_server
+        from .network import Network
+        from .paymentrequest import preload_ca_store
+        from .webhooks import WebhookDispatcher
         super().__init__('daemon')
         app_state.daemon = self
         config = app_state.config
@@ -134,21 +141,49 @@ class Daemon(DaemonThread):
         else:
             self.network = Network(config)
             self.network.start()
+        # Verifying BIP70 payment requests needs the trusted CA store
+        preload_ca_store()
         fx = FxThread(config, self.network)
         if self.network:
             self.network.add_jobs([fx])
         self.wallets = {}
+        # Delivers the HTTP POSTs of the notify command off the network thread
+        self.webhooks = WebhookDispatcher(os.path.join(config.path, 'webhooks'),
+                                          workers=config.get('webhook_workers', 4))
+        self.webhooks.start()
+        # Optional endpoint serving the metrics in the Prometheus text format
+        self.metrics_server = None
+        metrics_port = config.get('metrics_port')
+        if metrics_port:
+            host = config.get('metrics_host', '127.0.0.1')
+            try:
+                self.metrics_server = start_http_server(host, metrics_port)
+            except OSError as e:
+                logger.error('cannot serve metrics on %s:%s %s', host, metrics_port, e)
+        # Wallet path -> ReadWriteLock serialising RPC commands that modify a wallet
+        self.wallet_locks = {}
+        # Records the wallet whose lock a thread executing a batch already holds
+        self._batch_state = threading.local()
         # Setup JSONRPC server
         self.init_server(config, fd, is_gui)
 
     def init_server(self, config, fd, is_gui):
+        from .jsonrpc import VerifyingJSONRPCServer, ThreadedVerifyingJSONRPCServer
         host = config.get('rpchost', '127.0.0.1')
         port = config.get('rpcport', 0)
 
+        # More than one thread selects the threaded server with a worker pool
+        threads = config.get('rpcthreads', 1)
+
         rpc_user, rpc_password = get_rpc_credentials(config)
         try:
-            server = VerifyingJSONRPCServer((host, port), logRequests=False,
-                                            rpc_user=rpc_user, rpc_password=rpc_password)
+            if threads > 1:
+                server = ThreadedVerifyingJSONRPCServer(
+                    (host, port), logRequests=False, rpc_user=rpc_user,
+                    rpc_password=rpc_password, workers=threads)
+            else:
+                server = VerifyingJSONRPCServer((host, port), logRequests=False,
+                                                rpc_user=rpc_user, rpc_password=rpc_password)
         except Exception as e:
             logger.error('Warning: cannot initialize RPC server on host %s %s', host, e)
             self.server = None
@@ -163,12 +198,48 @@ class Daemon(DaemonThread):
         server.register_function(self.run_daemon, 'daemon')
         self.cmd_runner = Commands(self.config, None, self.network)
         for cmdname in known_commands:
-            server.register_function(getattr(self.cmd_runner, cmdname), cmdname)
+            server.register_function(partial(self._run_registered_command, cmdname), cmdname)
         server.register_function(self.run_cmdline, 'run_cmdline')
+        server.batch_context = self._batch_context
 
     def ping(self):
         return True
 
+    def get_wallet_lock(self, wallet):
+        return self.wallet_locks.setdefault(wallet.storage.path, ReadWriteLock())
+
+    @contextmanager
+    def _batch_context(self, methods):
+        '''Hold the loaded wallet's lock for a whole JSON-RPC batch so every call in
+        it sees the same wallet state.'''
+        wallet = self.cmd_runner.wallet
+        # Batches of daemon, gui and run_cmdline calls take wallet locks as needed
+        if wallet is None or not any(method in known_commands for method in methods):
+            yield
+            return
+        read_only = all(method in known_commands and known_commands[method].read_only
+                        for method in methods)
+        lock = self.get_wallet_lock(wallet)
+        with (lock.read_locked() if read_only else lock.write_locked()):
+            self._batch_state.wallet = wallet
+            try:
+                yield
+            finally:
+                self._batch_state.wallet = None
+
+    def _run_command(self, cmd, wallet, func, args, kwargs):
+        '''Run a command holding the wallet's lock; read-only commands share it.'''
+        if wallet is None or wallet is getattr(self._batch_state, 'wallet', None):
+            return func(*args, **kwargs)
+        lock = self.get_wallet_lock(wallet)
+        with (lock.read_locked() if cmd.read_only else lock.write_locked()):
+            return func(*args, **kwargs)
+
+    def _run_registered_command(self, cmdname, *args, **kwargs):
+        cmd_runner = self.cmd_runner
+        func = getattr(cmd_runner, cmdname)
+        return self._run_command(known_commands[cmdname], cmd_runner.wallet, func, args, kwargs)
+
     def run_daemon(self, config_options):
         config = SimpleConfig(config_options)
         sub = config.get('subcommand')
@@ -202,6 +273,8 @@ class Daemon(DaemonThread):
                     'wallets': {k: w.is_up_to_date()
                                 for k, w in self.wallets.items()},
                     'fee_per_kb': self.config.fee_per_kb(),
+                    'rpc': self.server.request_stats.snapshot() if self.server else {},
+                    'webhooks': self.webhooks.get_metrics(),
                 }
             else:
                 response = "Daemon offline"
@@ -221,6 +294,8 @@ class Daemon(DaemonThread):
         return "error: ElectrumSV is running in daemon mode; stop the daemon first."
 
     def load_wallet(self, path, password):
+        from .storage import WalletStorage
+        from .wallet import Wallet
         # wizard will be launched if we return
         if path in self.wallets:
             wallet = self.wallets[path]
@@ -254,7 +329,13 @@ class Daemon(DaemonThread):
         # Issue #659 wallet may already be stopped.
         if path in self.wallets:
             wallet = self.wallets.pop(path)
-            wallet.stop_threads()
+            # A batch closing its own wallet already holds the lock for writing
+            if wallet is getattr(self._batch_state, 'wallet', None):
+                wallet.stop_threads()
+            else:
+                with self.get_wallet_lock(wallet).write_locked():
+                    wallet.stop_threads()
+            self.wallet_locks.pop(path, None)
 
     def run_cmdline(self, config_options):
         password = config_options.get('password')
@@ -281,14 +362,19 @@ class Daemon(DaemonThread):
                          else config.get(x))
         cmd_runner = Commands(config, wallet, self.network)
         func = getattr(cmd_runner, cmd.name)
-        result = func(*args, **kwargs)
-        return result
+        return self._run_command(cmd, wallet, func, args, kwargs)
 
     def run(self):
         while self.is_running():
             self.server.handle_request() if self.server else time.sleep(0.1)
+        if self.server:
+            self.server.server_close()
         for k, wallet in self.wallets.items():
             wallet.stop_threads()
+        self.webhooks.stop()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
         if self.network:
             logger.debug("shutting down network")
             self.network.stop()
@@ -0,0 +1,136 @@
+# Electrum SV - lightweight Bitcoin SV client
+# Copyright (C) 2019 The Electrum SV Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Coalescing wallet change notifications.
+
+The wallet records what changed (transactions, addresses and the heights of
+verified transactions) as it happens, and the bus hands the accumulated
+changes to subscribers as a single WalletDelta once per interval.  This lets
+consumers such as the GUI refresh only what changed, at most once per
+interval, rather than rebuilding everything on every network event.
+'''
+
+from collections import namedtuple
+import threading
+import time
+
+from .logs import logs
+from .util import ThreadJob
+
+
+logger = logs.get_logger("events")
+
+DEFAULT_EVENT_INTERVAL = 0.5
+
+
+class WalletDelta(namedtuple('WalletDelta', 'wallet txids addresses heights')):
+    '''The changes made to a wallet over one coalescing interval.
+
+    txids     --- frozenset of transaction hashes added, removed or re-indexed.
+    addresses --- frozenset of Address objects whose history changed.
+    heights   --- dict mapping tx hash to (height, conf, timestamp) for
+                  transactions whose verification state changed.
+    '''
+
+    def is_verification_only(self):
+        '''True if nothing changed but the verification state of known transactions.'''
+        return not self.txids and not self.addresses
+
+
+class WalletEventBus(ThreadJob):
+    '''Accumulates wallet changes and delivers them to subscribers as one
+    WalletDelta per interval.  The note_* methods can be called from any
+    thread; subscribers are called from whichever thread calls run().
+    '''
+
+    def __init__(self, wallet, interval=DEFAULT_EVENT_INTERVAL, clock=time.monotonic):
+        self.wallet = wallet
+        self.interval = interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._reset()
+
+    def _reset(self):
+        self._txids = set()
+        self._addresses = set()
+        self._heights = {}
+        self._first_time = None
+
+    def _mark(self):
+        if self._first_time is None:
+            self._first_time = self._clock()
+
+    def subscribe(self, callback):
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def note_transaction(self, tx_hash, addresses=()):
+        with self._lock:
+            self._txids.add(tx_hash)
+            self._addresses.update(addresses)
+            self._mark()
+
+    def note_address(self, address):
+        with self._lock:
+            self._addresses.add(address)
+            self._mark()
+
+    def note_height(self, tx_hash, height, conf, timestamp):
+        with self._lock:
+            self._heights[tx_hash] = (height, conf, timestamp)
+            self._mark()
+
+    def has_pending(self):
+        with self._lock:
+            return self._first_time is not None
+
+    def flush(self, force=False):
+        '''Deliver any pending changes if the interval has elapsed since the
+        first of them was noted, or immediately if force is set.  Returns the
+        delivered delta or None.'''
+        with self._lock:
+            if self._first_time is None:
+                return None
+            if not force and self._clock() - self._first_time < self.interval:
+                return None
+            delta = WalletDelta(self.wallet, frozenset(self._txids),
+                                frozenset(self._addresses), self._heights)
+            self._reset()
+            subscribers = self._subscribers[:]
+        for callback in subscribers:
+            try:
+                callback(delta)
+            except Exception:
+                logger.exception("wallet event subscriber %s failed", callback)
+        return delta
+
+    def run(self):
+        '''Called periodically from the network thread.'''
+        self.flush()
@@ -1,12 +1,14 @@
 from decimal import Decimal
 from threading import Thread
+import array
 import csv
 import datetime
 import decimal
 import inspect
 import json
+import math
 import os
-import requests
+import struct
 import sys
 import time
 
@@ -27,6 +29,138 @@ CCY_PRECISIONS = {'BHD': 3, 'BIF': 0, 'BYR': 0, 'CLF': 4, 'CLP': 0,
                   'RWF': 0, 'TND': 3, 'UGX': 0, 'UYI': 0, 'VND': 0,
                   'VUV': 0, 'XAF': 0, 'XAU': 4, 'XOF': 0, 'XPF': 0}
 
+RATES_MAGIC = b'ESVR'
+RATES_VERSION = 1
+# magic, version, first day number, number of days
+RATES_HEADER = struct.Struct('<4sHII')
+
+# Local day numbers of 15 minute periods.  Time zone offsets and their changes are
+# multiples of 15 minutes, so every moment in a period falls on the same local day.
+_day_numbers = {}
+
+
+def day_number(timestamp):
+    '''The proleptic Gregorian ordinal of the local date of a POSIX timestamp.'''
+    period = int(timestamp) // 900
+    day = _day_numbers.get(period)
+    if day is None:
+        if len(_day_numbers) > 100000:
+            _day_numbers.clear()
+        day = _day_numbers[period] = datetime.date.fromtimestamp(period * 900).toordinal()
+    return day
+
+
+class RateHistory(object):
+    '''The daily rates of an exchange for a currency, in an array indexed by day number
+    from the first day with a rate.  Days without a rate hold NaN.
+
+    The binary cache file is RATES_HEADER followed by the rates as little-endian
+    doubles, so new days can be appended to it without writing the rest.
+    '''
+
+    def __init__(self, first_day=0, rates=()):
+        self.first_day = first_day
+        self.rates = array.array('d', rates)
+
+    def __len__(self):
+        return len(self.rates)
+
+    def rate(self, day):
+        '''The rate as a float on the given day number, or None.'''
+        index = day - self.first_day
+        if 0 <= index < len(self.rates):
+            rate = self.rates[index]
+            if not math.isnan(rate):
+                return rate
+        return None
+
+    def update(self, history):
+        '''Merge a dict mapping 'YYYY-MM-DD' dates to rates, as returned by request_history.
+        Returns the index of the first rate that changed, or len(self) if none did.'''
+        days = {}
+        for date_str, rate in history.items():
+            try:
+                day = datetime.date(int(date_str[:4]), int(date_str[5:7]),
+                                    int(date_str[8:10])).toordinal()
+                rate = float(rate)
+            except (TypeError, ValueError):
+                continue
+            if not math.isnan(rate):
+                days[day] = rate
+        changed_from = len(self.rates)
+        if not days:
+            return changed_from
+        first_day = min(days)
+        if not self.rates:
+            self.first_day = first_day
+        elif first_day < self.first_day:
+            padding = array.array('d', [math.nan]) * (self.first_day - first_day)
+            self.rates = padding + self.rates
+            self.first_day = first_day
+            changed_from = 0
+        rates = self.rates
+        last_index = max(days) - self.first_day
+        if last_index >= len(rates):
+            rates.extend([math.nan] * (last_index + 1 - len(rates)))
+        for day, rate in days.items():
+            index = day - self.first_day
+            if rates[index] != rate:
+                rates[index] = rate
+                changed_from = min(changed_from, index)
+        return changed_from
+
+    @classmethod
+    def load(cls, filename):
+        '''Read a cache file.  Returns None if it is missing or invalid.'''
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) < RATES_HEADER.size:
+            return None
+        magic, version, first_day, count = RATES_HEADER.unpack_from(data)
+        if (magic != RATES_MAGIC or version != RATES_VERSION
+                or len(data) != RATES_HEADER.size + count * 8):
+            return None
+        result = cls(first_day)
+        result.rates.frombytes(data[RATES_HEADER.size:])
+        if sys.byteorder == 'big':
+            result.rates.byteswap()
+        return result
+
+    def save(self, filename, changed_from=0):
+        '''Write the rates to filename.  If it holds the rates before index changed_from
+        only the rest are written.'''
+        header = RATES_HEADER.pack(RATES_MAGIC, RATES_VERSION, self.first_day,
+                                   len(self.rates))
+        tail = self.rates[changed_from:]
+        if sys.byteorder == 'big':
+            tail.byteswap()
+        try:
+            with open(filename, 'r+b') as f:
+                magic, version, first_day, count = RATES_HEADER.unpack(
+                    f.read(RATES_HEADER.size))
+                if ((magic, version, first_day) == (RATES_MAGIC, RATES_VERSION,
+                                                    self.first_day)
+                        and changed_from <= count):
+                    f.seek(RATES_HEADER.size + changed_from * 8)
+                    f.write(tail.tobytes())
+                    f.truncate()
+                    f.seek(0)
+                    f.write(header)
+                    return
+        except (OSError, struct.error):
+            pass
+        rates = array.array('d', self.rates)
+        if sys.byteorder == 'big':
+            rates.byteswap()
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            f.write(header)
+            f.write(rates.tobytes())
+        os.replace(tmp_filename, filename)
+
 
 class ExchangeBase(object):
 
@@ -38,11 +172,13 @@ class ExchangeBase(object):
 
     def get_json(self, site, get_string):
         # APIs must have https
+        import requests
         url = ''.join(['https://', site, get_string])
         response = requests.request('GET', url, headers={'User-Agent' : 'ElectrumSV'}, timeout=10)
         return response.json()
 
     def get_csv(self, site, get_string):
+        import requests
         url = ''.join(['https://', site, get_string])
         response = requests.request('GET', url, headers={'User-Agent' : 'ElectrumSV'})
         reader = csv.DictReader(response.content.decode().split('\n'))
@@ -68,18 +204,27 @@ class ExchangeBase(object):
         t.setDaemon(True)
         t.start()
 
+    def _rates_filename(self, ccy, cache_dir):
+        return os.path.join(cache_dir, self.name() + '_' + ccy + '.rates')
+
     def read_historical_rates(self, ccy, cache_dir):
-        filename = os.path.join(cache_dir, self.name() + '_'+ ccy)
-        if os.path.exists(filename):
+        filename = self._rates_filename(ccy, cache_dir)
+        h = RateHistory.load(filename)
+        if h is not None:
             timestamp = os.stat(filename).st_mtime
-            try:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    h = json.loads(f.read())
-            except:
-                h = None
         else:
-            h = None
-            timestamp = False
+            # Earlier versions cached the rates as JSON
+            filename = os.path.join(cache_dir, self.name() + '_'+ ccy)
+            if os.path.exists(filename):
+                timestamp = os.stat(filename).st_mtime
+                try:
+                    with open(filename, 'r', encoding='utf-8') as f:
+                        h = RateHistory()
+                        h.update(json.loads(f.read()))
+                except:
+                    h = None
+            else:
+                timestamp = False
         if h:
             self.history[ccy] = h
             self.on_history()
@@ -87,18 +232,21 @@ class ExchangeBase(object):
 
     def get_historical_rates_safe(self, ccy, cache_dir):
         h, timestamp = self.read_historical_rates(ccy, cache_dir)
-        if h is None or time.time() - timestamp < 24*3600:
+        if not h or time.time() - timestamp >= 24*3600:
             try:
                 logger.debug("requesting fx history for %s", ccy)
-                h = self.request_history(ccy)
+                history = self.request_history(ccy)
                 logger.debug("received fx history for %s", ccy)
-                self.on_history()
             except Exception:
                 logger.exception("failed fx history")
                 return
-            filename = os.path.join(cache_dir, self.name() + '_' + ccy)
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(json.dumps(h))
+            if h is None:
+                h = RateHistory()
+            changed_from = h.update(history)
+            try:
+                h.save(self._rates_filename(ccy, cache_dir), changed_from)
+            except OSError:
+                logger.exception("cannot write fx history cache")
         self.history[ccy] = h
         self.on_history()
 
@@ -117,7 +265,12 @@ class ExchangeBase(object):
         return []
 
     def historical_rate(self, ccy, d_t):
-        return self.history.get(ccy, {}).get(d_t.strftime('%Y-%m-%d'))
+        return self.day_rate(ccy, d_t.toordinal())
+
+    def day_rate(self, ccy, day):
+        '''The rate of ccy on the given day number, or None.'''
+        history = self.history.get(ccy)
+        return history.rate(day) if history else None
 
     def get_currencies(self):
         rates = self.get_rates('')
@@ -466,14 +619,42 @@ class FxThread(ThreadJob):
             return "%s" % (self.ccy_amount_str(value, True, default_prec))
         return _("No data")
 
-    def history_rate(self, d_t):
-        rate = self.exchange.historical_rate(self.ccy, d_t)
+    def _day_rate(self, day, today):
+        rate = self.exchange.day_rate(self.ccy, day)
         # Frequently there is no rate for today, until tomorrow :)
         # Use spot quotes in that case
-        if rate is None and (datetime.datetime.today().date() - d_t.date()).days <= 2:
+        if rate is None and today - day <= 2:
             rate = self.exchange.quotes.get(self.ccy)
             self.history_used_spot = True
-        return Decimal(rate) if rate is not None else None
+        if rate is None:
+            return None
+        # Rates are stored as floats; their repr is the decimal they were given as
+        return Decimal(repr(rate)) if isinstance(rate, float) else Decimal(rate)
+
+    def history_rate(self, d_t):
+        return self._day_rate(d_t.toordinal(), datetime.date.today().toordinal())
+
+    def rates_for_timestamps(self, timestamps):
+        '''The historical rate as a Decimal at each timestamp, or None where there is
+        none.  Each day's rate is looked up once.'''
+        today = datetime.date.today().toordinal()
+        day_rates = {}
+        result = []
+        for timestamp in timestamps:
+            if timestamp is None:
+                result.append(None)
+                continue
+            day = day_number(timestamp)
+            if day not in day_rates:
+                day_rates[day] = self._day_rate(day, today)
+            result.append(day_rates[day])
+        return result
+
+    def values_for_timestamps(self, amounts, timestamps):
+        '''The fiat value as a Decimal of each amount in satoshis at the matching
+        timestamp, or None where the amount or rate is unknown.'''
+        return [Decimal(amount) / COIN * rate if amount is not None and rate else None
+                for amount, rate in zip(amounts, self.rates_for_timestamps(timestamps))]
 
     def historical_value_str(self, satoshis, d_t):
         rate = self.history_rate(d_t)
@@ -485,6 +666,4 @@ class FxThread(ThreadJob):
             return Decimal(satoshis) / COIN * Decimal(rate)
 
     def timestamp_rate(self, timestamp):
-        from .util import timestamp_to_datetime
-        date = timestamp_to_datetime(timestamp)
-        return self.history_rate(date)
+        return self.rates_for_timestamps([timestamp])[0]
@@ -45,10 +45,8 @@ from . import dialogs
 from .cosigner_pool import CosignerPool
 from .main_window import ElectrumWindow
 from .exception_window import Exception_Hook
-from .installwizard import InstallWizard, GoBack
 from .label_sync import LabelSync
 from .log_window import SVLogWindow, SVLogHandler
-from .network_dialog import NetworkDialog
 from .util import ColorScheme, read_QIcon
 
 
@@ -199,6 +197,7 @@ class SVApplication(QApplication):
             self.net_dialog.show()
             self.net_dialog.raise_()
             return
+        from .network_dialog import NetworkDialog
         self.net_dialog = NetworkDialog(app_state.daemon.network, app_state.config)
         self.net_dialog.show()
 
@@ -215,6 +214,7 @@ class SVApplication(QApplication):
     def _maybe_choose_server(self):
         # Show network dialog if config does not exist
         if app_state.daemon.network and app_state.config.get('auto_connect') is None:
+            from .installwizard import InstallWizard, GoBack
             try:
                 wizard = InstallWizard(None)
                 wizard.init_network(app_state.daemon.network)
@@ -242,6 +242,7 @@ class SVApplication(QApplication):
             try:
                 wallet = app_state.daemon.load_wallet(path, None)
                 if not wallet:
+                    from .installwizard import InstallWizard, GoBack
                     storage = WalletStorage(path, manual_upgrades=True)
                     wizard = InstallWizard(storage)
                     try:
@@ -33,7 +33,6 @@ from PyQt5.QtWidgets import QMenu
 from electrumsv.app_state import app_state
 from electrumsv.i18n import _
 from electrumsv.platform import platform
-from electrumsv.util import timestamp_to_datetime, profiler
 import electrumsv.web as web
 
 from .util import MyTreeWidget, SortableTreeWidgetItem, read_QIcon
@@ -78,7 +77,6 @@ class HistoryList(MyTreeWidget):
         '''Replaced in address_dialog.py'''
         return self.wallet.get_addresses()
 
-    @profiler
     def on_update(self):
         self.wallet = self.parent.wallet
         h = self.wallet.get_history(self.get_domain())
@@ -88,7 +86,12 @@ class HistoryList(MyTreeWidget):
         fx = app_state.fx
         if fx:
             fx.history_used_spot = False
-        for h_item in h:
+        if fx and fx.show_history():
+            rates = fx.rates_for_timestamps([time.time() if conf <= 0 else timestamp
+                                             for _, _, conf, timestamp, _, _ in h])
+        else:
+            rates = None
+        for n, h_item in enumerate(h):
             tx_hash, height, conf, timestamp, value, balance = h_item
             status, status_str = self.wallet.get_tx_status(tx_hash, height, conf, timestamp)
             has_invoice = self.wallet.invoices.paid.get(tx_hash)
@@ -97,11 +100,9 @@ class HistoryList(MyTreeWidget):
             balance_str = self.parent.format_amount(balance, whitespaces=True)
             label = self.wallet.get_label(tx_hash)
             entry = ['', tx_hash, status_str, label, v_str, balance_str]
-            if fx and fx.show_history():
-                date = timestamp_to_datetime(time.time() if conf <= 0 else timestamp)
+            if rates is not None:
                 for amount in [value, balance]:
-                    text = fx.historical_value_str(amount, date)
-                    entry.append(text)
+                    entry.append(fx.value_str(amount, rates[n]))
             item = SortableTreeWidgetItem(entry)
             item.setIcon(0, icon)
             item.setToolTip(0, str(conf) + " confirmation" + ("s" if conf != 1 else ""))
@@ -50,6 +50,7 @@ from electrumsv.app_state import app_state
 from electrumsv.bitcoin import COIN, TYPE_ADDRESS, TYPE_SCRIPT
 import electrumsv.ecc as ecc
 from electrumsv.exceptions import NotEnoughFunds, UserCancelled, ExcessiveFee
+from electrumsv.history_export import write_history
 from electrumsv.i18n import _
 from electrumsv.keystore import Hardware_KeyStore
 from electrumsv.logs import logs
@@ -114,6 +115,7 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin):
     computing_privkeys_signal = pyqtSignal()
     show_privkeys_signal = pyqtSignal()
     history_updated_signal = pyqtSignal()
+    wallet_delta_signal = pyqtSignal(object)
 
     def __init__(self, wallet):
         QMainWindow.__init__(self)
@@ -123,7 +125,6 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin):
         self.wallet = wallet
 
         self.network = app_state.daemon.network
-        self.invoices = wallet.invoices
         self.contacts = wallet.contacts
         self.app = app_state.app
         self.cleaned_up = False
@@ -211,6 +212,7 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin):
         self.payment_request_ok_signal.connect(self.payment_request_ok)
         self.payment_request_error_signal.connect(self.payment_request_error)
         self.notify_transactions_signal.connect(self.notify_transactions)
+        self.wallet_delta_signal.connect(self.on_wallet_delta_qt)
         self.history_list.setFocus(True)
 
         # network callbacks
@@ -230,9 +232,17 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin):
             self.new_fx_quotes_signal.connect(self.on_fx_quotes)
             self.new_fx_history_signal.connect(self.on_fx_history)
 
+        # Same rule as the network callbacks above: a bound method of this class.
+        self.wallet.events.subscribe(self.on_wallet_delta)
+
         self.load_wallet()
         self.app.timer.timeout.connect(self.timer_actions)
 
+    @property
+    def invoices(self):
+        # The wallet loads its invoices in the background
+        return self.wallet.invoices
+
     def on_history(self, b):
         self.new_fx_history_signal.emit()
 
@@ -330,6 +340,19 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin):
         else:
             self.logger.debug("unexpected network message event='%s' args='%s'", event, args)
 
+    def on_wallet_delta(self, delta):
+        # Called from the network thread at most once per coalescing interval
+        self.wallet_delta_signal.emit(delta)
+
+    def on_wallet_delta_qt(self, delta):
+        if delta.is_verification_only():
+            # Only confirmation state changed; touch just the affected rows
+            for tx_hash, (height, conf, timestamp) in delta.heights.items():
+                self.history_list.update_item(tx_hash, height, conf, timestamp)
+            self.update_status()
+        else:
+            self.need_update.set()
+
     def on_network_qt(self, event, args=None):
         # Handle a network message in the GUI thread
         if event == 'status':
@@ -337,7 +360,9 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin):
         elif event == 'banner':
             self.console.showMessage(args[0])
         elif event == 'verified':
-            self.history_list.update_item(*args)
+            # The history list is refreshed from the coalesced wallet delta;
+            # this signal is still consumed by open address dialogs.
+            pass
         elif event == 'fee':
             pass
         else:
@@ -799,6 +824,9 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin):
 
     def timer_actions(self):
         # Note this runs in the GUI thread
+        if not self.network:
+            # Offline there is no network thread to pump the wallet's events
+            self.wallet.events.run()
         if self.need_update.is_set():
             self.need_update.clear()
             self.update_wallet()
@@ -2700,24 +2728,8 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin):
         self.show_message(_("Your wallet history has been successfully exported."))
 
     def do_export_history(self, wallet, fileName, is_csv):
-        history = wallet.export_history()
-        lines = []
-        for item in history:
-            if is_csv:
-                lines.append([item['txid'], item.get('label', ''),
-                              item['confirmations'], item['value'], item['date']])
-            else:
-                lines.append(item)
-
         with open(fileName, "w+") as f:
-            if is_csv:
-                transaction = csv.writer(f, lineterminator='\n')
-                transaction.writerow(["transaction_hash", "label", "confirmations",
-                                      "value", "timestamp"])
-                for line in lines:
-                    transaction.writerow(line)
-            else:
-                f.write(json.dumps(lines, indent=4))
+            write_history(wallet.iter_export_history(), f, 'csv' if is_csv else 'json')
 
     def sweep_key_dialog(self):
         addresses = self.wallet.get_unused_addresses()
@@ -2879,6 +2891,7 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin):
 
     def clean_up(self):
         self.wallet.thread.stop()
+        self.wallet.events.unsubscribe(self.on_wallet_delta)
         if self.network:
             self.network.unregister_callback(self.on_network)
 
@@ -16,12 +16,16 @@ from PyQt5.QtWidgets import (
 from PyQt5.uic import loadUi
 
 from electrumsv.i18n import _
+from electrumsv.metrics import metrics
 from electrumsv.paymentrequest import PR_UNPAID, PR_PAID, PR_EXPIRED
 from electrumsv.util import resource_path
 
 
 dialogs = []
 
+refresh_seconds = metrics.histogram('gui_refresh_seconds', 'Time taken to refresh a list',
+                                    ('list', ))
+
 pr_icons = {
     PR_UNPAID: "unpaid.png",
     PR_PAID: "confirmed.png",
@@ -463,7 +467,7 @@ class MyTreeWidget(QTreeWidget):
             # Now do any pending updates
             if self.editor is None and self.pending_update:
                 self.pending_update = False
-                self.on_update()
+                self._timed_update()
 
     def on_edited(self, item, column, prior):
         '''Called only when the text actually changes'''
@@ -480,7 +484,7 @@ class MyTreeWidget(QTreeWidget):
         else:
             self.setUpdatesEnabled(False)
             scroll_pos_val = self.verticalScrollBar().value() # save previous scroll bar position
-            self.on_update()
+            self._timed_update()
             def restoreScrollBar():
                 self.updateGeometry()
                 self.verticalScrollBar().setValue(scroll_pos_val) # restore scroll bar to previous
@@ -490,6 +494,10 @@ class MyTreeWidget(QTreeWidget):
         if self.current_filter:
             self.filter(self.current_filter)
 
+    def _timed_update(self):
+        with refresh_seconds.labels(type(self).__name__).time():
+            self.on_update()
+
     def on_update(self):
         pass
 
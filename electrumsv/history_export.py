@@ -0,0 +1,112 @@
+# Electrum SV - lightweight Bitcoin SV client
+# Copyright (C) 2019 The Electrum SV Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Writing wallet history exports.
+
+The writers take the items of Abstract_Wallet.iter_export_history() and write
+each to a file object as it arrives, so exporting a large history never holds
+more than a chunk of it.  csv and json give the files the wallet window has
+always written; ndjson writes one JSON object per line, which readers can also
+process a line at a time.
+'''
+
+import csv
+import json
+
+
+# The (item key, column heading) pairs of a CSV export
+CSV_COLUMNS = (
+    ('txid', 'transaction_hash'),
+    ('label', 'label'),
+    ('confirmations', 'confirmations'),
+    ('value', 'value'),
+    ('date', 'timestamp'),
+)
+FIAT_CSV_COLUMNS = (
+    ('fiat_value', 'fiat_value'),
+    ('fiat_balance', 'fiat_balance'),
+)
+ADDRESS_CSV_COLUMNS = (
+    ('input_addresses', 'input_addresses'),
+    ('output_addresses', 'output_addresses'),
+)
+
+FORMATS = ('csv', 'json', 'ndjson')
+
+
+def write_csv(items, f, columns=CSV_COLUMNS):
+    '''Write items as CSV rows with the given columns.  Address lists are
+    written space separated.  Returns the number of items written.'''
+    writer = csv.writer(f, lineterminator='\n')
+    writer.writerow([heading for _, heading in columns])
+    count = 0
+    for item in items:
+        row = []
+        for key, _ in columns:
+            value = item.get(key, '')
+            if isinstance(value, list):
+                value = ' '.join(value)
+            row.append(value)
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def write_json(items, f):
+    '''Write items as a JSON array, laid out as json.dump(items, f, indent=4)
+    would.  Returns the number of items written.'''
+    count = 0
+    for item in items:
+        f.write(',\n' if count else '[\n')
+        f.write('    ' + json.dumps(item, indent=4).replace('\n', '\n    '))
+        count += 1
+    f.write('\n]' if count else '[]')
+    return count
+
+
+def write_ndjson(items, f):
+    '''Write items as JSON objects, one per line.  Returns the number of items
+    written.'''
+    count = 0
+    for item in items:
+        f.write(json.dumps(item))
+        f.write('\n')
+        count += 1
+    return count
+
+
+def write_history(items, f, fmt, show_addresses=False, show_fiat=False):
+    '''Write items to f in fmt, one of FORMATS.  show_addresses and show_fiat
+    add their columns to CSV exports.  Returns the number of items written.'''
+    if fmt == 'csv':
+        columns = list(CSV_COLUMNS)
+        if show_fiat:
+            columns.extend(FIAT_CSV_COLUMNS)
+        if show_addresses:
+            columns.extend(ADDRESS_CSV_COLUMNS)
+        return write_csv(items, f, columns)
+    if fmt == 'json':
+        return write_json(items, f)
+    if fmt == 'ndjson':
+        return write_ndjson(items, f)
+    raise ValueError('unknown history export format: {}'.format(fmt))
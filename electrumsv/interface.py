@@ -24,7 +24,7 @@
 # SOFTWARE.
 
 import os
-import requests
+import queue
 import socket
 import ssl
 import sys
@@ -32,12 +32,25 @@ import threading
 import time
 import traceback
 
-ca_path = requests.certs.where()
-
 from . import pem
 from . import util
 from . import x509
 from .logs import logs
+from .metrics import metrics
+
+
+logger = logs.get_logger("connections")
+
+request_seconds = metrics.histogram('network_request_seconds',
+                                    'Round trip time of requests to servers', ('method', ))
+tls_handshakes = metrics.counter('network_tls_handshakes',
+                                 'TLS handshakes with servers, by whether an earlier '
+                                 'session was resumed', ('resumed', ))
+
+# Seconds to keep the addresses a server's host name resolves to
+DNS_CACHE_SECONDS = 600
+# Most connections being made at once
+MAX_CONNECTION_THREADS = 8
 
 
 def Connection(server, queue, config_path):
@@ -56,13 +69,119 @@ def Connection(server, queue, config_path):
     return c
 
 
+class ConnectionManager(object):
+    """Makes connections to servers on a bounded pool of threads.
+
+    Between connections it keeps what need not be done again: the addresses
+    host names resolve to, SSL contexts loaded with pinned certificates, and
+    each server's TLS session so that reconnecting resumes it instead of
+    doing a full handshake.  After a network outage every server reconnects
+    at once, so this is when it matters most.
+    """
+
+    def __init__(self, config_path, max_threads=MAX_CONNECTION_THREADS):
+        self.config_path = config_path
+        self.max_threads = max_threads
+        self.lock = threading.Lock()
+        self.jobs = queue.Queue()
+        self.threads = 0
+        self.idle = 0
+        # (host, port) -> (expiry time, getaddrinfo() result)
+        self.addresses = {}
+        # (cert_reqs, ca_certs) -> (modification time of ca_certs, SSLContext)
+        self.contexts = {}
+        # server -> (SSLContext, SSLSession)
+        self.sessions = {}
+
+    def connect(self, server, queue):
+        """Like Connection() but made by a pooled thread.  Returns the
+        TcpConnection, which is not itself started."""
+        host, port, protocol = server.rsplit(':', 2)
+        if not protocol in 'st':
+            raise Exception('Unknown protocol: %s' % protocol)
+        connection = TcpConnection(server, queue, self.config_path, self)
+        with self.lock:
+            if not self.idle and self.threads < self.max_threads:
+                self.threads += 1
+                threading.Thread(target=self._work, name='connections', daemon=True).start()
+        self.jobs.put(connection)
+        return connection
+
+    def _work(self):
+        while True:
+            with self.lock:
+                self.idle += 1
+            connection = self.jobs.get()
+            with self.lock:
+                self.idle -= 1
+            try:
+                connection.run()
+            except Exception:
+                logger.exception("connecting to %s", connection.server)
+                connection.queue.put((connection.server, None))
+
+    def resolve(self, host, port):
+        """The getaddrinfo() result for host and port, cached."""
+        now = time.time()
+        with self.lock:
+            entry = self.addresses.get((host, port))
+        if entry and entry[0] > now:
+            return entry[1]
+        result = socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM)
+        with self.lock:
+            self.addresses[(host, port)] = (now + DNS_CACHE_SECONDS, result)
+        return result
+
+    def forget_address(self, host, port):
+        with self.lock:
+            self.addresses.pop((host, port), None)
+
+    def clear_addresses(self):
+        """Call when the proxy changes; it may resolve names differently."""
+        with self.lock:
+            self.addresses.clear()
+
+    def ssl_context(self, cert_reqs, ca_certs):
+        """A shared SSL context, reloaded if the ca_certs file changes."""
+        mtime = os.path.getmtime(ca_certs)
+        with self.lock:
+            entry = self.contexts.get((cert_reqs, ca_certs))
+            if entry is None or entry[0] != mtime:
+                entry = (mtime, TcpConnection.get_ssl_context(cert_reqs, ca_certs))
+                self.contexts[(cert_reqs, ca_certs)] = entry
+            return entry[1]
+
+    def session(self, server, context):
+        """The TLS session to resume with server, if one was made with context."""
+        with self.lock:
+            entry = self.sessions.get(server)
+        if entry and entry[0] is context:
+            return entry[1]
+        return None
+
+    def remember_session(self, server, sock):
+        """Note the TLS session of sock, a socket connected to server.  Call
+        again before closing it, as servers can send session tickets after the
+        handshake."""
+        session = getattr(sock, 'session', None)
+        if session is not None:
+            with self.lock:
+                self.sessions[server] = (sock.context, session)
+
+    def forget_session(self, server):
+        with self.lock:
+            self.sessions.pop(server, None)
+
+
 class TcpConnection(threading.Thread):
 
-    def __init__(self, server, queue, config_path):
+    def __init__(self, server, queue, config_path, manager=None):
         threading.Thread.__init__(self)
         self.config_path = config_path
         self.queue = queue
         self.server = server
+        # Without a manager nothing is kept between connections
+        self.manager = manager or ConnectionManager(config_path)
         self.host, self.port, self.protocol = self.server.rsplit(':', 2)
         self.host = str(self.host)
         self.port = int(self.port)
@@ -97,7 +216,7 @@ class TcpConnection(threading.Thread):
 
     def get_simple_socket(self):
         try:
-            l = socket.getaddrinfo(self.host, self.port, socket.AF_UNSPEC, socket.SOCK_STREAM)
+            l = self.manager.resolve(self.host, self.port)
         except socket.gaierror:
             self.logger.debug("cannot resolve hostname")
             return
@@ -116,6 +235,8 @@ class TcpConnection(threading.Thread):
             except Exception as _e:
                 e = _e
                 continue
+        # The server may have moved
+        self.manager.forget_address(self.host, self.port)
         self.logger.debug("failed to connect %s", e)
 
     @staticmethod
@@ -130,6 +251,15 @@ class TcpConnection(threading.Thread):
 
         return context
 
+    def wrap_socket(self, s, context):
+        '''Do the TLS handshake on s, resuming the last session with the server
+        if there is one.'''
+        s = context.wrap_socket(s, do_handshake_on_connect=True,
+                                session=self.manager.session(self.server, context))
+        tls_handshakes.labels(str(s.session_reused)).inc()
+        self.manager.remember_session(self.server, s)
+        return s
+
     def get_socket(self):
         if self.use_ssl:
             cert_path = os.path.join(self.config_path, 'certs', self.host)
@@ -140,8 +270,10 @@ class TcpConnection(threading.Thread):
                     return
                 # try with CA first
                 try:
-                    context = self.get_ssl_context(cert_reqs=ssl.CERT_REQUIRED, ca_certs=ca_path)
-                    s = context.wrap_socket(s, do_handshake_on_connect=True)
+                    import requests
+                    context = self.manager.ssl_context(cert_reqs=ssl.CERT_REQUIRED,
+                                                       ca_certs=requests.certs.where())
+                    s = self.wrap_socket(s, context)
                 except ssl.SSLError as e:
                     if 'self signed certificate' not in str(e):
                         self.logger.exception("")
@@ -184,14 +316,19 @@ class TcpConnection(threading.Thread):
 
         if self.use_ssl:
             try:
-                context = self.get_ssl_context(cert_reqs=ssl.CERT_REQUIRED,
-                                               ca_certs=(temporary_path if is_new else cert_path))
-                s = context.wrap_socket(s, do_handshake_on_connect=True)
+                if is_new:
+                    context = self.get_ssl_context(cert_reqs=ssl.CERT_REQUIRED,
+                                                   ca_certs=temporary_path)
+                else:
+                    context = self.manager.ssl_context(cert_reqs=ssl.CERT_REQUIRED,
+                                                       ca_certs=cert_path)
+                s = self.wrap_socket(s, context)
             except socket.timeout:
                 self.logger.error('timeout')
                 return
             except ssl.SSLError as e:
                 self.logger.exception("SSL error")
+                self.manager.forget_session(self.server)
                 if e.errno != 1:
                     return
                 if is_new:
@@ -262,6 +399,11 @@ class Interface:
         self.debug = False
         self.unsent_requests = []
         self.unanswered_requests = {}
+        # Wire ID -> time the request was sent, for round trip times
+        self.send_times = {}
+        # If set, called with the round trip time of each response and whether
+        # it was an error
+        self.response_callback = None
         self.last_send = time.time()
         self.closed_remotely = False
 
@@ -291,6 +433,10 @@ class Interface:
         self.request_time = time.time()
         self.unsent_requests.append(args)
 
+    def outstanding_requests(self):
+        '''The number of requests queued or sent and not yet answered.'''
+        return len(self.unsent_requests) + len(self.unanswered_requests)
+
     def num_requests(self):
         '''Keep unanswered requests below 100'''
         n = 100 - len(self.unanswered_requests)
@@ -308,10 +454,12 @@ class Interface:
             self.logger.error("send_requests %s %s", type(e).__name__, e)
             return False
         self.unsent_requests = self.unsent_requests[n:]
+        now = time.time()
         for request in wire_requests:
             if self.debug:
                 self.logger.debug("--> %s", request)
             self.unanswered_requests[request[2]] = request
+            self.send_times[request[2]] = now
         return True
 
     def ping_required(self):
@@ -355,6 +503,12 @@ class Interface:
             else:
                 request = self.unanswered_requests.pop(wire_id, None)
                 if request:
+                    sent = self.send_times.pop(wire_id, None)
+                    if sent is not None:
+                        seconds = time.time() - sent
+                        request_seconds.labels(request[0]).observe(seconds)
+                        if self.response_callback:
+                            self.response_callback(seconds, bool(response.get('error')))
                     responses.append((request, response))
                 else:
                     self.logger.debug("unknown wire ID '%s'", wire_id)
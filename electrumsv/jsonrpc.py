@@ -24,13 +24,24 @@
 # SOFTWARE.
 
 from base64 import b64decode
+from concurrent.futures import ThreadPoolExecutor
 from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCServer, SimpleJSONRPCRequestHandler
+import selectors
+import threading
 import time
 
 from . import util
 from .logs import logs
 
 
+logger = logs.get_logger("jsonrpc")
+
+# Seconds an idle keep-alive connection is held open
+IDLE_TIMEOUT = 30
+# Connections waiting for a worker, per worker, before new ones are refused
+PENDING_PER_WORKER = 4
+
+
 class RPCAuthCredentialsInvalid(Exception):
     def __str__(self):
         return 'Authentication failed (bad credentials)'
@@ -63,15 +74,86 @@ class VerifyingRequestHandler(SimpleJSONRPCRequestHandler):
                 self.send_error(500, str(e))
         return False
 
+
+class KeepAliveVerifyingRequestHandler(VerifyingRequestHandler):
+    '''HTTP/1.1 so clients can reuse a connection for many requests.  Handles
+    a single request; the threaded server watches the connection for the next
+    one, so an idle connection does not occupy a worker.'''
+    protocol_version = 'HTTP/1.1'
+    # Unbuffered, so nothing of a following request is read and lost with
+    # this handler
+    rbufsize = 0
+    # Seconds to wait for the rest of a request once it has started
+    timeout = 10
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+
+
+class RPCRequestStats(object):
+    '''Per-method call counts and timings for the RPC server.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._methods = {}
+
+    def record(self, method, elapsed, failed):
+        with self._lock:
+            entry = self._methods.get(method)
+            if entry is None:
+                entry = self._methods[method] = [0, 0, 0.0, 0.0]
+            entry[0] += 1
+            if failed:
+                entry[1] += 1
+            entry[2] += elapsed
+            entry[3] = max(entry[3], elapsed)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                method: {
+                    'count': count,
+                    'errors': errors,
+                    'total_time': round(total, 6),
+                    'mean_time': round(total / count, 6),
+                    'max_time': round(max_time, 6),
+                }
+                for method, (count, errors, total, max_time) in self._methods.items()
+            }
+
+
 class VerifyingJSONRPCServer(SimpleJSONRPCServer):
 
-    def __init__(self, *args, rpc_user, rpc_password, **kargs):
+    def __init__(self, *args, rpc_user, rpc_password,
+                 requestHandler=VerifyingRequestHandler, **kargs):
 
         self.rpc_user = rpc_user
         self.rpc_password = rpc_password
+        self.request_stats = RPCRequestStats()
+        # Optional callable taking the list of method names in a batch request and
+        # returning a context manager held while the whole batch executes.
+        self.batch_context = None
 
         SimpleJSONRPCServer.__init__(
-            self, requestHandler=VerifyingRequestHandler, *args, **kargs)
+            self, requestHandler=requestHandler, *args, **kargs)
+
+    def _unmarshaled_dispatch(self, request, *args):
+        if isinstance(request, list) and self.batch_context is not None:
+            methods = [entry.get('method') for entry in request if isinstance(entry, dict)]
+            with self.batch_context(methods):
+                return super()._unmarshaled_dispatch(request, *args)
+        return super()._unmarshaled_dispatch(request, *args)
+
+    def _dispatch(self, method, params, *args):
+        failed = True
+        start = time.time()
+        try:
+            result = super()._dispatch(method, params, *args)
+            failed = False
+            return result
+        finally:
+            self.request_stats.record(method, time.time() - start, failed)
 
     def authenticate(self, headers):
         if self.rpc_password == '':
@@ -93,3 +175,87 @@ class VerifyingJSONRPCServer(SimpleJSONRPCServer):
                 and util.constant_time_compare(password, self.rpc_password)):
             time.sleep(0.050)
             raise RPCAuthCredentialsInvalid()
+
+
+class ThreadedVerifyingJSONRPCServer(VerifyingJSONRPCServer):
+    '''Hands each request to a bounded pool of worker threads, so a slow
+    command does not hold up other clients.  Connections are kept alive
+    between requests and watched by a selector while idle.  When more than
+    PENDING_PER_WORKER connections per worker are waiting, new ones are
+    closed.'''
+
+    def __init__(self, *args, workers, **kargs):
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(workers * (1 + PENDING_PER_WORKER))
+        self._idle = selectors.DefaultSelector()
+        self._closed = False
+        VerifyingJSONRPCServer.__init__(
+            self, requestHandler=KeepAliveVerifyingRequestHandler, *args, **kargs)
+        self._idle_thread = threading.Thread(target=self._watch_idle, name='rpc-idle',
+                                             daemon=True)
+        self._idle_thread.start()
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            logger.warning("too many pending requests, closing connection from %s",
+                           client_address)
+            self.shutdown_request(request)
+            return
+        self._pool.submit(self._process_request_worker, request, client_address)
+
+    def finish_request(self, request, client_address):
+        '''Returns True if the connection is to be kept open.'''
+        handler = self.RequestHandlerClass(request, client_address, self)
+        return not handler.close_connection
+
+    def _process_request_worker(self, request, client_address):
+        keep_alive = False
+        try:
+            keep_alive = self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self._slots.release()
+        if keep_alive and not self._closed:
+            try:
+                self._idle.register(request, selectors.EVENT_READ,
+                                    (client_address, time.monotonic() + IDLE_TIMEOUT))
+                return
+            except (OSError, ValueError):
+                # The server closed meanwhile
+                pass
+        self.shutdown_request(request)
+
+    def _watch_idle(self):
+        while not self._closed:
+            ready = [key for key, _events in self._idle.select(timeout=0.1)]
+            now = time.monotonic()
+            expired = [key for key in list(self._idle.get_map().values())
+                       if key.data[1] < now and key not in ready]
+            for key in ready + expired:
+                self._idle.unregister(key.fileobj)
+            for key in expired:
+                self.shutdown_request(key.fileobj)
+            for key in ready:
+                if self._closed:
+                    self.shutdown_request(key.fileobj)
+                elif not self._slots.acquire(blocking=False):
+                    logger.warning("too many pending requests, closing connection from %s",
+                                   key.data[0])
+                    self.shutdown_request(key.fileobj)
+                else:
+                    self._pool.submit(self._process_request_worker, key.fileobj,
+                                      key.data[0])
+        for key in list(self._idle.get_map().values()):
+            self.shutdown_request(key.fileobj)
+        self._idle.close()
+
+    def handle_error(self, request, client_address):
+        logger.exception("error handling request from %s", client_address)
+
+    def server_close(self):
+        self._closed = True
+        VerifyingJSONRPCServer.server_close(self)
+        # The idle thread submits work to the pool until it stops
+        self._idle_thread.join()
+        self._pool.shutdown(wait=False)
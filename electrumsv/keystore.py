@@ -21,7 +21,12 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from collections import OrderedDict
 import hashlib
+import hmac
+import os
+import threading
+import time
 from unicodedata import normalize
 
 import ecdsa
@@ -33,8 +38,8 @@ from . import ecc
 from .address import Address, PublicKey
 from .app_state import app_state
 from .bip32 import (
-    bip32_private_key, bip32_public_derivation, bip32_private_derivation, bip32_root,
-    xpub_from_xprv, deserialize_xpub, deserialize_xprv, is_xpub, is_xprv, CKD_pub
+    bip32_private_key, bip32_private_derivation, bip32_root,
+    xpub_from_xprv, deserialize_xpub, deserialize_xprv, is_xpub, is_xprv, CKD_priv, CKD_pub
 )
 from .bitcoin import (
     bh2u, bfh, DecodeBase58Check, EncodeBase58Check, is_seed, seed_type,
@@ -43,6 +48,7 @@ from .bitcoin import (
 from .crypto import sha256d, pw_encode, pw_decode
 from .exceptions import InvalidPassword
 from .logs import logs
+from .metrics import metrics
 from .mnemonic import Mnemonic, load_wordlist
 from .networks import Net
 from .util import hfu
@@ -50,6 +56,59 @@ from .util import hfu
 
 logger = logs.get_logger("keystore")
 
+cache_lookups = metrics.counter('keystore_cache_lookups',
+                                'Lookups in the derivation and x_pubkey caches',
+                                ('cache', 'result'))
+
+DEFAULT_DERIVATION_ENTRIES = 20000
+DEFAULT_XPUBKEY_ENTRIES = 20000
+
+
+class DerivationCache(object):
+    '''Bounded LRU cache of values that are expensive to compute from their keys, such
+    as public keys derived from an extended public key.  Values must be immutable as
+    they are shared by every caller.  Thread-safe.
+    '''
+
+    def __init__(self, name, max_entries):
+        self.name = name
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, func):
+        '''The value for key, calling func to create it if it is not cached.'''
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+        if value is not None:
+            cache_lookups.labels(self.name, 'hit').inc()
+            return value
+        cache_lookups.labels(self.name, 'miss').inc()
+        # Computed outside the lock; two threads may both compute a missing value
+        value = func()
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Shared by all keystores, so co-signers in one process derive each key once.  Keyed by
+# ('pubkey', xpub, branch, index) for public keys and ('node', xpub, branch) for the
+# (K, c) pair of each branch.
+derivation_cache = DerivationCache('derivation', DEFAULT_DERIVATION_ENTRIES)
+# x_pubkey strings parsed to (master key, derivation) and to (pubkey, address)
+xpubkey_cache = DerivationCache('x_pubkey', DEFAULT_XPUBKEY_ENTRIES)
+
 
 class KeyStore:
     def __init__(self):
@@ -95,14 +154,90 @@ class KeyStore:
 
 
 
+class SigningSession(object):
+    '''Decrypted and derived private key material, held for a limited time so that signing
+    with the same password does not decrypt the keystore and derive each key again.
+
+    Values are kept in bytearrays that are overwritten with zeros when the session is
+    closed, by lock() or when it times out.  The bytes copies handed out for signing are
+    freed but not cleared by Python, so this bounds how long key material is held rather
+    than guaranteeing it leaves memory.
+    '''
+
+    def __init__(self, password, timeout):
+        self._salt = os.urandom(16)
+        self._password_hash = self._hash_password(password)
+        self._expires = time.monotonic() + timeout
+        self._lock = threading.RLock()
+        self._values = {}
+        self._closed = False
+        self._timer = threading.Timer(timeout, self.close)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _hash_password(self, password):
+        return hmac.new(self._salt, (password or '').encode('utf8'), hashlib.sha256).digest()
+
+    def is_open(self):
+        return not self._closed and time.monotonic() < self._expires
+
+    def matches(self, password):
+        '''Whether the session is open and was unlocked with password.'''
+        return self.is_open() and hmac.compare_digest(self._password_hash,
+                                                      self._hash_password(password))
+
+    def get(self, key, func):
+        '''The value for key, calling func to create it if the session lacks it.'''
+        with self._lock:
+            value = self._values.get(key)
+            if value is None:
+                value = bytearray(func())
+                if not self._closed:
+                    self._values[key] = value
+            return bytes(value)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for value in self._values.values():
+                value[:] = bytes(len(value))
+            self._values.clear()
+        self._timer.cancel()
+
+
 class Software_KeyStore(KeyStore):
 
     def __init__(self):
         KeyStore.__init__(self)
+        self._session = None
 
     def may_have_password(self):
         return not self.is_watching_only()
 
+    def unlock(self, password, timeout):
+        '''Hold the decrypted key material for timeout seconds so that signing with password
+        does not decrypt and derive keys each time.  Raises InvalidPassword.'''
+        self.check_password(password)
+        self.lock()
+        self._session = SigningSession(password, timeout)
+
+    def lock(self):
+        '''End any signing session, clearing the key material it holds.'''
+        session, self._session = self._session, None
+        if session is not None:
+            session.close()
+
+    def is_unlocked(self):
+        session = self._session
+        return session is not None and session.is_open()
+
+    def _get_session(self, password):
+        '''The signing session if it was unlocked with password, otherwise None.'''
+        session = self._session
+        if session is not None and session.matches(password):
+            return session
+        return None
+
     def sign_message(self, sequence, message, password):
         privkey, compressed = self.get_private_key(sequence, password)
         key = ecc.ECPrivkey(privkey)
@@ -116,8 +251,9 @@ class Software_KeyStore(KeyStore):
     def sign_transaction(self, tx, password):
         if self.is_watching_only():
             return
-        # Raise if password is not correct.
-        self.check_password(password)
+        # Raise if password is not correct.  A signing session was unlocked with it.
+        if self._get_session(password) is None:
+            self.check_password(password)
         # Add private keys
         keypairs = self.get_tx_derivations(tx)
         for k, v in keypairs.items():
@@ -200,8 +336,16 @@ class Imported_KeyStore(Software_KeyStore):
 
     def get_private_key(self, pubkey, password):
         '''Returns a (32 byte privkey, is_compressed) pair.'''
-        WIF_privkey = self.export_private_key(pubkey, password)
-        return PublicKey.privkey_from_WIF_privkey(WIF_privkey)
+        session = self._get_session(password)
+        if session is None:
+            WIF_privkey = self.export_private_key(pubkey, password)
+            return PublicKey.privkey_from_WIF_privkey(WIF_privkey)
+        def decrypt():
+            privkey, compressed = PublicKey.privkey_from_WIF_privkey(
+                self.export_private_key(pubkey, password))
+            return privkey + bytes([compressed])
+        value = session.get(pubkey, decrypt)
+        return value[:-1], bool(value[-1])
 
     def get_pubkey_derivation(self, x_pubkey):
         if x_pubkey[0:2] in ['02', '03', '04']:
@@ -214,6 +358,7 @@ class Imported_KeyStore(Software_KeyStore):
 
     def update_password(self, old_password, new_password):
         self.check_password(old_password)
+        self.lock()
         if new_password == '':
             new_password = None
         for k, v in self.keypairs.items():
@@ -268,28 +413,32 @@ class Xpub:
 
     def __init__(self):
         self.xpub = None
-        self.xpub_receive = None
-        self.xpub_change = None
 
     def get_master_public_key(self):
         return self.xpub
 
     def derive_pubkey(self, for_change, n):
-        xpub = self.xpub_change if for_change else self.xpub_receive
-        if xpub is None:
-            xpub = bip32_public_derivation(self.xpub, "", "/%d"%for_change)
-            if for_change:
-                self.xpub_change = xpub
-            else:
-                self.xpub_receive = xpub
-        return self.get_pubkey_from_xpub(xpub, (n,))
+        return self.get_pubkey_from_xpub(self.xpub, (for_change, n))
+
+    @classmethod
+    def _get_node(cls, xpub, branch):
+        '''The (K, c) pair of the branch of xpub, a tuple of child indices.'''
+        def derive():
+            if branch:
+                cK, c = cls._get_node(xpub, branch[:-1])
+                return CKD_pub(cK, c, branch[-1])
+            _, _, _, _, c, cK = deserialize_xpub(xpub)
+            return cK, c
+        return derivation_cache.get(('node', xpub, branch), derive)
 
     @classmethod
     def get_pubkey_from_xpub(self, xpub, sequence):
-        _, _, _, _, c, cK = deserialize_xpub(xpub)
-        for i in sequence:
-            cK, c = CKD_pub(cK, c, i)
-        return bh2u(cK)
+        sequence = tuple(sequence)
+        branch, index = sequence[:-1], sequence[-1]
+        def derive():
+            cK, c = self._get_node(xpub, branch)
+            return bh2u(CKD_pub(cK, c, index)[0])
+        return derivation_cache.get(('pubkey', xpub, branch, index), derive)
 
     def get_xpubkey(self, c, i):
         s = ''.join(int_to_hex(x,2) for x in (c, i))
@@ -298,17 +447,20 @@ class Xpub:
     @classmethod
     def parse_xpubkey(self, pubkey):
         assert pubkey[0:2] == 'ff'
-        pk = bfh(pubkey)
-        pk = pk[1:]
-        xkey = EncodeBase58Check(pk[0:78])
-        dd = pk[78:]
-        s = []
-        while dd:
-            n = int(rev_hex(bh2u(dd[0:2])), 16)
-            dd = dd[2:]
-            s.append(n)
-        assert len(s) == 2
-        return xkey, s
+        def parse():
+            pk = bfh(pubkey)
+            pk = pk[1:]
+            xkey = EncodeBase58Check(pk[0:78])
+            dd = pk[78:]
+            s = []
+            while dd:
+                n = int(rev_hex(bh2u(dd[0:2])), 16)
+                dd = dd[2:]
+                s.append(n)
+            assert len(s) == 2
+            return xkey, tuple(s)
+        xkey, s = xpubkey_cache.get(('parse', pubkey), parse)
+        return xkey, list(s)
 
     def get_pubkey_derivation_based_on_wallet_advice(self, x_pubkey):
         _, addr = xpubkey_to_address(x_pubkey)
@@ -365,6 +517,7 @@ class BIP32_KeyStore(Deterministic_KeyStore, Xpub):
 
     def update_password(self, old_password, new_password):
         self.check_password(old_password)
+        self.lock()
         if new_password == '':
             new_password = None
         if self.has_seed():
@@ -390,10 +543,31 @@ class BIP32_KeyStore(Deterministic_KeyStore, Xpub):
         self.add_xprv(xprv)
 
     def get_private_key(self, sequence, password):
-        xprv = self.get_master_private_key(password)
-        _, _, _, _, c, k = deserialize_xprv(xprv)
-        pk = bip32_private_key(sequence, k, c)
-        return pk, True
+        session = self._get_session(password)
+        if session is None:
+            xprv = self.get_master_private_key(password)
+            _, _, _, _, c, k = deserialize_xprv(xprv)
+            pk = bip32_private_key(sequence, k, c)
+            return pk, True
+
+        # The session holds the master key, the key of each branch (the sequence less its
+        # last index) and each key derived, so most keys take one derivation step.
+        def master_key():
+            _, _, _, _, c, k = deserialize_xprv(self.get_master_private_key(password))
+            return k + c
+
+        def branch_key():
+            kc = session.get('master', master_key)
+            k, c = kc[:32], kc[32:]
+            for n in sequence[:-1]:
+                k, c = CKD_priv(k, c, n)
+            return k + c
+
+        def private_key():
+            kc = session.get(('branch', tuple(sequence[:-1])), branch_key)
+            return CKD_priv(kc[:32], kc[32:], sequence[-1])[0]
+
+        return session.get(tuple(sequence), private_key), True
 
     def set_wallet_advice(self, addr, advice): #overrides KeyStore.set_wallet_advice
         self.wallet_advice[addr] = advice
@@ -463,11 +637,13 @@ class Old_KeyStore(Deterministic_KeyStore):
 
     @classmethod
     def get_pubkey_from_mpk(self, mpk, for_change, n):
-        z = self.get_sequence(mpk, for_change, n)
-        master_public_key = ecdsa.VerifyingKey.from_string(bfh(mpk), curve = SECP256k1)
-        pubkey_point = master_public_key.pubkey.point + z*SECP256k1.generator
-        public_key2 = ecdsa.VerifyingKey.from_public_point(pubkey_point, curve = SECP256k1)
-        return '04' + bh2u(public_key2.to_string())
+        def derive():
+            z = self.get_sequence(mpk, for_change, n)
+            master_public_key = ecdsa.VerifyingKey.from_string(bfh(mpk), curve = SECP256k1)
+            pubkey_point = master_public_key.pubkey.point + z*SECP256k1.generator
+            public_key2 = ecdsa.VerifyingKey.from_public_point(pubkey_point, curve = SECP256k1)
+            return '04' + bh2u(public_key2.to_string())
+        return derivation_cache.get(('pubkey', mpk, (for_change,), n), derive)
 
     def derive_pubkey(self, for_change, n):
         return self.get_pubkey_from_mpk(self.mpk, for_change, n)
@@ -479,12 +655,26 @@ class Old_KeyStore(Deterministic_KeyStore):
         return pk
 
     def get_private_key(self, sequence, password):
-        seed = self.get_hex_seed(password)
-        self.check_seed(seed)
         for_change, n = sequence
-        secexp = self.stretch_key(seed)
-        pk = self.get_private_key_from_stretched_exponent(for_change, n, secexp)
-        return pk, False
+        session = self._get_session(password)
+        if session is None:
+            seed = self.get_hex_seed(password)
+            self.check_seed(seed)
+            secexp = self.stretch_key(seed)
+            pk = self.get_private_key_from_stretched_exponent(for_change, n, secexp)
+            return pk, False
+
+        # Stretching the seed takes 100,000 hashes, so the session holds the result
+        def stretched_exponent():
+            seed = self.get_hex_seed(password)
+            self.check_seed(seed)
+            return number_to_string(self.stretch_key(seed), generator_secp256k1.order())
+
+        def private_key():
+            secexp = string_to_number(session.get('secexp', stretched_exponent))
+            return self.get_private_key_from_stretched_exponent(for_change, n, secexp)
+
+        return session.get((for_change, n), private_key), False
 
     def check_seed(self, seed):
         secexp = self.stretch_key(seed)
@@ -508,16 +698,19 @@ class Old_KeyStore(Deterministic_KeyStore):
     @classmethod
     def parse_xpubkey(self, x_pubkey):
         assert x_pubkey[0:2] == 'fe'
-        pk = x_pubkey[2:]
-        mpk = pk[0:128]
-        dd = pk[128:]
-        s = []
-        while dd:
-            n = int(rev_hex(dd[0:4]), 16)
-            dd = dd[4:]
-            s.append(n)
-        assert len(s) == 2
-        return mpk, s
+        def parse():
+            pk = x_pubkey[2:]
+            mpk = pk[0:128]
+            dd = pk[128:]
+            s = []
+            while dd:
+                n = int(rev_hex(dd[0:4]), 16)
+                dd = dd[4:]
+                s.append(n)
+            assert len(s) == 2
+            return mpk, tuple(s)
+        mpk, s = xpubkey_cache.get(('parse', x_pubkey), parse)
+        return mpk, list(s)
 
     def get_pubkey_derivation(self, x_pubkey):
         if x_pubkey[0:2] != 'fe':
@@ -529,6 +722,7 @@ class Old_KeyStore(Deterministic_KeyStore):
 
     def update_password(self, old_password, new_password):
         self.check_password(old_password)
+        self.lock()
         if new_password == '':
             new_password = None
         if self.has_seed():
@@ -663,6 +857,9 @@ def parse_xpubkey(x_pubkey):
 
 
 def xpubkey_to_address(x_pubkey):
+    return xpubkey_cache.get(('address', x_pubkey), lambda: _xpubkey_to_address(x_pubkey))
+
+def _xpubkey_to_address(x_pubkey):
     if x_pubkey[0:2] == 'fd':
         address = script_to_address(x_pubkey[2:])
         return x_pubkey, address
@@ -34,20 +34,20 @@ import os
 import sys
 import time
 
-from electrumsv import daemon, keystore, web
+from electrumsv import daemon, web
 from electrumsv.app_state import app_state, AppStateProxy
 from electrumsv.commands import get_parser, known_commands, Commands, config_variables
 from electrumsv.exceptions import InvalidPassword
 from electrumsv.logs import logs
-from electrumsv.mnemonic import Mnemonic
-from electrumsv.network import Network
 from electrumsv.networks import Net, SVTestnet
 from electrumsv.platform import platform
 from electrumsv.simple_config import SimpleConfig
 from electrumsv.startup import is_bundle
 from electrumsv.storage import WalletStorage
 from electrumsv.util import json_encode, json_decode, setup_thread_excepthook
-from electrumsv.wallet import Wallet, ImportedPrivkeyWallet, ImportedAddressWallet
+
+# The wallet, keystore and network modules are imported by the functions using them, as
+# most invocations either pass the command to a running daemon or do not need them.
 
 
 # get password routine
@@ -64,6 +64,10 @@ def prompt_password(prompt, confirm=True):
 
 
 def run_non_RPC(config):
+    from electrumsv import keystore
+    from electrumsv.mnemonic import Mnemonic
+    from electrumsv.network import Network
+    from electrumsv.wallet import Wallet, ImportedPrivkeyWallet, ImportedAddressWallet
     cmdname = config.get('cmd')
 
     storage = WalletStorage(config.get_wallet_path())
@@ -74,20 +78,40 @@ def run_non_RPC(config):
         return prompt_password("Password (hit return if you do not wish to encrypt your wallet):")
 
     if cmdname == 'restore':
+        from electrumsv.restore import Account, RestoreEngine, bip39_accounts, network_probe
         text = config.get('text').strip()
         passphrase = config.get('passphrase', '')
-        password = password_dialog() if keystore.is_private(text) else None
+        is_bip39 = not keystore.is_seed(text) and keystore.bip39_is_checksum_valid(text)[0]
+        password = password_dialog() if keystore.is_private(text) or is_bip39 else None
+        network = None
+        if not config.get('offline'):
+            network = Network(config)
+            network.start()
         if keystore.is_address_list(text):
             wallet = ImportedAddressWallet.from_text(storage, text)
         elif keystore.is_private_key_list(text):
             wallet = ImportedPrivkeyWallet.from_text(storage, text, password)
         else:
             if keystore.is_seed(text):
-                k = keystore.from_seed(text, passphrase, False)
+                accounts = [Account('m', keystore.from_seed(text, passphrase, False))]
             elif keystore.is_master_key(text):
-                k = keystore.from_master_key(text)
+                accounts = [Account('m', keystore.from_master_key(text))]
+            elif is_bip39:
+                accounts = bip39_accounts(text, passphrase, config.get('restore_accounts', 3))
             else:
                 sys.exit("Error: Seed or key not recognized")
+            result = None
+            if network:
+                # Find the used addresses of every account before creating the wallet
+                print("Looking for used addresses...")
+                results = RestoreEngine(network_probe(network)).scan(accounts)
+                used = [result for result in results if result.is_used()]
+                result = used[0] if used else results[0]
+                if len(accounts) > 1:
+                    print("Restoring derivation path %s" % result.name)
+                for other in used[1:]:
+                    print("Derivation path %s also has history" % other.name)
+            k = result.keystore if result else accounts[0].keystore
             if password:
                 k.update_password(None, password)
             storage.put('keystore', k.dump())
@@ -95,9 +119,9 @@ def run_non_RPC(config):
             storage.put('use_encryption', bool(password))
             storage.write()
             wallet = Wallet(storage)
-        if not config.get('offline'):
-            network = Network(config)
-            network.start()
+            if result:
+                result.apply_to_wallet(wallet)
+        if network:
             wallet.start_threads(network)
             print("Recovering wallet...")
             wallet.synchronize()
@@ -212,6 +236,12 @@ def run_offline_command(config, config_options):
     cmd = known_commands[cmdname]
     password = config_options.get('password')
     if cmd.requires_wallet:
+        from electrumsv import wallet_summary
+        if wallet_summary.can_answer(cmdname, config):
+            summary = wallet_summary.WalletSummary.load(config.get_wallet_path())
+            if summary:
+                return run_command_with_wallet(config, config_options, cmd, summary)
+        from electrumsv.wallet import Wallet
         storage = WalletStorage(config.get_wallet_path())
         if storage.is_encrypted():
             storage.decrypt(password)
@@ -225,6 +255,17 @@ def run_offline_command(config, config_options):
         except InvalidPassword:
             print("Error: This password does not decode this wallet.")
             sys.exit(1)
+    result = run_command_with_wallet(config, config_options, cmd, wallet)
+    # save wallet
+    if wallet:
+        wallet.storage.write()
+        if wallet_summary.can_answer(cmdname, config):
+            wallet_summary.write_summary(wallet)
+    return result
+
+
+def run_command_with_wallet(config, config_options, cmd, wallet):
+    cmdname = cmd.name
     if cmd.requires_network:
         print("Warning: running command offline")
     # arguments passed to function
@@ -238,11 +279,7 @@ def run_offline_command(config, config_options):
         kwargs[x] = (config_options.get(x) if x in ['password', 'new_password'] else config.get(x))
     cmd_runner = Commands(config, wallet, None)
     func = getattr(cmd_runner, cmd.name)
-    result = func(*args, **kwargs)
-    # save wallet
-    if wallet:
-        wallet.storage.write()
-    return result
+    return func(*args, **kwargs)
 
 
 def main():
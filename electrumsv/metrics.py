@@ -0,0 +1,343 @@
+# Electrum SV - lightweight Bitcoin SV client
+# Copyright (C) 2019 The Electrum SV Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Process-wide counters, gauges and histograms.
+
+Metrics are registered by name on the `metrics` registry, optionally with
+label names, and updated from anywhere in the code.  Updating one costs a dict
+lookup and a few additions under a lock, so they are always on.  The registry
+can be exported as JSON (the getmetrics command) or in the Prometheus text
+format, optionally served over HTTP.
+'''
+
+from bisect import bisect_left
+from contextlib import contextmanager
+import functools
+import threading
+import time
+
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the buckets of histograms of sizes in bytes
+SIZE_BUCKETS = (1024, 16384, 131072, 1048576, 8388608, 67108864)
+
+
+class _Metric(object):
+
+    kind = None
+
+    def __init__(self, name, help, labelnames):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def labels(self, *values):
+        '''The child metric for the given label values.'''
+        assert len(values) == len(self.labelnames), (self.name, values)
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def remove(self, *values):
+        with self._lock:
+            self._children.pop(tuple(str(value) for value in values), None)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _unlabelled(self):
+        assert not self.labelnames, f'{self.name} requires labels'
+        return self.labels()
+
+    def samples(self):
+        '''A list of (label values, child) pairs.'''
+        with self._lock:
+            return sorted(self._children.items())
+
+
+class _CounterValue(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def to_json(self):
+        return self.value
+
+
+class Counter(_Metric):
+    '''A count that only goes up.'''
+
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self._unlabelled().inc(amount)
+
+
+class _GaugeValue(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+        self._function = None
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        '''Read the value by calling function when the metrics are exported.'''
+        self._function = function
+
+    @property
+    def value(self):
+        if self._function is not None:
+            try:
+                return self._function()
+            except Exception:
+                return None
+        return self._value
+
+    def to_json(self):
+        return self.value
+
+
+class Gauge(_Metric):
+    '''A value that can go up and down, such as the length of a queue.'''
+
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def set(self, value):
+        self._unlabelled().set(value)
+
+    def inc(self, amount=1):
+        self._unlabelled().inc(amount)
+
+    def dec(self, amount=1):
+        self._unlabelled().dec(amount)
+
+    def set_function(self, function):
+        self._unlabelled().set_function(function)
+
+
+class _HistogramValue(object):
+
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        # One more than the buckets, for observations above the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def to_json(self):
+        with self._lock:
+            count, total, max_value = self.count, self.sum, self.max
+        return {
+            'count': count,
+            'sum': round(total, 6),
+            'mean': round(total / count, 6) if count else 0.0,
+            'max': round(max_value, 6),
+        }
+
+
+class Histogram(_Metric):
+    '''Counts observations, such as durations, in buckets.'''
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._unlabelled().observe(value)
+
+    def time(self):
+        '''A context manager observing the time taken by its block.'''
+        return self._unlabelled().time()
+
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, cls, name, help, labelnames, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+        assert type(metric) is cls, f'{name} is already a {metric.kind}'
+        return metric
+
+    def counter(self, name, help='', labelnames=()):
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name, help='', labelnames=()):
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help='', labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def timed(self, name, help=''):
+        '''Decorator observing the duration of each call in the histogram name,
+        labelled by the function.'''
+        histogram = self.histogram(name, help, ('function', ))
+        def decorator(func):
+            child = histogram.labels(func.__qualname__)
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with child.time():
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _sorted_metrics(self):
+        with self._lock:
+            return sorted(self._metrics.items())
+
+    def to_json(self):
+        '''All metrics as a dict.  Labelled values are keyed by their label values
+        joined with commas.'''
+        result = {}
+        for name, metric in self._sorted_metrics():
+            samples = metric.samples()
+            if metric.labelnames:
+                result[name] = {','.join(values): child.to_json() for values, child in samples}
+            elif samples:
+                result[name] = samples[0][1].to_json()
+        return result
+
+    def to_prometheus(self):
+        '''All metrics in the Prometheus text exposition format.'''
+        lines = []
+        for name, metric in self._sorted_metrics():
+            name = 'electrumsv_' + name
+            if metric.help:
+                lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for values, child in metric.samples():
+                labels = list(zip(metric.labelnames, values))
+                if metric.kind == 'histogram':
+                    with child._lock:
+                        counts = list(child.counts)
+                        count, total = child.count, child.sum
+                    cumulative = 0
+                    for bound, n in zip(child.buckets + (float('inf'), ), counts):
+                        cumulative += n
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f'{name}_bucket{_format_labels(labels + [("le", le)])} '
+                                     f'{cumulative}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {total!r}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {count}')
+                else:
+                    value = child.value
+                    if value is not None:
+                        lines.append(f'{name}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    def escape(value):
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels) + '}'
+
+
+def start_http_server(host, port, registry=None):
+    '''Serve the registry in the Prometheus text format on a daemon thread.
+    Returns the server; call shutdown() on it to stop.'''
+    # Imported here as every process imports this module but few serve metrics
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class PrometheusHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            body = self.server.registry.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer((host, port), PrometheusHandler)
+    server.registry = registry or metrics
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    return server
+
+
+metrics = MetricsRegistry()
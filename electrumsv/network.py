@@ -26,7 +26,7 @@ import errno
 import json
 import os
 import queue
-import random
+from functools import partial
 import re
 import select
 import socket
@@ -45,22 +45,56 @@ from .bitcoin import COIN, bfh
 from .blockchain import Blockchain
 from .crypto import sha256d
 from .i18n import _
-from .interface import Connection, Interface
+from .interface import ConnectionManager, Interface
 from .logs import logs
+from .metrics import metrics
 from .networks import Net
+from .server_pool import ServerPool
 from .version import PACKAGE_VERSION, PROTOCOL_VERSION
 from .simple_config import SimpleConfig
+from .tx_cache import DEFAULT_DISK_ENTRIES, DEFAULT_MEMORY_BYTES, TxCache
 
 
 logger = logs.get_logger("network")
 
+response_errors = metrics.counter('network_response_errors',
+                                  'Error responses to requests, by method', ('method', ))
+routed_requests = metrics.counter('network_routed_requests',
+                                  'Read-only client requests sent to a server other than '
+                                  'the main one, by method', ('method', ))
+hedged_requests = metrics.counter('network_hedged_requests',
+                                  'Slow requests also sent to a second server, by method',
+                                  ('method', ))
+
 
 class RPCError(Exception):
     pass
 
 
-NODES_RETRY_INTERVAL = 60
 SERVER_RETRY_INTERVAL = 10
+# How often to check whether a better scoring main server is connected, and
+# how much better it must score to switch to it
+SCORE_CHECK_INTERVAL = 60
+SWITCH_SCORE_RATIO = 2
+
+# Requests whose answer does not depend on who asks.  While one is in flight,
+# identical requests from other wallets wait for its response instead of
+# being sent to the server again.
+SHARED_REQUEST_METHODS = {
+    'blockchain.transaction.get',
+    'blockchain.transaction.get_merkle',
+}
+
+# Read-only requests whose answer any server following our chain can give.
+# They are spread across the connected servers; everything else, in particular
+# subscriptions, goes to the main server.
+ROUTED_REQUEST_METHODS = {
+    'blockchain.scripthash.get_balance',
+    'blockchain.scripthash.get_history',
+    'blockchain.scripthash.listunspent',
+    'blockchain.transaction.get',
+    'blockchain.transaction.get_merkle',
+}
 
 # Called by util.py:get_peers()
 def parse_servers(result):
@@ -116,12 +150,6 @@ def _get_eligible_servers(hostmap=None, protocol="s", exclude_set=None):
         hostmap = Net.DEFAULT_SERVERS
     return list(set(filter_protocol(hostmap, protocol)) - exclude_set)
 
-def _pick_random_server(hostmap=None, protocol='s', exclude_set=None):
-    if exclude_set is None:
-        exclude_set = set()
-    eligible = _get_eligible_servers(hostmap, protocol, exclude_set)
-    return random.choice(eligible) if eligible else None
-
 proxy_modes = ['socks4', 'socks5', 'http']
 
 
@@ -175,8 +203,8 @@ class Network(util.DaemonThread):
     """
     The Network class manages a set of connections to remote electrum
     servers, each connected socket is handled by an Interface() object.
-    Connections are initiated by a Connection() thread which stops once
-    the connection succeeds or fails.
+    Connections are made by the ConnectionManager's threads, and each is
+    handed over once it succeeds or fails.
     """
 
     def __init__(self, config=None):
@@ -188,6 +216,9 @@ class Network(util.DaemonThread):
         # FIXME - this doesn't belong here; it's not a property of the Network
         # Leaving it here until startup is rationalized
         Blockchain.read_blockchains()
+        # Health scores of the servers we have used
+        self.server_pool = ServerPool(os.path.join(self.config.path, 'server-scores')
+                                      if self.config.path else None)
         # Server for addresses and transactions
         self.default_server = self.config.get('server', None)
         self.blacklisted_servers = set(self.config.get('server_blacklist', []))
@@ -197,10 +228,10 @@ class Network(util.DaemonThread):
             try:
                 deserialize_server(self.default_server)
             except:
-                logger.error('failed to parse server-string; falling back to random.')
+                logger.error('failed to parse server-string; falling back to another server.')
                 self.default_server = None
         if not self.default_server or self.default_server in self.blacklisted_servers:
-            self.default_server = _pick_random_server()
+            self.default_server = self._pick_server()
 
         self.lock = threading.Lock()
         # locks: if you need to take several acquire them in the order they are defined here!
@@ -208,6 +239,10 @@ class Network(util.DaemonThread):
         self.pending_sends_lock = threading.Lock()
 
         self.pending_sends = []
+        # Subscription keys no wallet watches any more, applied by the network thread
+        self.pending_releases = []
+        # Slow requests to also send to a second server
+        self.pending_hedges = []
         self.message_id = 0
         self.verifications_required = 1
         # If the height is cleared from the network constants, we're
@@ -233,13 +268,30 @@ class Network(util.DaemonThread):
             os.mkdir(dir_path)
             os.chmod(dir_path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
 
+        # Raw transactions and verified merkle proofs shared by all wallets
+        self.tx_cache = TxCache(os.path.join(self.config.path, 'tx_cache'),
+                                self.config.get('tx_cache_memory_mb',
+                                                DEFAULT_MEMORY_BYTES >> 20) << 20,
+                                self.config.get('tx_cache_disk_entries', DEFAULT_DISK_ENTRIES))
+
         # subscriptions and requests
         self.subscribed_addresses = set()
+        # Subscription keys sent to the server but not yet answered
+        self.pending_subscriptions = set()
+        # (method, params) -> callbacks waiting on an in-flight shared request
+        self.shared_requests = {}
         # Requests from client we've not seen a response to
         self.unanswered_requests = {}
+        # message_id -> (server, method, params, callback) of client requests
+        # routed to servers other than the main one, and of second copies of
+        # slow requests
+        self.routed_requests = {}
+        self.hedged_requests = {}
+        # Routed requests whose server went away, to send again
+        self.pending_reroutes = []
         # retry times
         self.server_retry_time = time.time()
-        self.nodes_retry_time = time.time()
+        self.score_check_time = time.time()
         # kick off the network.  interface is the main server we are currently
         # communicating with.  interfaces is the set of servers we are connecting
         # to or have an ongoing connection with
@@ -248,6 +300,19 @@ class Network(util.DaemonThread):
         self.auto_connect = self.config.get('auto_connect', True)
         self.connecting = set()
         self.socket_queue = queue.Queue()
+        self.connection_manager = ConnectionManager(self.config.path)
+
+        metrics.gauge('network_interfaces', 'Connected servers').set_function(
+            lambda: len(self.interfaces))
+        metrics.gauge('network_unanswered_requests', 'Client requests awaiting a response'
+                      ).set_function(lambda: len(self.unanswered_requests))
+        metrics.gauge('network_subscriptions', 'Distinct subscriptions').set_function(
+            lambda: len(self.subscriptions))
+        metrics.gauge('tx_cache_hits', 'Transaction cache hits').set_function(
+            lambda: self.tx_cache.hits)
+        metrics.gauge('tx_cache_misses', 'Transaction cache misses').set_function(
+            lambda: self.tx_cache.misses)
+
         self._start_network(deserialize_server(self.default_server)[2],
                            _deserialize_proxy(self.config.get('proxy')))
 
@@ -437,7 +502,7 @@ class Network(util.DaemonThread):
                 logger.debug("connecting to %s as new interface", server_key)
                 self._set_status('connecting')
             self.connecting.add(server_key)
-            c = Connection(server_key, self.socket_queue, self.config.path)
+            self.connection_manager.connect(server_key, self.socket_queue)
 
     def _get_unavailable_servers(self):
         exclude_set = set(self.interfaces)
@@ -446,9 +511,13 @@ class Network(util.DaemonThread):
         exclude_set = exclude_set.union(self.blacklisted_servers)
         return exclude_set
 
+    def _pick_server(self, hostmap=None, protocol='s', exclude_set=None):
+        '''The best scoring eligible server, or None.'''
+        return self.server_pool.best(_get_eligible_servers(hostmap, protocol, exclude_set))
+
     def _start_random_interface(self):
         exclude_set = self._get_unavailable_servers()
-        server_key = _pick_random_server(self.get_servers(), self.protocol, exclude_set)
+        server_key = self._pick_server(self.get_servers(), self.protocol, exclude_set)
         if server_key:
             self._start_interface(server_key)
 
@@ -463,6 +532,8 @@ class Network(util.DaemonThread):
         if not hasattr(socket, "_socketobject"):
             socket._socketobject = socket.socket
             socket._getaddrinfo = socket.getaddrinfo
+        # Names may resolve differently through the proxy, or not at all
+        self.connection_manager.clear_addresses()
         if proxy:
             logger.debug("setting proxy '%s'", proxy)
             proxy_mode = proxy_modes.index(proxy["mode"]) + 1
@@ -533,25 +604,38 @@ class Network(util.DaemonThread):
             self._switch_lagging_interface()
             self._notify('updated')
 
-    def _switch_to_random_interface(self):
-        '''Switch to a random connected server other than the current one'''
+    def _switch_to_best_interface(self):
+        '''Switch to the best scoring connected server other than the current one'''
         servers = self.get_interfaces()    # Those in connected state
         if self.default_server in servers:
             servers.remove(self.default_server)
         if servers:
-            self.switch_to_interface(random.choice(servers))
+            self.switch_to_interface(self.server_pool.best(servers), self.SWITCH_SCORE)
 
     def _switch_lagging_interface(self):
         '''If auto_connect and lagging, switch interface'''
         if self._server_is_lagging() and self.auto_connect:
-            # switch to one that has the longest chain
+            # switch to the best that has the longest chain
             interfaces = self.interfaces_by_blockchain().get(Blockchain.longest())
             if interfaces:
-                choice = random.choice(interfaces)
-                self.switch_to_interface(choice.server, self.SWITCH_LAGGING)
+                choice = self.server_pool.best(i.server for i in interfaces)
+                self.switch_to_interface(choice, self.SWITCH_LAGGING)
+
+    def _switch_poor_interface(self):
+        '''If auto_connect, switch from a main server scoring much worse than
+        another on its chain.  Switching resends every subscription, so it is
+        not done for small differences.'''
+        if not self.auto_connect or not self.interface:
+            return
+        interfaces = self.interfaces_by_blockchain().get(self.interface.blockchain, [])
+        best = self.server_pool.best(i.server for i in interfaces)
+        if (best and best != self.default_server and self.server_pool.score(best) >
+                SWITCH_SCORE_RATIO * self.server_pool.score(self.default_server)):
+            self.switch_to_interface(best, self.SWITCH_SCORE)
 
     SWITCH_DEFAULT = 'SWITCH_DEFAULT'
     SWITCH_RANDOM = 'SWITCH_RANDOM'
+    SWITCH_SCORE = 'SWITCH_SCORE'
     SWITCH_LAGGING = 'SWITCH_LAGGING'
     SWITCH_SOCKET_LOOP = 'SWITCH_SOCKET_LOOP'
     SWITCH_FOLLOW_CHAIN = 'SWITCH_FOLLOW_CHAIN'
@@ -581,6 +665,7 @@ class Network(util.DaemonThread):
 
     def _close_interface(self, interface):
         if interface:
+            self.connection_manager.remember_session(interface.server, interface.socket)
             if interface.server in self.interfaces:
                 self.interfaces.pop(interface.server)
             if interface.server == self.default_server:
@@ -646,9 +731,14 @@ class Network(util.DaemonThread):
                 # callback, are only sent to the current interface,
                 # and are placed in the unanswered_requests dictionary
                 client_req = self.unanswered_requests.pop(message_id, None)
+                other_req = None if client_req else (
+                    self.routed_requests.pop(message_id, None) or
+                    self.hedged_requests.pop(message_id, None))
                 if client_req:
                     assert interface == self.interface
                     callbacks = [client_req[2]]
+                elif other_req:
+                    callbacks = [other_req[3]]
                 else:
                     # fixme: will only work for subscriptions
                     k = self._get_index(method, params)
@@ -657,9 +747,11 @@ class Network(util.DaemonThread):
                 # Copy the request method and params to the response
                 response['method'] = method
                 response['params'] = params
+                if response.get('error'):
+                    response_errors.labels(method).inc()
                 # Only once we've received a response to an addr subscription
                 # add it to the list; avoids double-sends on reconnection
-                if method == 'blockchain.scripthash.subscribe':
+                if method == 'blockchain.scripthash.subscribe' and k in self.subscriptions:
                     self.subscribed_addresses.add(params[0])
             else:
                 if not response:  # Closed remotely / misbehaving
@@ -691,18 +783,20 @@ class Network(util.DaemonThread):
         self.send(msgs, callback)
 
     # Called by synchronizer.py:on_address_status()
-    def request_scripthash_history(self, sh, callback):
-        self.send([('blockchain.scripthash.get_history', [sh])], callback)
+    def request_scripthash_history(self, sh, callback, pinned=False):
+        self.send([('blockchain.scripthash.get_history', [sh])], callback, pinned)
 
     # Called by commands.py:notify()
     # Called by websockets.py:reading_thread()
     # Called by websockets.py:run()
     # Called locally.
-    def send(self, messages, callback):
-        '''Messages is a list of (method, params) tuples'''
+    def send(self, messages, callback, pinned=False):
+        '''Messages is a list of (method, params) tuples.  Read-only requests are
+        spread across the servers following our chain unless pinned, in which
+        case they go to the main server like all other requests.'''
         if messages:
             with self.pending_sends_lock:
-                self.pending_sends.append((messages, callback))
+                self.pending_sends.append((messages, callback, pinned))
 
     def _process_pending_sends(self):
         # Requests needs connectivity.  If we don't have an interface,
@@ -713,36 +807,177 @@ class Network(util.DaemonThread):
         with self.pending_sends_lock:
             sends = self.pending_sends
             self.pending_sends = []
+            releases = self.pending_releases
+            self.pending_releases = []
+
+        self._release_subscriptions(releases)
 
-        for messages, callback in sends:
+        for method, params, callback in self.pending_reroutes:
+            self._queue_client_request(method, params, callback)
+        self.pending_reroutes = []
+
+        for messages, callback, pinned in sends:
             for method, params in messages:
-                r = None
                 if method.endswith('.subscribe'):
                     k = self._get_index(method, params)
-                    # add callback to list
-                    l = self.subscriptions.get(k, [])
-                    if callback not in l:
-                        l.append(callback)
-                    self.subscriptions[k] = l
+                    # add callback to list; the list doubles as the reference
+                    # count of the subscription across wallets
+                    with self.lock:
+                        l = self.subscriptions[k]
+                        if callback not in l:
+                            l.append(callback)
                     # check cached response for subscriptions
                     r = self.sub_cache.get(k)
-                if r is not None:
-                    logger.debug("cache hit '%s'", k)
-                    callback(r)
+                    if r is not None:
+                        logger.debug("cache hit '%s'", k)
+                        callback(r)
+                        continue
+                    # Already asked the server; the answer goes to all subscribers
+                    if k in self.pending_subscriptions:
+                        continue
+                    if (method == 'blockchain.scripthash.subscribe'
+                            and params[0] in self.subscribed_addresses):
+                        continue
+                    self.pending_subscriptions.add(k)
+                    request_callback = partial(self._on_subscription_response, k)
+                elif method in SHARED_REQUEST_METHODS:
+                    r = self._cached_response(method, params)
+                    if r is not None:
+                        callback(r)
+                        continue
+                    k = (method, json.dumps(params))
+                    waiting = self.shared_requests.get(k)
+                    if waiting is not None:
+                        logger.debug("joined in-flight request '%s'", k)
+                        waiting.append(callback)
+                        continue
+                    self.shared_requests[k] = [callback]
+                    request_callback = partial(self._on_shared_response, k)
                 else:
-                    message_id = self._queue_request(method, params)
-                    self.unanswered_requests[message_id] = method, params, callback
+                    request_callback = callback
+                self._queue_client_request(method, params, request_callback, pinned)
+
+        with self.pending_sends_lock:
+            hedges = self.pending_hedges
+            self.pending_hedges = []
+
+        for (method, params), callback in hedges:
+            interface = self._hedge_interface()
+            if interface is None:
+                callback({'method': method, 'params': params,
+                          'error': {'message': 'no other server to ask'}})
+                continue
+            hedged_requests.labels(method).inc()
+            message_id = self._queue_request(method, params, interface)
+            self.hedged_requests[message_id] = interface.server, method, params, callback
+
+    def _queue_client_request(self, method, params, callback, pinned=False):
+        if pinned or method not in ROUTED_REQUEST_METHODS:
+            interface = self.interface
+        else:
+            interface = self._route_interface()
+        message_id = self._queue_request(method, params, interface)
+        if interface is self.interface:
+            self.unanswered_requests[message_id] = method, params, callback
+        else:
+            routed_requests.labels(method).inc()
+            self.routed_requests[message_id] = interface.server, method, params, callback
+
+    def _route_interface(self):
+        '''The server to send a read-only client request to.  Of the main server
+        and those with the same chain and tip, the one with the fewest
+        outstanding requests for its score.'''
+        main = self.interface
+        candidates = [interface for interface in self.interfaces.values()
+                      if interface is main or (interface.mode == Interface.MODE_DEFAULT
+                                               and interface.blockchain is main.blockchain
+                                               and interface.tip >= main.tip)]
+        if not candidates:
+            return main
+        return min(candidates, key=lambda interface:
+                   (interface.outstanding_requests() + 1) /
+                   max(self.server_pool.score(interface.server), 1e-6))
+
+    def _hedge_interface(self):
+        '''The best scoring server to send a second copy of a client request to: a
+        connected one following the main server's chain, other than it.'''
+        interfaces = {i.server: i for i in self.interfaces_by_blockchain().get(
+            self.interface.blockchain, []) if i.mode == Interface.MODE_DEFAULT}
+        interfaces.pop(self.default_server, None)
+        best = self.server_pool.best(interfaces)
+        return interfaces[best] if best else None
+
+    def _send_hedge(self, request, callback):
+        '''Send a second copy of a client request to another server.  callback is
+        given its response, or an error response if there is no server to ask
+        or it disconnects first.'''
+        with self.pending_sends_lock:
+            self.pending_hedges.append((request, callback))
+
+    def _on_subscription_response(self, k, response):
+        self.pending_subscriptions.discard(k)
+        with self.lock:
+            callbacks = list(self.subscriptions.get(k, []))
+        for callback in callbacks:
+            callback(response)
+
+    def _cached_response(self, method, params):
+        result = None
+        if method == 'blockchain.transaction.get' and len(params) == 1:
+            result = self.tx_cache.get_tx(params[0])
+        elif method == 'blockchain.transaction.get_merkle':
+            merkle = self.tx_cache.get_merkle(params[0])
+            # A proof for another height is stale, the tx was reorged
+            if merkle is not None and merkle.get('block_height') == params[1]:
+                result = merkle
+        if result is None:
+            return None
+        return {'method': method, 'params': params, 'result': result, 'cached': True}
+
+    def _on_shared_response(self, k, response):
+        # Proofs are cached by the verifier once they check out
+        if (response.get('method') == 'blockchain.transaction.get'
+                and len(response['params']) == 1 and response.get('result')):
+            self.tx_cache.put_tx(response['params'][0], response['result'])
+        for callback in self.shared_requests.pop(k, []):
+            callback(response)
 
     # Called by synchronizer.py:release()
     def unsubscribe(self, callback):
-        '''Unsubscribe a callback to free object references to enable GC.'''
-        # Note: we can't unsubscribe from the server, so if we receive
-        # subsequent notifications _process_response() will emit a harmless
-        # "received unexpected notification" warning
+        '''Unsubscribe a callback to free object references to enable GC.  Script
+        hashes no longer watched by any callback are unsubscribed at the server.'''
+        released = []
         with self.lock:
-            for v in self.subscriptions.values():
+            for k, v in list(self.subscriptions.items()):
                 if callback in v:
                     v.remove(callback)
+                    if not v:
+                        del self.subscriptions[k]
+                        released.append(k)
+        # Called from wallet threads; the subscription state belongs to the network thread
+        if released:
+            with self.pending_sends_lock:
+                self.pending_releases.extend(released)
+
+    def _release_subscriptions(self, released):
+        with self.lock:
+            # A wallet may have subscribed again since
+            released = [k for k in released if k not in self.subscriptions]
+        prefix = 'blockchain.scripthash.subscribe:'
+        hashes = [k[len(prefix):] for k in released if k.startswith(prefix)]
+        with self.interface_lock:
+            for k in released:
+                self.sub_cache.pop(k, None)
+        for h in hashes:
+            self.subscribed_addresses.discard(h)
+        for h in hashes:
+            self._queue_client_request('blockchain.scripthash.unsubscribe', [h],
+                                       lambda response: None)
+
+    def get_subscription_count(self):
+        '''The number of scripthashes subscribed to at the server on behalf of all
+        wallets.  Each is subscribed once regardless of how many wallets watch it.'''
+        return len(self.subscribed_addresses)
 
     def _connection_down(self, server, blacklist=False):
         '''A connection to server either went down, or was never made.
@@ -753,6 +988,18 @@ class Network(util.DaemonThread):
             self.config.set_key("server_blacklist", list(self.blacklisted_servers), True)
         else:
             self.disconnected_servers.add(server)
+            self.server_pool.record_connection_failure(server)
+        for message_id, (hedge_server, method, params, callback) in list(
+                self.hedged_requests.items()):
+            if hedge_server == server:
+                del self.hedged_requests[message_id]
+                callback({'method': method, 'params': params,
+                          'error': {'message': 'server disconnected'}})
+        for message_id, (routed_server, method, params, callback) in list(
+                self.routed_requests.items()):
+            if routed_server == server:
+                del self.routed_requests[message_id]
+                self.pending_reroutes.append((method, params, callback))
         if server == self.default_server:
             self._set_status('disconnected')
         if server in self.interfaces:
@@ -764,8 +1011,10 @@ class Network(util.DaemonThread):
 
     def _new_interface(self, server_key, socket):
         self._add_recent_server(server_key)
+        self.server_pool.record_connected(server_key)
 
         interface = Interface(server_key, socket)
+        interface.response_callback = partial(self.server_pool.record_response, server_key)
         interface.requested_chunks = set()
         interface.blockchain = None
         interface.tip_raw = None
@@ -807,6 +1056,7 @@ class Network(util.DaemonThread):
             interfaces = list(self.interfaces.values())
         for interface in interfaces:
             if interface.has_timed_out():
+                self.server_pool.record_timeout(interface.server)
                 self._connection_down(interface.server)
             elif interface.ping_required():
                 self._queue_request('server.ping', [], interface)
@@ -815,19 +1065,18 @@ class Network(util.DaemonThread):
         # nodes
         with self.interface_lock:
             server_count = len(self.interfaces) + len(self.connecting)
+            # Servers that failed are retried once their backoff has passed
+            self.disconnected_servers = {server for server in self.disconnected_servers
+                                         if not self.server_pool.can_retry(server, now)}
             if server_count < self.num_server:
                 self._start_random_interface()
-                if now - self.nodes_retry_time > NODES_RETRY_INTERVAL:
-                    logger.debug('retrying connections')
-                    self.disconnected_servers = set([])
-                    self.nodes_retry_time = now
 
         # main interface
         with self.interface_lock:
             if not self.is_connected():
                 if self.auto_connect:
                     if not self.is_connecting():
-                        self._switch_to_random_interface()
+                        self._switch_to_best_interface()
                 else:
                     if self.default_server in self.disconnected_servers:
                         if now - self.server_retry_time > SERVER_RETRY_INTERVAL:
@@ -835,6 +1084,11 @@ class Network(util.DaemonThread):
                             self.server_retry_time = now
                     else:
                         self.switch_to_interface(self.default_server, self.SWITCH_SOCKET_LOOP)
+            elif now - self.score_check_time > SCORE_CHECK_INTERVAL:
+                self._switch_poor_interface()
+                self.score_check_time = now
+
+        self.server_pool.save()
 
     def _request_headers(self, interface, base_height, count):
         assert count <=2016
@@ -1064,6 +1318,7 @@ class Network(util.DaemonThread):
             if interface.unanswered_requests and time.time() - interface.request_time > 20:
                 # The last request made is still outstanding, and was over 20 seconds ago.
                 interface.logger.error("blockchain request timed out")
+                self.server_pool.record_timeout(interface.server)
                 self._connection_down(interface.server)
                 continue
 
@@ -1100,6 +1355,7 @@ class Network(util.DaemonThread):
                 self.run_jobs()    # Synchronizer and Verifier and Fx
             self._process_pending_sends()
         self._stop_network()
+        self.server_pool.save(force=True)
         self.on_stop()
 
     def _on_server_version(self, interface, version_data):
@@ -1153,6 +1409,7 @@ class Network(util.DaemonThread):
         else:
             interface.logger.info(f'Connected {header}')
             interface.blockchain = blockchain
+            self.server_pool.record_chain(interface.server, blockchain is Blockchain.longest())
             self._switch_lagging_interface()
             self._notify('updated')
             self._notify('interfaces')
@@ -1241,16 +1498,73 @@ class Network(util.DaemonThread):
     # Called by wallet.py:append_utxos_to_inputs()
     # Called by scripts/get_history.py
     def synchronous_get(self, request, timeout=30):
-        q = queue.Queue()
-        self.send([request], q.put)
-        try:
-            r = q.get(True, timeout)
-        except queue.Empty:
+        r = self._hedged_request(request, timeout)
+        if r is None:
             raise Exception('Server did not answer')
         if r.get('error'):
             raise Exception(r.get('error'))
         return r.get('result')
 
+    def _hedged_request(self, request, timeout):
+        '''Send request to the main server, and if it has not answered within its
+        hedge delay send it to the best other server too.  Returns the first
+        successful response, the first error response if every copy failed, or
+        None if no answer came within timeout seconds.'''
+        q = queue.Queue()
+        # The second copy goes to another server, so the first goes to the main one
+        self.send([request], q.put, pinned=True)
+        now = time.time()
+        deadline = now + timeout
+        # The second copy of a subscription would never be answered
+        hedge_time = deadline if request[0].endswith('.subscribe') else (
+            now + self.server_pool.hedge_delay(self.default_server))
+        outstanding = 1
+        error = None
+        while True:
+            try:
+                r = q.get(True, max(0, min(hedge_time, deadline) - time.time()))
+            except queue.Empty:
+                if time.time() >= deadline:
+                    return error
+                self._send_hedge(request, q.put)
+                outstanding += 1
+                hedge_time = deadline
+                continue
+            outstanding -= 1
+            if not r.get('error'):
+                return r
+            error = error or r
+            if not outstanding:
+                return error
+
+    # Called by commands.py:getaddressbalances()
+    # Called by commands.py:getaddresshistories()
+    # Called by commands.py:gettransactions()
+    def synchronous_get_many(self, requests, timeout=30):
+        '''Send all the requests in one go and wait for every response.  Returns
+        the results in request order; raises if any request failed.'''
+        if not requests:
+            return []
+        q = queue.Queue()
+        self.send(requests, q.put)
+        # Responses arrive in any order; match them to requests by method and params
+        slots = defaultdict(list)
+        for n, (method, params) in enumerate(requests):
+            slots[(method, json.dumps(params))].append(n)
+        results = [None] * len(requests)
+        deadline = time.time() + timeout
+        for _n in range(len(requests)):
+            try:
+                r = q.get(True, max(0, deadline - time.time()))
+            except queue.Empty:
+                raise util.TimeoutException(_('Server did not answer'))
+            if r.get('error'):
+                # Text should not be sanitized before user display
+                raise RPCError(r['error'])
+            key = (r.get('method'), json.dumps(r.get('params')))
+            results[slots[key].pop(0)] = r.get('result')
+        return results
+
     @staticmethod
     def __wait_for(it):
         """Wait for the result of calling lambda `it`."""
@@ -1280,16 +1594,16 @@ class Network(util.DaemonThread):
     # Called by main_window.py:broadcast_transaction()
     def broadcast_transaction(self, transaction):
         command = 'blockchain.transaction.broadcast'
-        invocation = lambda c: self.send([(command, [str(transaction)])], c)
         our_txid = transaction.txid()
 
-        try:
-            their_txid = Network.__wait_for(invocation)
-        except RPCError as e:
-            msg = sanitized_broadcast_message(e.args[0])
+        # Broadcasting twice is harmless, and the other server may be faster
+        response = self._hedged_request((command, [str(transaction)]), 30)
+        if response is None:
+            return False, _('Server did not answer')
+        if response.get('error'):
+            msg = sanitized_broadcast_message(response['error'])
             return False, _('transaction broadcast failed: ') + msg
-        except util.TimeoutException:
-            return False, e.args[0]
+        their_txid = response.get('result')
 
         if their_txid != our_txid:
             try:
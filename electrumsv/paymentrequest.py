@@ -23,20 +23,20 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+# The protobuf, x509, RSA and requests modules are slow to import and only needed to
+# handle a payment request, so they are imported by the functions using them.  This keeps
+# importing the payment request status constants and InvoiceStore cheap.
 import hashlib
 import json
-import requests
+import os
+import threading
 import time
 import urllib.parse
 
 from . import bitcoin
 from . import ecc
-# Create with 'protoc --proto_path=lib/ --python_out=lib/ lib/paymentrequest.proto'
-from . import paymentrequest_pb2 as pb2
-from . import rsakey
 from . import transaction
 from . import util
-from . import x509
 from .exceptions import FileImportFailed, FileImportFailedEncrypted
 from .logs import logs
 from .util import bh2u, bfh
@@ -54,14 +54,40 @@ ACK_HEADERS = {
     'User-Agent': 'ElectrumSV'
 }
 
-ca_path = requests.certs.where()
-ca_list = None
-ca_keyID = None
+_ca_store = None
+_ca_store_lock = threading.Lock()
+
+def _pb2():
+    # Create with 'protoc --proto_path=lib/ --python_out=lib/ lib/paymentrequest.proto'
+    from . import paymentrequest_pb2
+    return paymentrequest_pb2
+
+def ca_path():
+    import requests
+    return requests.certs.where()
+
+def get_ca_store():
+    '''The trusted certificate authorities, cached in the user directory.  The store loads
+    itself on first use unless preload_ca_store() was called.'''
+    global _ca_store
+    with _ca_store_lock:
+        if _ca_store is None:
+            from .app_state import app_state
+            from .x509 import CertificateStore
+            try:
+                cache_path = os.path.join(app_state.config.path, 'ca_certificates.json')
+            except AttributeError:
+                cache_path = None
+            _ca_store = CertificateStore(ca_path(), cache_path)
+        return _ca_store
 
-def load_ca_list():
-    global ca_list, ca_keyID
-    if ca_list is None:
-        ca_list, ca_keyID = x509.load_certificates(ca_path)
+def preload_ca_store():
+    '''Load the trusted certificate authorities on a background thread, so verifying the
+    first payment request does not wait for it.'''
+    thread = threading.Thread(target=lambda: get_ca_store().load(), name='ca-store',
+                              daemon=True)
+    thread.start()
+    return thread
 
 
 
@@ -74,6 +100,7 @@ PR_PAID    = 3     # send and propagated
 
 
 def get_payment_request(url):
+    import requests
     u = urllib.parse.urlparse(url)
     error = None
     response = None
@@ -124,6 +151,7 @@ class PaymentRequest:
         if self.error:
             return
         self.id = bh2u(bitcoin.sha256(r)[0:16])
+        pb2 = _pb2()
         try:
             self.data = pb2.PaymentRequest()
             self.data.ParseFromString(r)
@@ -148,7 +176,7 @@ class PaymentRequest:
         if not self.raw:
             self.error = "Empty request"
             return False
-        pr = pb2.PaymentRequest()
+        pr = _pb2().PaymentRequest()
         try:
             pr.ParseFromString(self.raw)
         except:
@@ -167,11 +195,11 @@ class PaymentRequest:
             return False
 
     def verify_x509(self, paymntreq):
-        load_ca_list()
-        if not ca_list:
+        from . import x509
+        if not len(get_ca_store()):
             self.error = "Trusted certificate authorities list not found"
             return False
-        cert = pb2.X509Certificates()
+        cert = _pb2().X509Certificates()
         cert.ParseFromString(paymntreq.pki_data)
         # verify the chain of certificates
         try:
@@ -185,17 +213,12 @@ class PaymentRequest:
         if self.requestor.startswith('*.'):
             self.requestor = self.requestor[2:]
         # verify the BIP70 signature
-        pubkey0 = rsakey.RSAKey(x.modulus, x.exponent)
         sig = paymntreq.signature
         paymntreq.signature = b''
         s = paymntreq.SerializeToString()
-        sigBytes = bytearray(sig)
-        msgBytes = bytearray(s)
-        if paymntreq.pki_type == "x509+sha256":
-            hashBytes = bytearray(hashlib.sha256(msgBytes).digest())
-            verify = pubkey0.verify(sigBytes, x509.PREFIX_RSA_SHA256 + hashBytes)
-        elif paymntreq.pki_type == "x509+sha1":
-            verify = pubkey0.hashAndVerify(sigBytes, msgBytes)
+        algo = (x509.ALGO_RSA_SHA256 if paymntreq.pki_type == "x509+sha256"
+                else x509.ALGO_RSA_SHA1)
+        verify = x509.verify_rsa_signature(x.modulus, x.exponent, algo, sig, s)
         if not verify:
             self.error = "ERROR: Invalid Signature for Payment Request Data"
             return False
@@ -266,6 +289,8 @@ class PaymentRequest:
         return self.outputs[:]
 
     def send_payment(self, raw_tx, refund_addr):
+        import requests
+        pb2 = _pb2()
         pay_det = self.details
         if not self.details.payment_url:
             return False, "no url"
@@ -278,7 +303,7 @@ class PaymentRequest:
         pm = paymnt.SerializeToString()
         payurl = urllib.parse.urlparse(pay_det.payment_url)
         try:
-            r = requests.post(payurl.geturl(), data=pm, headers=ACK_HEADERS, verify=ca_path)
+            r = requests.post(payurl.geturl(), data=pm, headers=ACK_HEADERS, verify=ca_path())
         except requests.exceptions.SSLError:
             logger.debug("Payment Message/PaymentACK verify Failed")
             try:
@@ -317,6 +342,7 @@ def make_unsigned_request(req):
     if amount is None:
         amount = 0
     memo = req['memo']
+    pb2 = _pb2()
     script = bfh(Transaction.pay_script(addr))
     outputs = [(script, amount)]
     pd = pb2.PaymentDetails()
@@ -342,12 +368,18 @@ def sign_request_with_alias(pr, alias, alias_privkey):
 
 def verify_cert_chain(chain):
     """ Verify a chain of certificates. The last certificate is the CA"""
-    load_ca_list()
-    # parse the chain
+    from . import x509
+    store = get_ca_store()
+    # parse the chain, reusing intermediate certificates verified before
     cert_num = len(chain)
     x509_chain = []
+    verified = set()
     for i in range(cert_num):
-        x = x509.X509(bytearray(chain[i]))
+        x = store.get_verified(bytes(chain[i])) if i else None
+        if x is None:
+            x = x509.X509(bytearray(chain[i]))
+        else:
+            verified.add(i)
         x509_chain.append(x)
         if i == 0:
             x.check_date()
@@ -358,44 +390,29 @@ def verify_cert_chain(chain):
         raise Exception("ERROR: CA Certificate Chain Not Provided by Payment Processor")
     # if the root CA is not supplied, add it to the chain
     ca = x509_chain[cert_num-1]
-    if ca.getFingerprint() not in ca_list:
-        keyID = ca.get_issuer_keyID()
-        f = ca_keyID.get(keyID)
-        if f:
-            root = ca_list[f]
+    if ca.getFingerprint() not in store:
+        root = store.get_by_key_id(ca.get_issuer_keyID())
+        if root:
             x509_chain.append(root)
         else:
             raise Exception("Supplied CA Not Found in Trusted CA Store.")
-    # verify the chain of signatures
-    cert_num = len(x509_chain)
-    for i in range(1, cert_num):
+    # verify the chain of signatures, stopping at an intermediate verified before
+    for i in range(1, len(x509_chain)):
         x = x509_chain[i]
         prev_x = x509_chain[i-1]
+        if i - 1 in verified:
+            break
         algo, sig, data = prev_x.get_signature()
-        sig = bytearray(sig)
-        pubkey = rsakey.RSAKey(x.modulus, x.exponent)
-        if algo == x509.ALGO_RSA_SHA1:
-            verify = pubkey.hashAndVerify(sig, data)
-        elif algo == x509.ALGO_RSA_SHA256:
-            hashBytes = bytearray(hashlib.sha256(data).digest())
-            verify = pubkey.verify(sig, x509.PREFIX_RSA_SHA256 + hashBytes)
-        elif algo == x509.ALGO_RSA_SHA384:
-            hashBytes = bytearray(hashlib.sha384(data).digest())
-            verify = pubkey.verify(sig, x509.PREFIX_RSA_SHA384 + hashBytes)
-        elif algo == x509.ALGO_RSA_SHA512:
-            hashBytes = bytearray(hashlib.sha512(data).digest())
-            verify = pubkey.verify(sig, x509.PREFIX_RSA_SHA512 + hashBytes)
-        else:
-            raise Exception("Algorithm not supported")
-            # logger.error("%s %s", self.error, algo.getComponentByName('algorithm'))
-        if not verify:
+        if not x509.verify_rsa_signature(x.modulus, x.exponent, algo, sig, data):
             raise Exception("Certificate not Signed by Provided CA Certificate Chain")
+    for x in x509_chain[1:cert_num]:
+        store.add_verified(x)
 
     return x509_chain[0], ca
 
 
 def check_ssl_config(config):
-    from . import pem
+    from . import pem, rsakey
     key_path = config.get('ssl_privkey')
     cert_path = config.get('ssl_chain')
     with open(key_path, 'r', encoding='utf-8') as f:
@@ -417,14 +434,14 @@ def check_ssl_config(config):
     return requestor
 
 def sign_request_with_x509(pr, key_path, cert_path):
-    from . import pem
+    from . import pem, rsakey, x509
     with open(key_path, 'r', encoding='utf-8') as f:
         params = pem.parse_private_key(f.read())
         privkey = rsakey.RSAKey(*params)
     with open(cert_path, 'r', encoding='utf-8') as f:
         s = f.read()
         bList = pem.dePemList(s, "CERTIFICATE")
-    certificates = pb2.X509Certificates()
+    certificates = _pb2().X509Certificates()
     certificates.certificate.extend(bytes(x) for x in bList)
     pr.pki_type = 'x509+sha256'
     pr.pki_data = certificates.SerializeToString()
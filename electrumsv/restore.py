@@ -0,0 +1,234 @@
+# Electrum SV - lightweight Bitcoin SV client
+# Copyright (C) 2019 The Electrum SV Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Address discovery for restoring wallets.
+
+The synchronizer creates a wallet's addresses one gap window at a time, and
+each window waits for subscriptions and histories before the next can be
+created, so restoring a deep wallet takes a server round trip per gap limit
+of addresses.  The RestoreEngine instead derives batches of addresses ahead
+of time for every candidate account, asks for all their histories in one
+pipelined round of requests, and repeats until every address sequence ends
+in a run of unused addresses as long as its gap limit.  The gap limit of a
+sequence grows as wider gaps between used addresses are found.
+
+The histories found are given to the wallet before its synchronizer starts,
+so the synchronizer only needs to fetch the transactions.
+'''
+
+from collections import namedtuple
+import time
+
+from .address import Address
+from .keystore import (
+    BIP32_KeyStore, bip39_to_seed, bip44_derivation, bip44_derivation_145
+)
+from .logs import logs
+
+
+logger = logs.get_logger("restore")
+
+DEFAULT_GAP_LIMIT = 20
+DEFAULT_CHANGE_GAP_LIMIT = 6
+MAX_GAP_LIMIT = 1000
+# Addresses derived ahead of need for each sequence in each round
+BATCH_SIZE = 100
+# Most history requests in one round, to stay within server session limits
+MAX_ROUND_REQUESTS = 2000
+
+# One derivation path of a seed.  name describes it to the user.
+Account = namedtuple('Account', 'name keystore')
+
+
+def bip39_accounts(seed, passphrase, count):
+    '''The accounts to look for in a BIP39 seed: the first count accounts of the
+    BIP44 derivation paths with coin type 145 and with the network's coin type.
+    The first is the default the install wizard offers.'''
+    bip32_seed = bip39_to_seed(seed, passphrase)
+    derivations = []
+    for account_id in range(count):
+        for derivation in (bip44_derivation_145(account_id), bip44_derivation(account_id)):
+            if derivation not in derivations:
+                derivations.append(derivation)
+    accounts = []
+    for derivation in derivations:
+        k = BIP32_KeyStore({})
+        k.add_xprv_from_seed(bip32_seed, 'standard', derivation)
+        accounts.append(Account(derivation, k))
+    return accounts
+
+
+def network_probe(network, timeout=60):
+    '''A probe for RestoreEngine that asks network's server for histories.'''
+    def probe(scripthashes):
+        requests = [('blockchain.scripthash.get_history', [sh]) for sh in scripthashes]
+        return network.synchronous_get_many(requests, timeout=timeout)
+    return probe
+
+
+class _Sequence(object):
+    '''The receiving or change addresses of an account.'''
+
+    def __init__(self, keystore, for_change, gap_limit):
+        self.keystore = keystore
+        self.for_change = for_change
+        self.gap_limit = gap_limit
+        self.addresses = []
+        self.histories = {}
+        self.last_used = -1
+        self.widest_gap = 0
+
+    def is_done(self):
+        return len(self.addresses) - self.last_used - 1 >= self.gap_limit
+
+    def extend(self, count):
+        '''Derive count more addresses and return them.'''
+        start = len(self.addresses)
+        for n in range(start, start + count):
+            pubkey = self.keystore.derive_pubkey(self.for_change, n)
+            self.addresses.append(Address.from_pubkey(pubkey))
+        return self.addresses[start:]
+
+    def record(self, index, history):
+        if not history:
+            return
+        self.histories[self.addresses[index]] = history
+        self.widest_gap = max(self.widest_gap, index - self.last_used - 1)
+        self.last_used = max(self.last_used, index)
+        # Users who skipped this many addresses may have skipped as many again
+        self.gap_limit = min(MAX_GAP_LIMIT, max(self.gap_limit, 2 * self.widest_gap))
+
+    def used_addresses(self):
+        return self.addresses[:self.last_used + 1]
+
+
+class AccountResult(object):
+    '''What the engine found for an account.'''
+
+    def __init__(self, account, receiving, change):
+        self.account = account
+        self.receiving = receiving
+        self.change = change
+
+    @property
+    def name(self):
+        return self.account.name
+
+    @property
+    def keystore(self):
+        return self.account.keystore
+
+    @property
+    def gap_limit(self):
+        return self.receiving.gap_limit
+
+    def histories(self):
+        '''A dict mapping each used address to its list of (tx_hash, height)
+        pairs.'''
+        result = dict(self.receiving.histories)
+        result.update(self.change.histories)
+        return result
+
+    def is_used(self):
+        return bool(self.receiving.histories or self.change.histories)
+
+    def apply_to_wallet(self, wallet):
+        '''Give the addresses and histories found to wallet, a new deterministic
+        wallet with the same keystore.  Call before starting its threads.'''
+        if self.gap_limit > wallet.gap_limit:
+            wallet.change_gap_limit(self.gap_limit)
+        histories = self.histories()
+        for sequence in (self.receiving, self.change):
+            used = sequence.used_addresses()
+            addresses = (wallet.get_change_addresses() if sequence.for_change
+                         else wallet.get_receiving_addresses())
+            while len(addresses) < len(used):
+                wallet.create_new_address(sequence.for_change)
+            for address in used:
+                if address in histories:
+                    wallet.receive_history_callback(address, histories[address], {})
+        wallet.synchronize()
+
+
+class RestoreEngine(object):
+    '''Finds the used addresses of accounts.
+
+    probe is called with a list of script hashes and returns their histories
+    in the same order, each a list of dicts with tx_hash and height keys as
+    returned by blockchain.scripthash.get_history.  network_probe() makes one
+    for a network.
+    '''
+
+    def __init__(self, probe, gap_limit=DEFAULT_GAP_LIMIT,
+                 change_gap_limit=DEFAULT_CHANGE_GAP_LIMIT, batch_size=BATCH_SIZE,
+                 max_round_requests=MAX_ROUND_REQUESTS):
+        self.probe = probe
+        self.gap_limit = gap_limit
+        self.change_gap_limit = change_gap_limit
+        self.batch_size = batch_size
+        self.max_round_requests = max_round_requests
+        self.rounds = 0
+        self.requests = 0
+
+    def scan(self, accounts, progress=None):
+        '''Scan the accounts together and return an AccountResult for each, in
+        order.  progress, if given, is called after each round with the number
+        of addresses probed so far.'''
+        start = time.time()
+        results = [AccountResult(account,
+                                 _Sequence(account.keystore, False, self.gap_limit),
+                                 _Sequence(account.keystore, True, self.change_gap_limit))
+                   for account in accounts]
+        sequences = [sequence for result in results
+                     for sequence in (result.receiving, result.change)]
+        while True:
+            batch = []
+            for sequence in sequences:
+                if sequence.is_done():
+                    continue
+                needed = sequence.last_used + 1 + sequence.gap_limit - len(sequence.addresses)
+                count = min(max(needed, self.batch_size),
+                            self.max_round_requests - len(batch))
+                if count <= 0:
+                    break
+                first = len(sequence.addresses)
+                batch.extend((sequence, first + n, address)
+                             for n, address in enumerate(sequence.extend(count)))
+            if not batch:
+                break
+            self._probe_batch(batch)
+            if progress:
+                progress(self.requests)
+
+        logger.debug("probed %d addresses of %d accounts in %d rounds in %.1fs",
+                     self.requests, len(accounts), self.rounds, time.time() - start)
+        return results
+
+    def _probe_batch(self, batch):
+        scripthashes = [address.to_scripthash_hex() for _, _, address in batch]
+        histories = self.probe(scripthashes)
+        self.rounds += 1
+        self.requests += len(batch)
+        # Record in derivation order so the gaps between used addresses are right
+        for (sequence, index, _), history in zip(batch, histories):
+            sequence.record(index, [(item['tx_hash'], item['height']) for item in history])
@@ -0,0 +1,235 @@
+# Electrum SV - lightweight Bitcoin SV client
+# Copyright (C) 2019 The Electrum SV Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Health scores of the servers the network connects to.
+
+Each server's round trip time, error and timeout rates, connection failures
+and agreement with our chain are tracked, and combined into a score the
+network uses to choose its main server, the servers it connects to, and where
+to send a second copy of a slow request.  Servers that fail to connect are
+retried after a backoff that doubles with each failure, instead of all being
+retried together on a fixed interval.  Scores are saved next to the recent
+servers list so a restarted client starts with the servers that served it
+well.
+'''
+
+import json
+import os
+import random
+import time
+
+from .logs import logs
+
+
+logger = logs.get_logger("server_pool")
+
+# Weight of each new observation in the moving averages
+ALPHA = 0.2
+# Assumed round trip time of a server not yet heard from, in seconds
+DEFAULT_RTT = 0.5
+# A server this many seconds slower than another scores half as well
+RTT_SCALE = 0.5
+# Reliability assumed of servers not yet heard from; known good ones score higher
+DEFAULT_RELIABILITY = 0.8
+# Score multiplier for servers not following our chain
+CHAIN_PENALTY = 0.1
+# Connection retry backoff, in seconds
+MIN_RETRY_DELAY = 10
+MAX_RETRY_DELAY = 3600
+# Slow requests are sent to a second server after this many round trip times,
+# bounded below and above in seconds
+HEDGE_RTT_MULTIPLE = 3
+MIN_HEDGE_DELAY = 0.5
+MAX_HEDGE_DELAY = 5.0
+# Servers kept in the scores file
+MAX_SAVED_SERVERS = 200
+SAVE_INTERVAL = 60
+
+
+class ServerStats(object):
+    '''What we have seen of one server.'''
+
+    def __init__(self, server):
+        self.server = server
+        self.rtt = None
+        self.reliability = DEFAULT_RELIABILITY
+        self.error_rate = 0.0
+        self.failures = 0
+        self.retry_time = 0
+        self.last_seen = 0
+        # Not saved; each session finds out afresh
+        self.chain_ok = True
+
+    def _observe(self, success):
+        self.reliability += ALPHA * (float(success) - self.reliability)
+
+    def record_response(self, seconds, error=False):
+        '''A response arrived seconds after its request was sent.  Error
+        responses are answers too, but a server giving many is unhealthy.'''
+        self.rtt = seconds if self.rtt is None else self.rtt + ALPHA * (seconds - self.rtt)
+        self.error_rate += ALPHA * (float(error) - self.error_rate)
+        self._observe(True)
+        self.last_seen = time.time()
+
+    def record_timeout(self):
+        self._observe(False)
+
+    def record_connected(self):
+        self.failures = 0
+        self.retry_time = 0
+        self.last_seen = time.time()
+
+    def record_connection_failure(self):
+        self._observe(False)
+        self.failures += 1
+        delay = min(MAX_RETRY_DELAY, MIN_RETRY_DELAY * 2 ** (self.failures - 1))
+        self.retry_time = time.time() + delay
+
+    def can_retry(self, now=None):
+        return (now or time.time()) >= self.retry_time
+
+    def score(self):
+        '''Higher is better.'''
+        rtt = DEFAULT_RTT if self.rtt is None else self.rtt
+        score = self.reliability * (1 - self.error_rate / 2) / (1 + rtt / RTT_SCALE)
+        if not self.chain_ok:
+            score *= CHAIN_PENALTY
+        return score
+
+    def hedge_delay(self):
+        '''Seconds to wait for an answer before asking another server.'''
+        rtt = DEFAULT_RTT if self.rtt is None else self.rtt
+        return max(MIN_HEDGE_DELAY, min(MAX_HEDGE_DELAY, HEDGE_RTT_MULTIPLE * rtt))
+
+    def to_dict(self):
+        return {'rtt': self.rtt, 'reliability': self.reliability,
+                'error_rate': self.error_rate, 'failures': self.failures,
+                'retry_time': self.retry_time, 'last_seen': self.last_seen}
+
+    @classmethod
+    def from_dict(cls, server, d):
+        stats = cls(server)
+        stats.rtt = d.get('rtt')
+        stats.reliability = float(d.get('reliability', DEFAULT_RELIABILITY))
+        stats.error_rate = float(d.get('error_rate', 0.0))
+        stats.failures = int(d.get('failures', 0))
+        stats.retry_time = float(d.get('retry_time', 0))
+        stats.last_seen = float(d.get('last_seen', 0))
+        return stats
+
+
+class ServerPool(object):
+    '''The ServerStats of every server we know of.  Only used from the network
+    thread, apart from reading hedge delays.'''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.stats = {}
+        self.save_time = time.time()
+        self.dirty = False
+        if path:
+            self._load()
+
+    def __getitem__(self, server):
+        stats = self.stats.get(server)
+        if stats is None:
+            stats = self.stats[server] = ServerStats(server)
+        return stats
+
+    def score(self, server):
+        stats = self.stats.get(server)
+        return stats.score() if stats else ServerStats(server).score()
+
+    def hedge_delay(self, server):
+        stats = self.stats.get(server)
+        return stats.hedge_delay() if stats else ServerStats(server).hedge_delay()
+
+    def record_response(self, server, seconds, error=False):
+        self[server].record_response(seconds, error)
+        self.dirty = True
+
+    def record_timeout(self, server):
+        self[server].record_timeout()
+        self.dirty = True
+
+    def record_connected(self, server):
+        self[server].record_connected()
+        self.dirty = True
+
+    def record_connection_failure(self, server):
+        stats = self[server]
+        stats.record_connection_failure()
+        logger.debug("%s failed %d times; retrying in %ds", server, stats.failures,
+                     stats.retry_time - time.time())
+        self.dirty = True
+
+    def record_chain(self, server, chain_ok):
+        self[server].chain_ok = chain_ok
+
+    def can_retry(self, server, now=None):
+        stats = self.stats.get(server)
+        return stats is None or stats.can_retry(now)
+
+    def ranked(self, servers):
+        '''servers ordered best first.  Equal scores, such as those of servers
+        not yet heard from, are in random order.'''
+        servers = list(servers)
+        random.shuffle(servers)
+        return sorted(servers, key=self.score, reverse=True)
+
+    def best(self, servers):
+        '''The best scoring of servers, or None if there are none.'''
+        ranked = self.ranked(servers)
+        return ranked[0] if ranked else None
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.stats = {server: ServerStats.from_dict(server, d)
+                          for server, d in data.items()}
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logger.exception("ignoring unreadable server scores %s", self.path)
+
+    def save(self, force=False):
+        '''Save the scores if they changed, at most every SAVE_INTERVAL seconds
+        unless forced.'''
+        if not self.path or not self.dirty:
+            return
+        now = time.time()
+        if not force and now - self.save_time < SAVE_INTERVAL:
+            return
+        kept = sorted(self.stats.values(), key=lambda stats: stats.last_seen,
+                      reverse=True)[:MAX_SAVED_SERVERS]
+        data = {stats.server: stats.to_dict() for stats in kept}
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=4, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            logger.exception("unable to save server scores")
+        self.save_time = now
+        self.dirty = False
@@ -39,7 +39,8 @@ from . import ecc
 from .address import Address
 from .keystore import bip44_derivation
 from .logs import logs
-from .util import profiler, bfh
+from .metrics import metrics, SIZE_BUCKETS
+from .util import bfh
 
 
 logger = logs.get_logger("storage")
@@ -66,6 +67,10 @@ def multisig_type(wallet_type):
 
 
 class WalletStorage:
+    _write_seconds = metrics.histogram('storage_write_seconds', 'Time taken to write a wallet')
+    _write_bytes = metrics.histogram('storage_write_bytes', 'Size of a wallet file written',
+                                     buckets=SIZE_BUCKETS)
+
     def __init__(self, path, manual_upgrades=False):
         logger.debug("wallet path '%s'", path)
         dirname = os.path.dirname(path)
@@ -172,10 +177,10 @@ class WalletStorage:
                 self.modified = True
                 self.data.pop(key)
 
-    @profiler
     def write(self):
         with self.lock:
-            self._write()
+            with self._write_seconds.time():
+                self._write()
 
     def _write(self):
         if threading.currentThread().isDaemon():
@@ -191,6 +196,7 @@ class WalletStorage:
             public_key = ecc.ECPubkey(bfh(self.pubkey))
             s = public_key.encrypt_message(c, enc_magic)
             s = s.decode('utf8')
+        self._write_bytes.observe(len(s))
 
         temp_path = "%s.tmp.%s" % (self.path, os.getpid())
         with open(temp_path, "w", encoding='utf-8') as f:
@@ -27,12 +27,16 @@ import hashlib
 from threading import Lock
 
 from .logs import logs
+from .metrics import metrics
 from .transaction import Transaction
 from .util import ThreadJob, bh2u
 
 
 logger = logs.get_logger("synchronizer")
 
+queue_sizes = metrics.gauge('synchronizer_queue', 'Outstanding synchronizer requests',
+                            ('wallet', 'queue'))
+
 
 class Synchronizer(ThreadJob):
     '''The synchronizer keeps the wallet up-to-date with its set of
@@ -52,6 +56,8 @@ class Synchronizer(ThreadJob):
         # Entries are (tx_hash, tx_height) tuples
         self.requested_tx = {}
         self.requested_histories = {}
+        # Script hashes whose history is being asked of the main server again
+        self.pinned_histories = set()
         self.requested_hashes = set()
         self.h2addr = {}
         self.lock = Lock()
@@ -69,6 +75,9 @@ class Synchronizer(ThreadJob):
 
     def release(self):
         self.network.unsubscribe(self.on_address_status)
+        for queue in ('new_addresses', 'requested_hashes', 'requested_histories',
+                      'requested_tx'):
+            queue_sizes.remove(self.wallet.storage.path, queue)
 
     def add(self, address):
         '''This can be called from the proxy or GUI threads.'''
@@ -119,6 +128,8 @@ class Synchronizer(ThreadJob):
         logger.debug("receiving history %s %s", addr, len(result))
         # Remove request; this allows up_to_date to be True
         server_status = self.requested_histories.pop(scripthash)
+        pinned = scripthash in self.pinned_histories
+        self.pinned_histories.discard(scripthash)
         hashes = set(item['tx_hash'] for item in result)
         hist = [(item['tx_hash'], item['height']) for item in result]
         # tx_fees
@@ -126,12 +137,20 @@ class Synchronizer(ThreadJob):
         tx_fees = dict(x for x in tx_fees if x[1] is not None)
         # Note if the server hasn't been patched to sort the items properly
         if hist != sorted(hist, key=lambda x:x[1]):
-            self.network.interface.logger.error("serving improperly sorted address histories")
+            logger.error("server is serving improperly sorted address histories")
         # Check that txids are unique
         if len(hashes) != len(result):
             logger.error("server history has non-unique txids: %s", addr)
         # Check that the status corresponds to what was announced
         elif self.get_status(hist) != server_status:
+            if not pinned:
+                # The history may have come from a server that has not yet seen
+                # what the main server announced; ask the main server
+                self.pinned_histories.add(scripthash)
+                self.requested_histories[scripthash] = server_status
+                self.network.request_scripthash_history(scripthash, self.on_address_history,
+                                                        pinned=True)
+                return
             logger.error("error: status mismatch: %s", addr)
         else:
             # Store received history
@@ -154,10 +173,8 @@ class Synchronizer(ThreadJob):
         self.wallet.receive_tx_callback(tx_hash, tx, tx_height)
         logger.debug("received tx %s height: %d bytes: %d",
                          tx_hash, tx_height, len(tx.raw))
-        # callbacks
+        # callbacks; wallet changes reach the GUI through the wallet's event bus
         self.network.trigger_callback('new_transaction', tx, self.wallet)
-        if not self.requested_tx:
-            self.network.trigger_callback('updated')
 
 
     def request_missing_txs(self, hist):
@@ -197,6 +214,14 @@ class Synchronizer(ThreadJob):
             self.new_addresses = set()
         self.subscribe_to_addresses(addresses)
 
+        # The path, as loaded wallets in different directories can share a name
+        wallet_path = self.wallet.storage.path
+        queue_sizes.labels(wallet_path, 'new_addresses').set(len(self.new_addresses))
+        queue_sizes.labels(wallet_path, 'requested_hashes').set(len(self.requested_hashes))
+        queue_sizes.labels(wallet_path, 'requested_histories').set(
+            len(self.requested_histories))
+        queue_sizes.labels(wallet_path, 'requested_tx').set(len(self.requested_tx))
+
         # 3. Detect if situation has changed
         up_to_date = self.is_up_to_date()
         if up_to_date != self.wallet.is_up_to_date():
@@ -0,0 +1,74 @@
+import copy
+import pickle
+import unittest
+
+from electrumsv.address import Address, Base58, Base58Error
+from electrumsv.networks import Net, SVMainnet, SVTestnet
+
+
+P2PKH_STRING = '1KXrWXciRDZUpQwQmuM1DbwsKDLYAYsVLR'
+P2PKH_CASHADDR = 'qr95sy3j9xwd2ap32xkykttr4cvcu7as4y0qverfuy'
+
+
+class TestAddress(unittest.TestCase):
+
+    def tearDown(self):
+        Net.set_to(SVMainnet)
+
+    def test_from_string_interned(self):
+        a = Address.from_string(P2PKH_STRING)
+        self.assertIs(a, Address.from_string(P2PKH_STRING))
+        self.assertEqual(a, Address.from_string(P2PKH_CASHADDR))
+
+    def test_value_semantics(self):
+        a = Address.from_string(P2PKH_STRING)
+        b = Address(a.hash160, a.kind)
+        self.assertIsNot(a, b)
+        self.assertEqual(a, b)
+        self.assertEqual(hash(a), hash(b))
+        self.assertEqual(1, len({a, b}))
+        self.assertNotEqual(a, Address(a.hash160, Address.ADDR_P2SH))
+        self.assertNotEqual(a, (a.hash160, a.kind))
+        self.assertIs(a, copy.deepcopy(a))
+        self.assertEqual(a, pickle.loads(pickle.dumps(a)))
+
+    def test_cached_forms(self):
+        a = Address.from_string(P2PKH_CASHADDR)
+        self.assertEqual(P2PKH_STRING, a.to_string())
+        self.assertEqual(P2PKH_CASHADDR, a.to_cashaddr())
+        self.assertEqual('a253a5dbc8d97745ce4350553ab33d1aa594b541a99f0084e97dfae9ed9ec004',
+                         a.to_scripthash_hex())
+        self.assertIs(a.to_scripthash_hex(), a.to_scripthash_hex())
+
+    def test_invalid_cashaddr_characters(self):
+        self.assertFalse(Address.is_valid('qqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqfnhks60\x11'))
+        self.assertFalse(Address.is_valid(P2PKH_CASHADDR + '\x00'))
+
+    def test_network_change(self):
+        a = Address.from_string(P2PKH_STRING)
+        Net.set_to(SVTestnet)
+        self.assertEqual('mz3ooahhEEzjbXR2VUKP3XACBCwF5zhQBy', a.to_string())
+        self.assertFalse(Address.is_valid(P2PKH_STRING))
+
+
+class TestBase58(unittest.TestCase):
+
+    def test_round_trip_leading_zeros(self):
+        for be_bytes in (b'\0', b'\0\0\1', b'\1\0', bytes(21), b'\xff' * 25):
+            txt = Base58.encode(be_bytes)
+            self.assertEqual(be_bytes, Base58.decode(txt))
+
+    def test_known_values(self):
+        self.assertEqual('1111111111111111111114oLvT2', Base58.encode_check(bytes(21)))
+        self.assertEqual([bytes(21)], Base58.decode_check_many(['1111111111111111111114oLvT2']))
+
+    def test_invalid_character(self):
+        for txt in ('10I', 'abc0', 'ab€'):
+            with self.assertRaises(Base58Error):
+                Base58.decode(txt)
+
+    def test_many(self):
+        payloads = [bytes([0]) + bytes([n]) * 20 for n in range(5)]
+        strings = Base58.encode_check_many(payloads)
+        self.assertEqual([Base58.encode_check(p) for p in payloads], strings)
+        self.assertEqual(payloads, Base58.decode_check_many(strings))
@@ -139,6 +139,19 @@ class TestCashAddrAddress(unittest.TestCase):
         with self.assertRaises(ValueError):
             cashaddr.decode("bitcoincash:ppm2qsznbks23z7629mms6s4cwef74vcwvn0h82")
 
+    def test_decode_control_characters(self):
+        # Control characters are not 5-bit values, even where the checksum matches
+        addr = cashaddr.encode_full(BSV_PREFIX, cashaddr.PUBKEY_TYPE, bytes(20))
+        prefix, payload = addr.split(':')
+        for n in (0, 0x11, 31):
+            for mangled in (payload[:-1] + chr(n), chr(n) + payload[1:]):
+                with self.assertRaises(ValueError) as e:
+                    cashaddr.decode(prefix + ':' + mangled)
+                self.assertTrue('invalid characters' in e.exception.args[0])
+        for c in ('\xe9', '\u20ac'):
+            with self.assertRaises(ValueError):
+                cashaddr.decode(addr[:-1] + c)
+
     def test_bad_decode_checksum(self):
         """Test whether addresses with invalid checksums fail to decode."""
         for bits_size in self.valid_sizes:
@@ -178,5 +191,12 @@ class TestCashAddrAddress(unittest.TestCase):
             self.assertEqual(kind, cashaddr.PUBKEY_TYPE)
             self.assertEqual(addr_hash, hashbytes)
 
+    def test_encode_decode_many(self):
+        items = [(cashaddr.PUBKEY_TYPE, bytes(20)), (cashaddr.SCRIPT_TYPE, bytes(range(20)))]
+        encoded = cashaddr.encode_many(BSV_PREFIX, items)
+        self.assertEqual([cashaddr.encode(BSV_PREFIX, kind, h) for kind, h in items], encoded)
+        decoded = cashaddr.decode_many([BSV_PREFIX + ':' + e for e in encoded])
+        self.assertEqual([(BSV_PREFIX, kind, h) for kind, h in items], decoded)
+
 if __name__ == '__main__':
     unittest.main()
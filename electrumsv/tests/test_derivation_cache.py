@@ -0,0 +1,90 @@
+import unittest
+
+from electrumsv import keystore
+from electrumsv.address import Address
+from electrumsv.bip32 import bip32_public_derivation, deserialize_xpub
+from electrumsv.bitcoin import bh2u
+
+
+STANDARD_SEED = 'cycle rocket west magnet parrot shuffle foot correct salt library feed song'
+OLD_SEED = ('powerful random nobody notice nothing important anyway look away hidden '
+            'message over')
+
+
+def uncached_pubkey(xpub, for_change, n):
+    child = bip32_public_derivation(xpub, '', '/%d/%d' % (for_change, n))
+    return bh2u(deserialize_xpub(child)[5])
+
+
+class TestDerivationCache(unittest.TestCase):
+
+    def test_get(self):
+        cache = keystore.DerivationCache('test', 10)
+        calls = []
+        def func():
+            calls.append(1)
+            return 'value'
+        self.assertEqual('value', cache.get('a', func))
+        self.assertEqual('value', cache.get('a', func))
+        self.assertEqual(1, len(calls))
+
+    def test_evicts_least_recently_used(self):
+        cache = keystore.DerivationCache('test', 2)
+        cache.get('a', lambda: 1)
+        cache.get('b', lambda: 2)
+        cache.get('a', lambda: 1)
+        cache.get('c', lambda: 3)
+        self.assertEqual(2, len(cache))
+        self.assertEqual(1, cache.get('a', lambda: None))
+        self.assertEqual(4, cache.get('b', lambda: 4))
+
+    def test_errors_are_not_cached(self):
+        cache = keystore.DerivationCache('test', 10)
+        with self.assertRaises(ValueError):
+            cache.get('a', lambda: int('x'))
+        self.assertEqual(0, len(cache))
+
+
+class TestKeystoreDerivation(unittest.TestCase):
+
+    def setUp(self):
+        keystore.derivation_cache.clear()
+        keystore.xpubkey_cache.clear()
+
+    def test_bip32_derive_pubkey(self):
+        ks = keystore.from_seed(STANDARD_SEED, '', False)
+        for for_change, n in [(0, 0), (0, 1), (1, 0), (0, 0), (1, 7)]:
+            self.assertEqual(uncached_pubkey(ks.xpub, for_change, n),
+                             ks.derive_pubkey(for_change, n))
+        self.assertEqual(Address.from_string('1NNkttn1YvVGdqBW4PR6zvc3Zx3H5owKRf'),
+                         Address.from_pubkey(ks.derive_pubkey(0, 0)))
+
+    def test_bip32_xpubkey(self):
+        ks = keystore.from_seed(STANDARD_SEED, '', False)
+        x_pubkey = ks.get_xpubkey(1, 3)
+        for _ in range(2):
+            xpub, derivation = keystore.parse_xpubkey(x_pubkey)
+            self.assertEqual((ks.xpub, [1, 3]), (xpub, derivation))
+            # Callers get their own list
+            derivation.append(0)
+            self.assertEqual([1, 3], ks.get_pubkey_derivation(x_pubkey))
+            pubkey, address = keystore.xpubkey_to_address(x_pubkey)
+            self.assertEqual(uncached_pubkey(ks.xpub, 1, 3), pubkey)
+            self.assertEqual(Address.from_pubkey(pubkey), address)
+
+    def test_old_keystore_xpubkey(self):
+        ks = keystore.from_seed(OLD_SEED, '', False)
+        x_pubkey = ks.get_xpubkey(0, 0)
+        for _ in range(2):
+            self.assertEqual([0, 0], ks.get_pubkey_derivation(x_pubkey))
+            pubkey, address = keystore.xpubkey_to_address(x_pubkey)
+            self.assertEqual(ks.derive_pubkey(0, 0), pubkey)
+            self.assertEqual(Address.from_string('1FJEEB8ihPMbzs2SkLmr37dHyRFzakqUmo'), address)
+
+    def test_keystores_share_derivations(self):
+        ks1 = keystore.from_seed(STANDARD_SEED, '', False)
+        ks2 = keystore.from_xpub(ks1.xpub)
+        ks1.derive_pubkey(0, 5)
+        entries = len(keystore.derivation_cache)
+        self.assertEqual(ks1.derive_pubkey(0, 5), ks2.derive_pubkey(0, 5))
+        self.assertEqual(entries, len(keystore.derivation_cache))
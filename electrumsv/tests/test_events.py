@@ -0,0 +1,62 @@
+import unittest
+
+from electrumsv.address import Address
+from electrumsv.events import WalletEventBus
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestWalletEventBus(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.wallet = object()
+        self.bus = WalletEventBus(self.wallet, interval=0.5, clock=self.clock)
+        self.deltas = []
+        self.bus.subscribe(self.deltas.append)
+        self.address = Address.from_string('1KXrWXciRDZUpQwQmuM1DbwsKDLYAYsVLR')
+
+    def test_nothing_pending(self):
+        self.assertIsNone(self.bus.flush(force=True))
+        self.assertEqual([], self.deltas)
+
+    def test_coalesces_within_interval(self):
+        self.bus.note_transaction('aa', [self.address])
+        self.clock.now += 0.2
+        self.bus.note_transaction('bb')
+        self.bus.note_address(self.address)
+        self.bus.run()
+        self.assertEqual([], self.deltas)
+        self.clock.now += 0.3
+        self.bus.run()
+        self.assertEqual(1, len(self.deltas))
+        delta = self.deltas[0]
+        self.assertIs(self.wallet, delta.wallet)
+        self.assertEqual({'aa', 'bb'}, delta.txids)
+        self.assertEqual({self.address}, delta.addresses)
+        self.assertFalse(delta.is_verification_only())
+        self.assertFalse(self.bus.has_pending())
+
+    def test_verification_only(self):
+        self.bus.note_height('aa', 100, 1, 1500000000)
+        self.bus.note_height('aa', 100, 2, 1500000000)
+        delta = self.bus.flush(force=True)
+        self.assertTrue(delta.is_verification_only())
+        self.assertEqual({'aa': (100, 2, 1500000000)}, delta.heights)
+
+    def test_failing_subscriber_does_not_block_others(self):
+        def bad_callback(delta):
+            raise ValueError()
+        self.bus.unsubscribe(self.deltas.append)
+        self.bus.subscribe(bad_callback)
+        self.bus.subscribe(self.deltas.append)
+        self.bus.note_transaction('aa')
+        self.bus.flush(force=True)
+        self.assertEqual(1, len(self.deltas))
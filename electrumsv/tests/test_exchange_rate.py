@@ -0,0 +1,172 @@
+import datetime
+from decimal import Decimal
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from electrumsv.app_state import AppStateProxy
+from electrumsv.exchange_rate import (
+    ExchangeBase, FxThread, RateHistory, RATES_HEADER, day_number
+)
+from electrumsv.simple_config import SimpleConfig
+
+
+def day(date_str):
+    return datetime.date(*map(int, date_str.split('-'))).toordinal()
+
+
+def timestamp(date_str, hour=12):
+    return datetime.datetime(*map(int, date_str.split('-')), hour).timestamp()
+
+
+class FakeExchange(ExchangeBase):
+
+    def __init__(self, history):
+        super().__init__(lambda: None, lambda: None)
+        self.requested = history
+
+    def history_ccys(self):
+        return ['USD']
+
+    def request_history(self, ccy):
+        return self.requested
+
+
+class TestRateHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.cache_dir, 'rates')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_update_and_rate(self):
+        h = RateHistory()
+        self.assertEqual(0, h.update({'2019-03-01': '10.5', '2019-03-03': 12,
+                                      'bad': 1, '2019-03-04': None}))
+        self.assertEqual(3, len(h))
+        self.assertEqual(10.5, h.rate(day('2019-03-01')))
+        self.assertIsNone(h.rate(day('2019-03-02')))
+        self.assertEqual(12.0, h.rate(day('2019-03-03')))
+        self.assertIsNone(h.rate(day('2019-02-28')))
+        self.assertIsNone(h.rate(day('2019-03-04')))
+
+    def test_update_reports_changes(self):
+        h = RateHistory()
+        h.update({'2019-03-01': 1, '2019-03-02': 2})
+        self.assertEqual(2, h.update({'2019-03-02': 2, '2019-03-05': 5}))
+        self.assertEqual(1, h.update({'2019-03-02': 3}))
+        self.assertEqual(5, h.update({}))
+        self.assertEqual(0, h.update({'2019-02-27': 0.5}))
+        self.assertEqual(0.5, h.rate(day('2019-02-27')))
+        self.assertEqual(5.0, h.rate(day('2019-03-05')))
+
+    def test_save_and_load(self):
+        h = RateHistory()
+        h.update({'2019-03-01': 1.25, '2019-03-03': 3})
+        h.save(self.filename)
+        loaded = RateHistory.load(self.filename)
+        self.assertEqual(h.first_day, loaded.first_day)
+        self.assertEqual(1.25, loaded.rate(day('2019-03-01')))
+        self.assertIsNone(loaded.rate(day('2019-03-02')))
+        self.assertEqual(RATES_HEADER.size + 3 * 8, os.path.getsize(self.filename))
+
+    def test_save_appends(self):
+        h = RateHistory()
+        h.update({'2019-03-01': 1})
+        h.save(self.filename)
+        changed_from = h.update({'2019-03-02': 2, '2019-03-03': 3})
+        self.assertEqual(1, changed_from)
+        h.save(self.filename, changed_from)
+        loaded = RateHistory.load(self.filename)
+        self.assertEqual([1.0, 2.0, 3.0], list(loaded.rates))
+        # Earlier days change the first day, so the file is rewritten
+        changed_from = h.update({'2019-02-28': 0.5})
+        h.save(self.filename, changed_from)
+        self.assertEqual([0.5, 1.0, 2.0, 3.0], list(RateHistory.load(self.filename).rates))
+
+    def test_load_invalid(self):
+        self.assertIsNone(RateHistory.load(self.filename))
+        with open(self.filename, 'wb') as f:
+            f.write(b'junk' * 10)
+        self.assertIsNone(RateHistory.load(self.filename))
+
+
+class TestExchangeHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_reads_json_cache(self):
+        exchange = FakeExchange({})
+        with open(os.path.join(self.cache_dir, 'FakeExchange_USD'), 'w') as f:
+            json.dump({'2019-03-01': '10.5'}, f)
+        h, _ = exchange.read_historical_rates('USD', self.cache_dir)
+        self.assertEqual(10.5, h.rate(day('2019-03-01')))
+
+    def test_requests_and_caches(self):
+        exchange = FakeExchange({'2019-03-01': 1, '2019-03-02': 2})
+        exchange.get_historical_rates_safe('USD', self.cache_dir)
+        self.assertEqual(2.0, exchange.day_rate('USD', day('2019-03-02')))
+        self.assertEqual(2.0, exchange.historical_rate(
+            'USD', datetime.datetime(2019, 3, 2, 23)))
+        filename = os.path.join(self.cache_dir, 'FakeExchange_USD.rates')
+        self.assertEqual(2, len(RateHistory.load(filename)))
+
+        # A fresh cache is used as it is
+        exchange = FakeExchange({'2019-03-03': 3})
+        exchange.get_historical_rates_safe('USD', self.cache_dir)
+        self.assertIsNone(exchange.day_rate('USD', day('2019-03-03')))
+        # A day old one is brought up to date
+        os.utime(filename, (0, 0))
+        exchange.get_historical_rates_safe('USD', self.cache_dir)
+        self.assertEqual(3.0, exchange.day_rate('USD', day('2019-03-03')))
+        self.assertEqual(3, len(RateHistory.load(filename)))
+
+
+class TestFxThreadRates(unittest.TestCase):
+
+    def setUp(self):
+        self.user_dir = tempfile.mkdtemp()
+        config = SimpleConfig({'electrum_path': self.user_dir, 'currency': 'USD'})
+        AppStateProxy(config, 'cmdline')
+        self.fx = FxThread(config, None)
+        self.fx.exchange.history['USD'] = history = RateHistory()
+        history.update({'2019-03-01': '100.1', '2019-03-02': '200.2'})
+
+    def tearDown(self):
+        shutil.rmtree(self.user_dir)
+
+    def test_day_number(self):
+        for ts in (0, timestamp('2019-03-01', 0), timestamp('2019-03-01', 23), 1.5e9):
+            self.assertEqual(datetime.datetime.fromtimestamp(ts).toordinal(), day_number(ts))
+
+    def test_rates_for_timestamps(self):
+        timestamps = [timestamp('2019-03-01'), timestamp('2019-03-02', 0),
+                      timestamp('2019-03-02', 23), timestamp('2019-03-05'), None]
+        self.assertEqual([Decimal('100.1'), Decimal('200.2'), Decimal('200.2'), None, None],
+                         self.fx.rates_for_timestamps(timestamps))
+
+    def test_values_for_timestamps(self):
+        timestamps = [timestamp('2019-03-01'), timestamp('2019-03-02'), timestamp('2019-03-05'),
+                      timestamp('2019-03-01')]
+        self.assertEqual([Decimal('50.05'), Decimal('-200.2'), None, None],
+                         self.fx.values_for_timestamps([50000000, -100000000, 1, None],
+                                                       timestamps))
+
+    def test_matches_history_rate(self):
+        for ts in (timestamp('2019-03-01'), timestamp('2019-03-02')):
+            date = datetime.datetime.fromtimestamp(ts)
+            self.assertEqual(self.fx.history_rate(date), self.fx.timestamp_rate(ts))
+
+    def test_uses_spot_rate_for_recent_days(self):
+        self.fx.exchange.quotes = {'USD': Decimal('300')}
+        self.assertEqual([Decimal('300')], self.fx.rates_for_timestamps([
+            datetime.datetime.now().timestamp()]))
+        self.assertTrue(self.fx.history_used_spot)
@@ -0,0 +1,100 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from bitcoinx import Headers, MissingHeader
+
+from electrumsv.app_state import app_state, AppStateProxy
+from electrumsv.blockchain import Blockchain, HeaderIndex, SEGMENT_SIZE
+from electrumsv.crypto import sha256d
+from electrumsv.networks import Net
+from electrumsv.simple_config import SimpleConfig
+
+
+def make_chunk(count, first_timestamp=1500000000):
+    '''count raw headers linked by their prev_hash fields.'''
+    prev_hash = bytes(32)
+    headers = []
+    for n in range(count):
+        raw = (struct.pack('<I', 4) + prev_hash + os.urandom(32) +
+               struct.pack('<III', first_timestamp + n * 600, 0x18015ddc, n))
+        headers.append(raw)
+        prev_hash = sha256d(raw)
+    return headers
+
+
+class TestHeaderIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.user_dir = tempfile.mkdtemp()
+        AppStateProxy(SimpleConfig({'electrum_path': self.user_dir}), 'cmdline')
+        app_state.headers = Headers.from_file(Net.COIN, os.path.join(self.user_dir, 'headers'),
+                                              Net.CHECKPOINT)
+        self.blockchains = Blockchain.blockchains
+        Blockchain.blockchains = []
+        for chain in app_state.headers.chains():
+            Blockchain.from_chain(chain)
+        self.blockchain = Blockchain.longest()
+        self.start_height = Net.CHECKPOINT.height - 10 * SEGMENT_SIZE
+        self.start_height -= self.start_height % SEGMENT_SIZE
+        self.headers = make_chunk(SEGMENT_SIZE)
+        Blockchain.connect_chunk(self.start_height, b''.join(self.headers), True)
+
+    def tearDown(self):
+        Blockchain.blockchains = self.blockchains
+        shutil.rmtree(self.user_dir)
+
+    def test_header_info_at_height(self):
+        for n in (0, 1, 1000, SEGMENT_SIZE - 1):
+            height = self.start_height + n
+            header = self.blockchain.header_at_height(height)
+            info = self.blockchain.header_info_at_height(height)
+            self.assertEqual((header.hash, header.merkle_root, header.timestamp), info)
+        with self.assertRaises(MissingHeader):
+            self.blockchain.header_info_at_height(self.start_height - 1)
+        with self.assertRaises(MissingHeader):
+            self.blockchain.header_info_at_height(Net.CHECKPOINT.height + 1)
+
+    def test_headers_at_heights(self):
+        heights = [self.start_height + 5, self.start_height - 1, self.start_height + 5,
+                   Net.CHECKPOINT.height, -1, self.start_height + 2]
+        infos = self.blockchain.headers_at_heights(heights)
+        self.assertEqual([None, None], [infos[1], infos[4]])
+        for height, info in zip(heights, infos):
+            if info is not None:
+                header = self.blockchain.header_at_height(height)
+                self.assertEqual((header.hash, header.merkle_root, header.timestamp), info)
+
+    def test_refreshed_when_headers_are_set(self):
+        height = self.start_height + 100
+        old = self.blockchain.header_info_at_height(height)
+        Blockchain.connect_chunk(self.start_height, b''.join(make_chunk(SEGMENT_SIZE)), True)
+        new = self.blockchain.header_info_at_height(height)
+        self.assertNotEqual(old.hash, new.hash)
+        self.assertEqual(self.blockchain.header_at_height(height).hash, new.hash)
+
+    def test_segments_are_bounded(self):
+        index = HeaderIndex(app_state.headers, max_segments=2)
+        chain = self.blockchain.chain
+        for height in (0, SEGMENT_SIZE, 2 * SEGMENT_SIZE, self.start_height):
+            index.lookup_many(chain, [height])
+        self.assertEqual(2, len(index._segments))
+
+    def test_reads_headers_added_later(self):
+        class FakeChain:
+            height = 10
+
+        raw_headers = make_chunk(20)
+        class FakeHeaders:
+            coin = Net.COIN
+            def raw_header_at_height(self, chain, height):
+                return raw_headers[height]
+
+        chain = FakeChain()
+        index = HeaderIndex(FakeHeaders())
+        self.assertIsNone(index.lookup_many(chain, [15])[0])
+        self.assertEqual(1500000000, index.lookup(chain, 0).timestamp)
+        chain.height = 19
+        self.assertEqual(1500000000 + 15 * 600, index.lookup(chain, 15).timestamp)
@@ -0,0 +1,108 @@
+import io
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from electrumsv.app_state import AppStateProxy, app_state
+from electrumsv.history_export import write_csv, write_history, write_json, write_ndjson
+from electrumsv.simple_config import SimpleConfig
+from electrumsv.wallet import Abstract_Wallet
+
+
+ITEMS = [
+    {'txid': 'aa', 'label': 'first', 'confirmations': 10, 'value': '1.', 'date': 'd1',
+     'input_addresses': ['x', 'y']},
+    {'txid': 'bb', 'label': 'second "quoted"', 'confirmations': 0, 'value': '-0.5',
+     'date': 'd2', 'input_addresses': []},
+]
+
+
+class FakeWallet(object):
+    '''Just enough of a wallet for the history export methods.'''
+
+    iter_export_history = Abstract_Wallet.iter_export_history
+    export_history = Abstract_Wallet.export_history
+    _export_history_chunk = Abstract_Wallet._export_history_chunk
+
+    def __init__(self, count):
+        self.history = [('%064x' % n, n + 1, count - n, 1500000000 + n * 86400, 100, 100 * n)
+                        for n in range(count)]
+        self.labels_read = []
+
+    def get_history(self, domain=None):
+        return self.history
+
+    def get_label(self, tx_hash):
+        self.labels_read.append(tx_hash)
+        return ''
+
+
+class TestWriters(unittest.TestCase):
+
+    def test_csv(self):
+        f = io.StringIO()
+        self.assertEqual(2, write_csv(iter(ITEMS), f))
+        self.assertEqual('transaction_hash,label,confirmations,value,timestamp\n'
+                         'aa,first,10,1.,d1\n'
+                         'bb,"second ""quoted""",0,-0.5,d2\n', f.getvalue())
+
+    def test_csv_columns(self):
+        f = io.StringIO()
+        write_history(iter(ITEMS), f, 'csv', show_addresses=True, show_fiat=True)
+        lines = f.getvalue().splitlines()
+        self.assertEqual('transaction_hash,label,confirmations,value,timestamp,'
+                         'fiat_value,fiat_balance,input_addresses,output_addresses', lines[0])
+        self.assertEqual('aa,first,10,1.,d1,,,x y,', lines[1])
+
+    def test_json_matches_dump(self):
+        for items in (ITEMS, ITEMS[:1], []):
+            f = io.StringIO()
+            self.assertEqual(len(items), write_json(iter(items), f))
+            self.assertEqual(json.dumps(items, indent=4), f.getvalue())
+
+    def test_ndjson(self):
+        f = io.StringIO()
+        self.assertEqual(2, write_ndjson(iter(ITEMS), f))
+        self.assertEqual(ITEMS, [json.loads(line) for line in f.getvalue().splitlines()])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            write_history([], io.StringIO(), 'xml')
+
+
+class TestIterExportHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.user_dir = tempfile.mkdtemp()
+        AppStateProxy(SimpleConfig({'electrum_path': self.user_dir}), 'cmdline')
+
+    def tearDown(self):
+        shutil.rmtree(self.user_dir)
+
+    def test_is_lazy(self):
+        wallet = FakeWallet(10)
+        items = wallet.iter_export_history(chunk_size=3)
+        self.assertEqual('%064x' % 0, next(items)['txid'])
+        self.assertEqual(1, len(wallet.labels_read))
+        self.assertEqual(10, len(list(items)) + 1)
+        self.assertEqual(10, len(wallet.labels_read))
+
+    def test_filters_before_formatting(self):
+        wallet = FakeWallet(10)
+        items = wallet.export_history(from_timestamp=1500000000 + 2 * 86400,
+                                      to_timestamp=1500000000 + 5 * 86400)
+        self.assertEqual(['%064x' % n for n in (2, 3, 4)], [item['txid'] for item in items])
+        self.assertEqual(3, len(wallet.labels_read))
+
+    def test_fiat_rates_per_chunk(self):
+        wallet = FakeWallet(5)
+        app_state.fx = fx = mock.Mock()
+        fx.rates_for_timestamps.side_effect = lambda timestamps: [1] * len(timestamps)
+        fx.value_str.side_effect = lambda value, rate: str(value * rate)
+        items = list(wallet.iter_export_history(chunk_size=2))
+        self.assertEqual([2, 2, 1], [len(call[0][0]) for call in
+                                     fx.rates_for_timestamps.call_args_list])
+        self.assertEqual(['0', '100', '200', '300', '400'],
+                         [item['fiat_balance'] for item in items])
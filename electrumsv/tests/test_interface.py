@@ -1,4 +1,11 @@
+import queue
+import ssl
+import threading
+import time
 import unittest
+from unittest import mock
+
+import requests
 
 from electrumsv import interface
 
@@ -24,3 +31,70 @@ class TestInterface(unittest.TestCase):
         self.assertTrue(i.check_host_name(
             peercert={'subject': [('commonName', 'foo.bar.com')]},
             name='foo.bar.com'))
+
+
+class FakeSSLSocket(object):
+
+    def __init__(self, context, session):
+        self.context = context
+        self.session = session
+
+
+class TestConnectionManager(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = interface.ConnectionManager(None, max_threads=2)
+
+    def test_resolve_is_cached(self):
+        with mock.patch('socket.getaddrinfo', return_value=['addr']) as getaddrinfo:
+            self.assertEqual(['addr'], self.manager.resolve('host', 1))
+            self.assertEqual(['addr'], self.manager.resolve('host', 1))
+            self.assertEqual(1, getaddrinfo.call_count)
+            self.manager.forget_address('host', 1)
+            self.manager.resolve('host', 1)
+            self.assertEqual(2, getaddrinfo.call_count)
+            self.manager.clear_addresses()
+            self.manager.resolve('host', 1)
+            self.assertEqual(3, getaddrinfo.call_count)
+
+    def test_resolve_expires(self):
+        with mock.patch('socket.getaddrinfo', return_value=['addr']) as getaddrinfo:
+            self.manager.resolve('host', 1)
+            with mock.patch('time.time', return_value=time.time() +
+                            interface.DNS_CACHE_SECONDS + 1):
+                self.manager.resolve('host', 1)
+        self.assertEqual(2, getaddrinfo.call_count)
+
+    def test_ssl_context_is_cached(self):
+        cafile = requests.certs.where()
+        context = self.manager.ssl_context(ssl.CERT_REQUIRED, cafile)
+        self.assertIs(context, self.manager.ssl_context(ssl.CERT_REQUIRED, cafile))
+        with mock.patch('os.path.getmtime', return_value=0):
+            self.assertIsNot(context, self.manager.ssl_context(ssl.CERT_REQUIRED, cafile))
+
+    def test_sessions(self):
+        context, other_context = object(), object()
+        self.assertIsNone(self.manager.session('server', context))
+        self.manager.remember_session('server', FakeSSLSocket(context, 'session'))
+        self.assertEqual('session', self.manager.session('server', context))
+        # Sessions only resume with the context that made them
+        self.assertIsNone(self.manager.session('server', other_context))
+        # Plain sockets have no session
+        self.manager.remember_session('server', object())
+        self.assertEqual('session', self.manager.session('server', context))
+        self.manager.forget_session('server')
+        self.assertIsNone(self.manager.session('server', context))
+
+    def test_threads_are_bounded(self):
+        release = threading.Event()
+        results = queue.Queue()
+        def run(connection):
+            release.wait()
+            connection.queue.put((connection.server, None))
+        with mock.patch.object(interface.TcpConnection, 'run', autospec=True, side_effect=run):
+            for n in range(5):
+                self.manager.connect('host%d:1:t' % n, results)
+            self.assertEqual(2, self.manager.threads)
+            release.set()
+            servers = {results.get(timeout=5)[0] for n in range(5)}
+        self.assertEqual({'host%d:1:t' % n for n in range(5)}, servers)
@@ -0,0 +1,201 @@
+from contextlib import contextmanager
+from functools import partial
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import jsonrpclib
+
+from electrumsv.daemon import Daemon
+from electrumsv.jsonrpc import ThreadedVerifyingJSONRPCServer, VerifyingJSONRPCServer
+from electrumsv.util import ReadWriteLock
+
+
+class TestReadWriteLock(unittest.TestCase):
+
+    def test_readers_share(self):
+        lock = ReadWriteLock()
+        lock.acquire_read()
+        acquired = threading.Event()
+        def reader():
+            with lock.read_locked():
+                acquired.set()
+        t = threading.Thread(target=reader)
+        t.start()
+        self.assertTrue(acquired.wait(2))
+        t.join()
+        lock.release_read()
+
+    def test_writer_excludes_readers(self):
+        lock = ReadWriteLock()
+        lock.acquire_write()
+        acquired = threading.Event()
+        def reader():
+            with lock.read_locked():
+                acquired.set()
+        t = threading.Thread(target=reader)
+        t.start()
+        self.assertFalse(acquired.wait(0.1))
+        lock.release_write()
+        self.assertTrue(acquired.wait(2))
+        t.join()
+
+
+class ServerTestMixin(object):
+
+    def start_server(self, server):
+        self.server = server
+        server.register_function(lambda: time.sleep(0.5) or 'slow', 'slow')
+        server.register_function(lambda x: x * 2, 'double')
+        self.thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+        host, port = server.socket.getsockname()
+        self.url = 'http://user:pass@%s:%d' % (host, port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+class TestVerifyingJSONRPCServer(ServerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.start_server(VerifyingJSONRPCServer(('127.0.0.1', 0), logRequests=False,
+                                                 rpc_user='user', rpc_password='pass'))
+
+    def test_request_stats(self):
+        client = jsonrpclib.Server(self.url)
+        self.assertEqual(4, client.double(2))
+        self.assertEqual(6, client.double(3))
+        stats = self.server.request_stats.snapshot()
+        self.assertEqual(2, stats['double']['count'])
+        self.assertEqual(0, stats['double']['errors'])
+
+    def test_bad_credentials(self):
+        client = jsonrpclib.Server(self.url.replace('pass@', 'wrong@'))
+        with self.assertRaises(Exception):
+            client.double(2)
+
+
+class TestThreadedVerifyingJSONRPCServer(ServerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.start_server(ThreadedVerifyingJSONRPCServer(
+            ('127.0.0.1', 0), logRequests=False, rpc_user='user', rpc_password='pass',
+            workers=4))
+
+    def test_slow_request_does_not_block(self):
+        slow_thread = threading.Thread(target=lambda: jsonrpclib.Server(self.url).slow())
+        slow_thread.start()
+        time.sleep(0.1)
+        start = time.time()
+        self.assertEqual(10, jsonrpclib.Server(self.url).double(5))
+        self.assertLess(time.time() - start, 0.4)
+        slow_thread.join()
+
+    def test_keep_alive(self):
+        client = jsonrpclib.Server(self.url)
+        for i in range(5):
+            self.assertEqual(i * 2, client.double(i))
+        self.assertEqual(5, self.server.request_stats.snapshot()['double']['count'])
+
+    def test_idle_connections_do_not_block(self):
+        clients = [jsonrpclib.Server(self.url) for _ in range(6)]
+        for client in clients:
+            self.assertEqual(2, client.double(1))
+        # Every worker would still be reading from an idle connection
+        start = time.time()
+        self.assertEqual(10, jsonrpclib.Server(self.url).double(5))
+        self.assertLess(time.time() - start, 0.4)
+        self.assertEqual(4, clients[0].double(2))
+
+    def test_pending_requests_are_bounded(self):
+        while self.server._slots.acquire(blocking=False):
+            pass
+        with self.assertRaises(Exception):
+            jsonrpclib.Server(self.url).double(1)
+
+    def test_busy_workers_do_not_stall_idle_connections(self):
+        client = jsonrpclib.Server(self.url)
+        self.assertEqual(2, client.double(1))
+        # Wait for the worker to hand the connection back
+        while not self.server._idle.get_map():
+            time.sleep(0.01)
+        while self.server._slots.acquire(blocking=False):
+            pass
+        # The idle connection's next request is refused rather than left waiting
+        with self.assertRaises(Exception):
+            client.double(2)
+        self.assertEqual({}, dict(self.server._idle.get_map()))
+        self.assertTrue(self.server._idle_thread.is_alive())
+
+    def test_batch_context(self):
+        batches = []
+        @contextmanager
+        def batch_context(methods):
+            batches.append(methods)
+            yield
+        self.server.batch_context = batch_context
+        client = jsonrpclib.Server(self.url)
+        batch = jsonrpclib.MultiCall(client)
+        batch.double(1)
+        batch.double(2)
+        self.assertEqual([2, 4], list(batch()))
+        self.assertEqual([['double', 'double']], batches)
+
+
+class TestDaemonBatch(ServerTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.user_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.user_dir, 'wallet')
+        self.wallet = mock.Mock()
+        self.wallet.storage.path = self.path
+        daemon = Daemon.__new__(Daemon)
+        daemon.wallets = {self.path: self.wallet}
+        daemon.wallet_locks = {}
+        daemon._batch_state = threading.local()
+        daemon.cmd_runner = mock.Mock(wallet=self.wallet)
+        daemon.cmd_runner.getbalance.return_value = {'confirmed': '1'}
+        server = ThreadedVerifyingJSONRPCServer(
+            ('127.0.0.1', 0), logRequests=False, rpc_user='user', rpc_password='pass',
+            workers=2)
+        server.register_function(daemon.run_daemon, 'daemon')
+        server.register_function(partial(daemon._run_registered_command, 'getbalance'),
+                                 'getbalance')
+        server.batch_context = daemon._batch_context
+        self.start_server(server)
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.user_dir)
+
+    def _close_wallet_batch(self, *methods):
+        client = jsonrpclib.Server(self.url)
+        batch = jsonrpclib.MultiCall(client)
+        for method in methods:
+            if method == 'daemon':
+                batch.daemon({'subcommand': 'close_wallet', 'wallet_path': self.path,
+                              'cwd': self.user_dir, 'electrum_path': self.user_dir})
+            else:
+                getattr(batch, method)()
+        results = []
+        thread = threading.Thread(target=lambda: results.extend(batch()), daemon=True)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive(), 'batch deadlocked')
+        self.wallet.stop_threads.assert_called_once_with()
+        return results
+
+    def test_close_wallet(self):
+        self.assertEqual([True], self._close_wallet_batch('daemon'))
+
+    def test_close_wallet_with_wallet_command(self):
+        self.assertEqual([{'confirmed': '1'}, True],
+                         self._close_wallet_batch('getbalance', 'daemon'))
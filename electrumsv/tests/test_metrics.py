@@ -0,0 +1,66 @@
+import unittest
+import urllib.request
+
+from electrumsv.metrics import MetricsRegistry, start_http_server
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter_labels(self):
+        counter = self.registry.counter('requests', 'Requests', ('method', ))
+        counter.labels('a').inc()
+        counter.labels('a').inc(2)
+        counter.labels('b').inc()
+        self.assertIs(counter, self.registry.counter('requests'))
+        self.assertEqual({'requests': {'a': 3, 'b': 1}}, self.registry.to_json())
+
+    def test_gauge_function(self):
+        items = [1, 2]
+        self.registry.gauge('items').set_function(lambda: len(items))
+        self.registry.gauge('level').set(7)
+        items.append(3)
+        self.assertEqual({'items': 3, 'level': 7}, self.registry.to_json())
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('size', buckets=(1, 10))
+        for value in (0.5, 5, 50):
+            histogram.observe(value)
+        self.assertEqual({'count': 3, 'sum': 55.5, 'mean': 18.5, 'max': 50},
+                         self.registry.to_json()['size'])
+        text = self.registry.to_prometheus()
+        self.assertIn('electrumsv_size_bucket{le="1"} 1\n', text)
+        self.assertIn('electrumsv_size_bucket{le="10"} 2\n', text)
+        self.assertIn('electrumsv_size_bucket{le="+Inf"} 3\n', text)
+        self.assertIn('electrumsv_size_count 3\n', text)
+
+    def test_timed(self):
+        @self.registry.timed('function_seconds')
+        def double(x):
+            '''Doubles x.'''
+            return x * 2
+        self.assertEqual(4, double(2))
+        self.assertEqual('double', double.__name__)
+        self.assertEqual('Doubles x.', double.__doc__)
+        key = TestMetricsRegistry.test_timed.__qualname__ + '.<locals>.double'
+        self.assertEqual(1, self.registry.to_json()['function_seconds'][key]['count'])
+
+    def test_kind_mismatch(self):
+        self.registry.counter('x')
+        with self.assertRaises(AssertionError):
+            self.registry.gauge('x')
+
+    def test_http_server(self):
+        self.registry.counter('hits', 'Hits', ('path', )).labels('/"a"').inc()
+        server = start_http_server('127.0.0.1', 0, self.registry)
+        try:
+            url = 'http://127.0.0.1:%d/metrics' % server.server_address[1]
+            with urllib.request.urlopen(url) as response:
+                text = response.read().decode()
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertIn('# TYPE electrumsv_hits counter\n', text)
+        self.assertIn('electrumsv_hits{path="/\\"a\\""} 1\n', text)
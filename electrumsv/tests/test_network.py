@@ -0,0 +1,316 @@
+from collections import defaultdict
+import threading
+import time
+import unittest
+
+from electrumsv.interface import ConnectionManager, Interface
+from electrumsv.network import Network
+from electrumsv.server_pool import ServerPool
+from electrumsv.tx_cache import TxCache
+
+
+class FakeInterface(object):
+
+    def __init__(self, server='main:50002:s'):
+        self.server = server
+        self.socket = None
+        self.mode = Interface.MODE_DEFAULT
+        self.blockchain = 'chain'
+        self.tip = 100
+        self.sent = []
+        self.responses = []
+        self.closed = False
+
+    def queue_request(self, method, params, message_id):
+        self.sent.append((method, params, message_id))
+
+    def outstanding_requests(self):
+        return len(self.sent) - len(self.responses)
+
+    def close(self):
+        self.closed = True
+
+    def answer(self, result, n=-1):
+        method, params, message_id = self.sent[n]
+        self.responses.append(((method, params, message_id), {'result': result}))
+
+    def answer_error(self, message, n=-1):
+        method, params, message_id = self.sent[n]
+        self.responses.append(((method, params, message_id), {'error': {'message': message}}))
+
+    def get_responses(self):
+        responses, self.responses = self.responses, []
+        return responses
+
+
+def make_network():
+    network = Network.__new__(Network)
+    network.lock = threading.Lock()
+    network.interface_lock = threading.RLock()
+    network.pending_sends_lock = threading.Lock()
+    network.pending_sends = []
+    network.pending_releases = []
+    network.pending_hedges = []
+    network.message_id = 0
+    network.debug = False
+    network.subscriptions = defaultdict(list)
+    network.sub_cache = {}
+    network.subscribed_addresses = set()
+    network.pending_subscriptions = set()
+    network.shared_requests = {}
+    network.unanswered_requests = {}
+    network.routed_requests = {}
+    network.hedged_requests = {}
+    network.pending_reroutes = []
+    network.callbacks = defaultdict(list)
+    network.disconnected_servers = set()
+    network.tx_cache = TxCache()
+    network.server_pool = ServerPool()
+    network.connection_manager = ConnectionManager(None)
+    network.interface = FakeInterface()
+    network.default_server = network.interface.server
+    network.interfaces = {network.default_server: network.interface}
+    return network
+
+
+class TestSharedRequests(unittest.TestCase):
+
+    def setUp(self):
+        self.network = make_network()
+        self.interface = self.network.interface
+
+    def _callbacks(self, count):
+        results = [[] for _ in range(count)]
+        return results, [lambda r, l=l: l.append(r['result']) for l in results]
+
+    def test_subscription_sent_once(self):
+        results, callbacks = self._callbacks(3)
+        for callback in callbacks:
+            self.network.subscribe_to_scripthashes(['aa'], callback)
+            self.network._process_pending_sends()
+        self.assertEqual(1, len(self.interface.sent))
+        self.interface.answer('status')
+        self.network._process_responses(self.interface)
+        self.assertEqual([['status']] * 3, results)
+        self.assertEqual(1, self.network.get_subscription_count())
+
+    def test_unsubscribe_releases_last_reference(self):
+        results, (cb1, cb2) = self._callbacks(2)
+        self.network.subscribe_to_scripthashes(['aa'], cb1)
+        self.network.subscribe_to_scripthashes(['aa'], cb2)
+        self.network._process_pending_sends()
+        self.interface.answer('status')
+        self.network._process_responses(self.interface)
+        self.network.unsubscribe(cb1)
+        self.network._process_pending_sends()
+        self.assertEqual(1, self.network.get_subscription_count())
+        self.network.unsubscribe(cb2)
+        self.network._process_pending_sends()
+        self.assertEqual(0, self.network.get_subscription_count())
+        self.assertEqual('blockchain.scripthash.unsubscribe', self.interface.sent[-1][0])
+
+    def test_release_applied_by_network_thread(self):
+        results, (cb1, cb2) = self._callbacks(2)
+        self.network.subscribe_to_scripthashes(['aa'], cb1)
+        self.network._process_pending_sends()
+        self.interface.answer('status')
+        self.network._process_responses(self.interface)
+        self.network.unsubscribe(cb1)
+        self.assertEqual(1, self.network.get_subscription_count())
+        # Subscribed again before the network thread got to the release
+        self.network.subscribe_to_scripthashes(['aa'], cb2)
+        self.network._process_pending_sends()
+        self.assertEqual(['blockchain.scripthash.subscribe', 'blockchain.scripthash.unsubscribe',
+                          'blockchain.scripthash.subscribe'],
+                         [method for method, _params, _id in self.interface.sent])
+        self.interface.answer('status2')
+        self.network._process_responses(self.interface)
+        self.assertEqual(1, self.network.get_subscription_count())
+        self.assertEqual([['status'], ['status2']], results)
+
+    def test_batch_responses_reach_callback(self):
+        results, (callback, ) = self._callbacks(1)
+        self.network.send([('blockchain.transaction.get', ['ff']),
+                           ('blockchain.transaction.get', ['ee']),
+                           ('blockchain.scripthash.get_history', ['aa'])], callback)
+        self.network._process_pending_sends()
+        for n, result in enumerate(['rawtx1', 'rawtx2', []]):
+            self.interface.answer(result, n)
+        self.network._process_responses(self.interface)
+        self.assertEqual([['rawtx1', 'rawtx2', []]], results)
+
+    def test_transaction_get_coalesced(self):
+        results, callbacks = self._callbacks(2)
+        for callback in callbacks:
+            self.network.send([('blockchain.transaction.get', ['ff'])], callback)
+        self.network._process_pending_sends()
+        self.assertEqual(1, len(self.interface.sent))
+        self.interface.answer('rawtx')
+        self.network._process_responses(self.interface)
+        self.assertEqual([['rawtx']] * 2, results)
+        self.assertEqual({}, self.network.shared_requests)
+        # Once answered, a new request goes to the server again
+        self.network.send([('blockchain.transaction.get', ['ff'])], callbacks[0])
+        self.network._process_pending_sends()
+        self.assertEqual(2, len(self.interface.sent))
+
+    def test_merkle_served_from_cache(self):
+        merkle = {'block_height': 100, 'pos': 1, 'merkle': []}
+        self.network.tx_cache.put_merkle('ff', merkle)
+        results, (callback, ) = self._callbacks(1)
+        self.network.send([('blockchain.transaction.get_merkle', ['ff', 100])], callback)
+        self.network._process_pending_sends()
+        self.assertEqual([], self.interface.sent)
+        self.assertEqual([[merkle]], results)
+        # Different height; the tx was reorged so the proof is stale
+        self.network.send([('blockchain.transaction.get_merkle', ['ff', 101])], callback)
+        self.network._process_pending_sends()
+        self.assertEqual(1, len(self.interface.sent))
+
+
+class TestHedgedRequests(unittest.TestCase):
+
+    def setUp(self):
+        self.network = make_network()
+        self.main = self.network.interface
+        self.other = FakeInterface('other:50002:s')
+        self.network.interfaces[self.other.server] = self.other
+        # Hedge after the minimum delay
+        self.network.server_pool.record_response(self.main.server, 0.01)
+
+    def _start(self, request, timeout=5):
+        result = {}
+        def run():
+            try:
+                result['result'] = self.network.synchronous_get(request, timeout)
+            except Exception as e:
+                result['error'] = e
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread, result
+
+    def _pump_until(self, interface, count):
+        end = time.time() + 5
+        while len(interface.sent) < count and time.time() < end:
+            self.network._process_pending_sends()
+            time.sleep(0.01)
+        self.assertEqual(count, len(interface.sent))
+
+    def test_fast_answer_is_not_hedged(self):
+        thread, result = self._start(('blockchain.estimatefee', [2]))
+        self._pump_until(self.main, 1)
+        self.main.answer(0.5)
+        self.network._process_responses(self.main)
+        thread.join()
+        self.assertEqual({'result': 0.5}, result)
+        self.assertEqual([], self.other.sent)
+
+    def test_slow_answer_is_hedged(self):
+        thread, result = self._start(('blockchain.estimatefee', [2]))
+        self._pump_until(self.main, 1)
+        self._pump_until(self.other, 1)
+        self.assertEqual(self.main.sent[0][:2], self.other.sent[0][:2])
+        self.other.answer(0.25)
+        self.network._process_responses(self.other)
+        thread.join()
+        self.assertEqual({'result': 0.25}, result)
+        self.assertEqual({}, self.network.hedged_requests)
+        # The main server's late answer goes nowhere
+        self.main.answer(0.5)
+        self.network._process_responses(self.main)
+
+    def test_error_waits_for_other_copy(self):
+        thread, result = self._start(('blockchain.transaction.broadcast', ['00']))
+        self._pump_until(self.main, 1)
+        self._pump_until(self.other, 1)
+        self.other.answer_error('txn-already-known')
+        self.network._process_responses(self.other)
+        self.main.answer('txid')
+        self.network._process_responses(self.main)
+        thread.join()
+        self.assertEqual({'result': 'txid'}, result)
+
+    def test_no_other_server(self):
+        self.other.blockchain = 'fork'
+        thread, result = self._start(('blockchain.estimatefee', [2]))
+        self._pump_until(self.main, 1)
+        time.sleep(0.6)
+        self.network._process_pending_sends()
+        self.main.answer(0.5)
+        self.network._process_responses(self.main)
+        thread.join()
+        self.assertEqual({'result': 0.5}, result)
+        self.assertEqual([], self.other.sent)
+
+
+class TestRouting(unittest.TestCase):
+
+    def setUp(self):
+        self.network = make_network()
+        self.main = self.network.interface
+        self.other = FakeInterface('other:50002:s')
+        self.network.interfaces[self.other.server] = self.other
+        self.results = []
+
+    def _send(self, method, count):
+        self.network.send([(method, ['%02x' % n]) for n in range(count)],
+                          lambda r: self.results.append(r['result']))
+        self.network._process_pending_sends()
+
+    def test_reads_are_spread(self):
+        self._send('blockchain.scripthash.get_history', 4)
+        self.assertEqual(2, len(self.main.sent))
+        self.assertEqual(2, len(self.other.sent))
+        for interface in (self.main, self.other):
+            for n in range(2):
+                interface.answer([], n)
+            self.network._process_responses(interface)
+        self.assertEqual([[]] * 4, self.results)
+        self.assertEqual({}, self.network.routed_requests)
+        self.assertEqual({}, self.network.unanswered_requests)
+
+    def test_subscriptions_are_pinned(self):
+        self._send('blockchain.scripthash.subscribe', 4)
+        self.assertEqual(4, len(self.main.sent))
+        self.assertEqual([], self.other.sent)
+        # Each subscription has just the caller's callback
+        self.assertEqual([1] * 4, [len(v) for v in self.network.subscriptions.values()])
+        for n in range(4):
+            self.main.answer('status', n)
+        self.network._process_responses(self.main)
+        self.assertEqual(['status'] * 4, self.results)
+
+    def test_pinned_requests(self):
+        self.network.send([('blockchain.scripthash.get_history', ['aa'])] * 2,
+                          lambda r: None, pinned=True)
+        self.network._process_pending_sends()
+        self.assertEqual(2, len(self.main.sent))
+
+    def test_only_servers_agreeing_on_the_tip(self):
+        self.other.tip = 99
+        self._send('blockchain.scripthash.get_balance', 2)
+        self.other.tip = 100
+        self.other.blockchain = 'fork'
+        self._send('blockchain.scripthash.get_balance', 2)
+        self.other.blockchain = 'chain'
+        self.other.mode = Interface.MODE_CATCH_UP
+        self._send('blockchain.scripthash.get_balance', 2)
+        self.assertEqual([], self.other.sent)
+
+    def test_prefers_healthier_servers(self):
+        self.network.server_pool.record_response(self.main.server, 2.0)
+        self.network.server_pool.record_response(self.other.server, 0.05)
+        self._send('blockchain.transaction.get', 6)
+        self.assertGreater(len(self.other.sent), 3)
+
+    def test_rerouted_when_server_goes_down(self):
+        self._send('blockchain.scripthash.get_history', 2)
+        self.assertEqual(1, len(self.other.sent))
+        self.network._connection_down(self.other.server)
+        self.assertTrue(self.other.closed)
+        self.network._process_pending_sends()
+        self.assertEqual(2, len(self.main.sent))
+        self.assertEqual(self.other.sent[0][:2], self.main.sent[1][:2])
+        self.main.answer([])
+        self.network._process_responses(self.main)
+        self.assertEqual([[]], self.results)
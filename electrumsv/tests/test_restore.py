@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from electrumsv import keystore
+from electrumsv.address import Address
+from electrumsv.restore import (
+    Account, RestoreEngine, bip39_accounts, network_probe, MAX_GAP_LIMIT
+)
+from electrumsv.storage import WalletStorage
+from electrumsv.wallet import Standard_Wallet
+
+
+STANDARD_SEED = 'cycle rocket west magnet parrot shuffle foot correct salt library feed song'
+BIP39_SEED = ('abandon abandon abandon abandon abandon abandon abandon abandon abandon '
+              'abandon abandon about')
+
+
+class FakeElectrumX(object):
+    '''Stands in for a server answering blockchain.scripthash.get_history.'''
+
+    def __init__(self):
+        self.histories = {}
+        self.rounds = []
+
+    def fund(self, keystore, for_change, n, height=100):
+        address = Address.from_pubkey(keystore.derive_pubkey(for_change, n))
+        tx_hash = os.urandom(32).hex()
+        self.histories.setdefault(address.to_scripthash_hex(), []).append(
+            {'tx_hash': tx_hash, 'height': height})
+        return address
+
+    def probe(self, scripthashes):
+        self.rounds.append(len(scripthashes))
+        return [self.histories.get(sh, []) for sh in scripthashes]
+
+
+def used_indices(sequence):
+    return [n for n, address in enumerate(sequence.addresses)
+            if address in sequence.histories]
+
+
+class TestRestoreEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeElectrumX()
+        self.keystore = keystore.from_seed(STANDARD_SEED, '', False)
+        self.account = Account('m', self.keystore)
+
+    def test_unused_account(self):
+        engine = RestoreEngine(self.server.probe, batch_size=1)
+        result, = engine.scan([self.account])
+        self.assertFalse(result.is_used())
+        self.assertEqual(20, len(result.receiving.addresses))
+        self.assertEqual(6, len(result.change.addresses))
+        self.assertEqual([26], self.server.rounds)
+
+    def test_finds_used_addresses(self):
+        for n in (0, 3, 10):
+            self.server.fund(self.keystore, False, n)
+        self.server.fund(self.keystore, True, 2)
+        result, = RestoreEngine(self.server.probe, batch_size=1).scan([self.account])
+        self.assertTrue(result.is_used())
+        self.assertEqual([0, 3, 10], used_indices(result.receiving))
+        self.assertEqual([2], used_indices(result.change))
+        # Every sequence ends with a full gap of unused addresses
+        self.assertEqual(10 + 1 + 20, len(result.receiving.addresses))
+        self.assertEqual(2 + 1 + 6, len(result.change.addresses))
+        self.assertEqual(4, len(result.histories()))
+
+    def test_gap_limit_grows(self):
+        # A fixed gap limit of 20 stops looking at address 35
+        for n in (0, 15, 40):
+            self.server.fund(self.keystore, False, n)
+        result, = RestoreEngine(self.server.probe, batch_size=1).scan([self.account])
+        self.assertEqual([0, 15, 40], used_indices(result.receiving))
+        self.assertEqual(48, result.gap_limit)
+
+    def test_gap_limit_is_bounded(self):
+        sequence = RestoreEngine(self.server.probe).scan([self.account])[0].receiving
+        sequence.addresses = list(range(5000))
+        sequence.record(4000, [('00' * 32, 1)])
+        self.assertEqual(MAX_GAP_LIMIT, sequence.gap_limit)
+
+    def test_deep_wallet_takes_few_rounds(self):
+        for n in range(500):
+            self.server.fund(self.keystore, False, n)
+        result, = RestoreEngine(self.server.probe).scan([self.account])
+        self.assertEqual(list(range(500)), used_indices(result.receiving))
+        # The synchronizer would take a round trip per 20 addresses
+        self.assertEqual(6, len(self.server.rounds))
+
+    def test_round_size_is_bounded(self):
+        accounts = [Account(str(n), keystore.from_seed(STANDARD_SEED, str(n), False))
+                    for n in range(3)]
+        results = RestoreEngine(self.server.probe, max_round_requests=250).scan(accounts)
+        self.assertEqual([250, 250], self.server.rounds)
+        self.assertTrue(all(result.receiving.is_done() and result.change.is_done()
+                            for result in results))
+
+    def test_accounts_share_rounds(self):
+        accounts = bip39_accounts(BIP39_SEED, '', 2)
+        self.assertEqual(["m/44'/145'/0'", "m/44'/0'/0'", "m/44'/145'/1'", "m/44'/0'/1'"],
+                         [account.name for account in accounts])
+        self.server.fund(accounts[3].keystore, False, 1)
+        results = RestoreEngine(self.server.probe).scan(accounts)
+        self.assertEqual([False, False, False, True], [r.is_used() for r in results])
+        self.assertEqual(1, len(self.server.rounds))
+
+    def test_network_probe(self):
+        network = mock.Mock()
+        network.synchronous_get_many.return_value = [[], []]
+        self.assertEqual([[], []], network_probe(network, timeout=5)(['aa', 'bb']))
+        network.synchronous_get_many.assert_called_once_with(
+            [('blockchain.scripthash.get_history', ['aa']),
+             ('blockchain.scripthash.get_history', ['bb'])], timeout=5)
+
+
+class TestApplyToWallet(unittest.TestCase):
+
+    def setUp(self):
+        self.user_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.user_dir)
+
+    def test_apply_to_wallet(self):
+        server = FakeElectrumX()
+        k = keystore.from_seed(STANDARD_SEED, '', False)
+        addresses = [server.fund(k, False, n) for n in (0, 15, 40)]
+        change = server.fund(k, True, 9)
+        result, = RestoreEngine(server.probe).scan([Account('m', k)])
+
+        storage = WalletStorage(os.path.join(self.user_dir, 'wallet'))
+        storage.put('keystore', k.dump())
+        wallet = Standard_Wallet(storage)
+        result.apply_to_wallet(wallet)
+
+        self.assertEqual(48, wallet.gap_limit)
+        self.assertEqual(addresses, [wallet.get_receiving_addresses()[n] for n in (0, 15, 40)])
+        self.assertEqual(change, wallet.get_change_addresses()[9])
+        for address in addresses + [change]:
+            self.assertEqual(1, len(wallet.get_address_history(address)))
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from electrumsv import server_pool
+from electrumsv.server_pool import ServerPool, ServerStats
+
+
+class TestServerStats(unittest.TestCase):
+
+    def test_faster_scores_better(self):
+        fast, slow = ServerStats('fast'), ServerStats('slow')
+        for _ in range(5):
+            fast.record_response(0.05)
+            slow.record_response(1.0)
+        self.assertGreater(fast.score(), slow.score())
+        self.assertGreater(fast.score(), ServerStats('new').score())
+
+    def test_failures_lower_score(self):
+        stats = ServerStats('s')
+        stats.record_response(0.1)
+        score = stats.score()
+        stats.record_timeout()
+        self.assertLess(stats.score(), score)
+        score = stats.score()
+        stats.record_response(0.1, error=True)
+        self.assertLess(stats.score(), score)
+
+    def test_chain_disagreement(self):
+        stats = ServerStats('s')
+        score = stats.score()
+        stats.chain_ok = False
+        self.assertAlmostEqual(score * server_pool.CHAIN_PENALTY, stats.score())
+
+    def test_retry_backoff(self):
+        stats = ServerStats('s')
+        now = time.time()
+        self.assertTrue(stats.can_retry(now))
+        stats.record_connection_failure()
+        self.assertFalse(stats.can_retry(now))
+        self.assertTrue(stats.can_retry(now + server_pool.MIN_RETRY_DELAY + 1))
+        for _ in range(20):
+            stats.record_connection_failure()
+        self.assertFalse(stats.can_retry(now + server_pool.MAX_RETRY_DELAY - 10))
+        self.assertTrue(stats.can_retry(now + server_pool.MAX_RETRY_DELAY + 10))
+        stats.record_connected()
+        self.assertTrue(stats.can_retry(now))
+
+    def test_hedge_delay(self):
+        stats = ServerStats('s')
+        stats.record_response(0.001)
+        self.assertEqual(server_pool.MIN_HEDGE_DELAY, stats.hedge_delay())
+        stats.rtt = 0.5
+        self.assertEqual(1.5, stats.hedge_delay())
+        stats.rtt = 10
+        self.assertEqual(server_pool.MAX_HEDGE_DELAY, stats.hedge_delay())
+
+
+class TestServerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.user_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.user_dir, 'server-scores')
+
+    def tearDown(self):
+        shutil.rmtree(self.user_dir)
+
+    def test_best(self):
+        pool = ServerPool()
+        self.assertIsNone(pool.best([]))
+        pool.record_response('a', 0.3)
+        pool.record_response('b', 0.1)
+        pool.record_connection_failure('c')
+        self.assertEqual(['b', 'a', 'c'], pool.ranked(['a', 'b', 'c']))
+        self.assertEqual('b', pool.best(iter(['c', 'b'])))
+
+    def test_save_and_load(self):
+        pool = ServerPool(self.path)
+        pool.record_response('a', 0.2, error=True)
+        pool.record_connection_failure('b')
+        pool.record_chain('a', False)
+        pool.save()
+        self.assertFalse(os.path.exists(self.path))
+        pool.save(force=True)
+        loaded = ServerPool(self.path)
+        for server in ('a', 'b'):
+            self.assertEqual(pool[server].to_dict(), loaded[server].to_dict())
+        # Chain agreement is found afresh each session
+        self.assertTrue(loaded['a'].chain_ok)
+        self.assertFalse(loaded.can_retry('b'))
+
+    def test_unreadable_file(self):
+        with open(self.path, 'w') as f:
+            f.write('junk')
+        self.assertEqual({}, ServerPool(self.path).stats)
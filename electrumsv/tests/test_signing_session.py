@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from electrumsv import keystore
+from electrumsv.app_state import AppStateProxy
+from electrumsv.commands import Commands
+from electrumsv.exceptions import InvalidPassword
+from electrumsv.simple_config import SimpleConfig
+from electrumsv.storage import WalletStorage
+from electrumsv.wallet import Standard_Wallet
+
+
+STANDARD_SEED = 'cycle rocket west magnet parrot shuffle foot correct salt library feed song'
+OLD_SEED = ('powerful random nobody notice nothing important anyway look away hidden '
+            'message over')
+WIF_PRIVKEY = 'KwdMAjGmerYanjeui5SHS7JkmpZvVipYvB2LJGU1ZxJwYvP98617'
+PASSWORD = 'secret'
+
+
+def encrypted_keystore(seed):
+    ks = keystore.from_seed(seed, '', False)
+    ks.update_password(None, PASSWORD)
+    return ks
+
+
+class TestSigningSession(unittest.TestCase):
+
+    def test_get_caches(self):
+        session = keystore.SigningSession(PASSWORD, 60)
+        calls = []
+        def func():
+            calls.append(1)
+            return b'key'
+        self.assertEqual(b'key', session.get('a', func))
+        self.assertEqual(b'key', session.get('a', func))
+        self.assertEqual(1, len(calls))
+        session.close()
+
+    def test_close_zeroes_values(self):
+        session = keystore.SigningSession(PASSWORD, 60)
+        session.get('a', lambda: b'key')
+        value = session._values['a']
+        session.close()
+        self.assertEqual(bytearray(3), value)
+        self.assertFalse(session.is_open())
+        self.assertFalse(session.matches(PASSWORD))
+
+    def test_matches(self):
+        session = keystore.SigningSession(PASSWORD, 60)
+        self.assertTrue(session.matches(PASSWORD))
+        self.assertFalse(session.matches('wrong'))
+        self.assertFalse(session.matches(None))
+        session.close()
+        self.assertTrue(keystore.SigningSession(None, 60).matches(None))
+
+    def test_expiry(self):
+        session = keystore.SigningSession(PASSWORD, 0.05)
+        session.get('a', lambda: b'key')
+        value = session._values['a']
+        time.sleep(0.2)
+        self.assertFalse(session.matches(PASSWORD))
+        self.assertEqual(bytearray(3), value)
+
+
+class TestKeyStoreSession(unittest.TestCase):
+
+    def _check_keys(self, ks, sequences):
+        expected = [ks.get_private_key(sequence, PASSWORD) for sequence in sequences]
+        ks.unlock(PASSWORD, 60)
+        self.assertTrue(ks.is_unlocked())
+        self.assertEqual(expected, [ks.get_private_key(sequence, PASSWORD)
+                                    for sequence in sequences])
+        # Cached the second time round
+        self.assertEqual(expected, [ks.get_private_key(sequence, PASSWORD)
+                                    for sequence in sequences])
+        # Other passwords do not use the session
+        with self.assertRaises(InvalidPassword):
+            ks.get_private_key(sequences[0], 'wrong')
+        session = ks._session
+        ks.lock()
+        self.assertFalse(ks.is_unlocked())
+        self.assertEqual({}, session._values)
+        self.assertEqual(expected, [ks.get_private_key(sequence, PASSWORD)
+                                    for sequence in sequences])
+
+    def test_bip32_keystore(self):
+        ks = encrypted_keystore(STANDARD_SEED)
+        self._check_keys(ks, [[0, 0], [0, 1], [1, 0], [1, 5]])
+
+    def test_bip32_keystore_caches_branches(self):
+        ks = encrypted_keystore(STANDARD_SEED)
+        ks.unlock(PASSWORD, 60)
+        ks.get_private_key([0, 0], PASSWORD)
+        ks.get_private_key([0, 1], PASSWORD)
+        self.assertEqual({'master', ('branch', (0,)), (0, 0), (0, 1)},
+                         set(ks._session._values))
+        ks.lock()
+
+    def test_old_keystore(self):
+        ks = encrypted_keystore(OLD_SEED)
+        self._check_keys(ks, [(0, 0), (0, 1), (1, 0)])
+
+    def test_imported_keystore(self):
+        ks = keystore.Imported_KeyStore({})
+        pubkey = ks.import_privkey(WIF_PRIVKEY, PASSWORD)
+        self._check_keys(ks, [pubkey])
+
+    def test_unlock_wrong_password(self):
+        ks = encrypted_keystore(STANDARD_SEED)
+        with self.assertRaises(InvalidPassword):
+            ks.unlock('wrong', 60)
+        self.assertFalse(ks.is_unlocked())
+
+    def test_update_password_locks(self):
+        ks = encrypted_keystore(STANDARD_SEED)
+        ks.unlock(PASSWORD, 60)
+        ks.update_password(PASSWORD, 'new')
+        self.assertFalse(ks.is_unlocked())
+        with self.assertRaises(InvalidPassword):
+            ks.get_private_key([0, 0], PASSWORD)
+
+
+class TestWalletSession(unittest.TestCase):
+
+    def setUp(self):
+        self.user_dir = tempfile.mkdtemp()
+        self.config = SimpleConfig({'electrum_path': self.user_dir})
+        AppStateProxy(self.config, 'cmdline')
+        storage = WalletStorage(os.path.join(self.user_dir, 'wallet'))
+        storage.put('keystore', encrypted_keystore(STANDARD_SEED).dump())
+        storage.put('use_encryption', True)
+        self.wallet = Standard_Wallet(storage)
+        self.commands = Commands(self.config, self.wallet, None)
+
+    def tearDown(self):
+        shutil.rmtree(self.user_dir)
+
+    def test_lockwallet(self):
+        self.assertTrue(self.commands.unlockwallet(timeout=60, password=PASSWORD))
+        self.assertTrue(self.wallet.keystore.is_unlocked())
+        self.assertTrue(self.commands.lockwallet())
+        self.assertFalse(self.wallet.keystore.is_unlocked())
+
+    def test_stop_threads_locks(self):
+        self.wallet.unlock_keystores(PASSWORD, 60)
+        self.wallet.stop_threads()
+        self.assertFalse(self.wallet.keystore.is_unlocked())
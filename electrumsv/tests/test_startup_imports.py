@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+import unittest
+
+
+# Modules that are slow to import and that command line invocations should not pay for
+DEFERRED_MODULES = [
+    'dns', 'google.protobuf', 'requests', 'http.server',
+    'electrumsv.dnssec', 'electrumsv.exchange_rate', 'electrumsv.jsonrpc',
+    'electrumsv.network', 'electrumsv.paymentrequest_pb2', 'electrumsv.rsakey',
+    'electrumsv.wallet', 'electrumsv.x509',
+]
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def imported_modules(module, candidates):
+    '''The candidates imported as a side effect of importing module in a new
+    interpreter.'''
+    code = (f'import sys, {module}\n'
+            f'print(" ".join(m for m in {candidates!r} if m in sys.modules))')
+    env = dict(os.environ, PYTHONPATH=PACKAGE_DIR)
+    output = subprocess.check_output([sys.executable, '-c', code], env=env,
+                                     universal_newlines=True)
+    return output.split()
+
+
+class TestStartupImports(unittest.TestCase):
+
+    def test_main_defers_heavy_modules(self):
+        self.assertEqual([], imported_modules('electrumsv.main', DEFERRED_MODULES))
+
+    def test_daemon_client_defers_heavy_modules(self):
+        self.assertEqual([], imported_modules('electrumsv.daemon', DEFERRED_MODULES))
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from electrumsv.tests.test_transaction import signed_blob, v2_blob
+from electrumsv.tx_cache import TxCache, raw_tx_hash
+
+
+class TestTxCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_rejects_wrong_hash(self):
+        cache = TxCache()
+        self.assertFalse(cache.put_tx('00' * 32, signed_blob))
+        self.assertIsNone(cache.get_tx('00' * 32))
+
+    def test_persists_to_disk(self):
+        tx_hash = raw_tx_hash(signed_blob)
+        merkle = {'block_height': 5, 'pos': 0, 'merkle': ['ab' * 32]}
+        cache = TxCache(self.path)
+        self.assertTrue(cache.put_tx(tx_hash, signed_blob))
+        cache.put_merkle(tx_hash, merkle)
+        cache = TxCache(self.path)
+        self.assertEqual(signed_blob, cache.get_tx(tx_hash))
+        self.assertEqual(merkle, cache.get_merkle(tx_hash))
+        cache.discard_merkle(tx_hash)
+        self.assertIsNone(TxCache(self.path).get_merkle(tx_hash))
+
+    def test_memory_lru(self):
+        cache = TxCache(max_memory_bytes=len(signed_blob) + 1)
+        hash1, hash2 = raw_tx_hash(signed_blob), raw_tx_hash(v2_blob)
+        cache.put_tx(hash1, signed_blob)
+        cache.put_tx(hash2, v2_blob)
+        self.assertIsNone(cache.get_tx(hash1))
+        self.assertEqual(v2_blob, cache.get_tx(hash2))
+
+    def test_disk_pruning(self):
+        cache = TxCache(self.path, max_disk_entries=1)
+        hash1, hash2 = raw_tx_hash(signed_blob), raw_tx_hash(v2_blob)
+        cache.put_tx(hash1, signed_blob)
+        cache.put_tx(hash2, v2_blob)
+        self.assertEqual(1, cache.disk_entries)
+        self.assertEqual(v2_blob, TxCache(self.path).get_tx(hash2))
+
+    def test_damaged_disk_entries(self):
+        tx_hash = raw_tx_hash(signed_blob)
+        cache = TxCache(self.path)
+        cache.put_tx(tx_hash, signed_blob)
+        cache.put_merkle(tx_hash, {'block_height': 5, 'pos': 0, 'merkle': []})
+        tx_file = os.path.join(self.path, tx_hash + '.tx')
+        merkle_file = os.path.join(self.path, tx_hash + '.merkle')
+        with open(tx_file, 'w') as f:
+            f.write(signed_blob[:-10])
+        with open(merkle_file, 'w') as f:
+            f.write('{"block_height": 5, "po')
+        cache = TxCache(self.path)
+        self.assertIsNone(cache.get_tx(tx_hash))
+        self.assertIsNone(cache.get_merkle(tx_hash))
+        self.assertFalse(os.path.exists(tx_file))
+        self.assertFalse(os.path.exists(merkle_file))
+        self.assertEqual(0, cache.disk_entries)
+        # The entry can be cached again
+        self.assertTrue(cache.put_tx(tx_hash, signed_blob))
+        self.assertEqual(signed_blob, TxCache(self.path).get_tx(tx_hash))
+
+    def test_writes_leave_no_temporary_files(self):
+        tx_hash = raw_tx_hash(signed_blob)
+        TxCache(self.path).put_tx(tx_hash, signed_blob)
+        self.assertEqual([tx_hash + '.tx'], os.listdir(self.path))
+        with open(os.path.join(self.path, tx_hash + '.tx.tmp.1'), 'w') as f:
+            f.write('partial')
+        TxCache(self.path)
+        self.assertEqual([tx_hash + '.tx'], os.listdir(self.path))
+
+    def test_malformed_tx_hash(self):
+        cache = TxCache(self.path)
+        for tx_hash in ('../wallet', 'AB' * 32, 'ab' * 31, None):
+            self.assertIsNone(cache.get_tx(tx_hash))
+            self.assertIsNone(cache.get_merkle(tx_hash))
+            cache.put_merkle(tx_hash, {'block_height': 5})
+            cache.discard_merkle(tx_hash)
+        self.assertEqual([], os.listdir(self.path))
@@ -0,0 +1,53 @@
+import unittest
+from unittest import mock
+
+from electrumsv.verifier import SPV, backlog
+
+
+TX_HASH = 'ab' * 32
+
+
+class TestVerifyMerkle(unittest.TestCase):
+
+    def setUp(self):
+        self.network = mock.Mock()
+        self.wallet = mock.Mock()
+        self.wallet.is_up_to_date.return_value = False
+        self.spv = SPV(self.network, self.wallet)
+        self.wallet.verifier = self.spv
+        self.merkle = {'block_height': 100, 'pos': 0, 'merkle': []}
+        header = self.network.blockchain.return_value.header_info_at_height.return_value
+        header.merkle_root = SPV.hash_merkle_root([], TX_HASH, 0)
+        header.timestamp = 1500000000
+
+    def response(self, **kwargs):
+        response = {'params': [TX_HASH, 100], 'result': self.merkle}
+        response.update(kwargs)
+        return response
+
+    def test_caches_proofs_from_servers(self):
+        self.spv.verify_merkle(self.response())
+        self.network.tx_cache.put_merkle.assert_called_once_with(TX_HASH, self.merkle)
+        self.wallet.add_verified_tx.assert_called_once_with(TX_HASH, (100, 1500000000, 0))
+
+    def test_does_not_rewrite_cached_proofs(self):
+        self.spv.verify_merkle(self.response(cached=True))
+        self.network.tx_cache.put_merkle.assert_not_called()
+        self.wallet.add_verified_tx.assert_called_once_with(TX_HASH, (100, 1500000000, 0))
+
+
+class TestBacklogMetrics(unittest.TestCase):
+
+    def test_release_keeps_wallets_with_the_same_name(self):
+        spvs = []
+        for path in ('/a/wallet', '/b/wallet'):
+            wallet = mock.Mock()
+            wallet.storage.path = path
+            wallet.basename.return_value = 'wallet'
+            spvs.append(SPV(mock.Mock(), wallet))
+            backlog.labels(path, 'unverified').set(1)
+        self.addCleanup(spvs[1].release)
+        spvs[0].release()
+        labels = [values for values, child in backlog.samples()]
+        self.assertNotIn(('/a/wallet', 'unverified'), labels)
+        self.assertIn(('/b/wallet', 'unverified'), labels)
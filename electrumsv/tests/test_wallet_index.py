@@ -0,0 +1,197 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from electrumsv.address import Address
+from electrumsv.bitcoin import TYPE_ADDRESS
+from electrumsv.storage import WalletStorage
+from electrumsv.wallet import ImportedAddressWallet
+from electrumsv.wallet_index import (
+    AddressHistory, PrunedTxoTable, ReverseHistory, TransactionMap, TxInput, TxInputTable,
+    TxOutput, TxRecordTable
+)
+from electrumsv.tests.test_transaction import signed_blob, v2_blob
+
+
+ADDRESS_A = Address.from_string('1MYXdf4moacvaEKZ57ozerpJ3t9xSeN6LK')
+ADDRESS_B = Address.from_string('13Vp8Y3hD5Cb6sERfpxePz5vGJizXbWciN')
+OTHER = Address.from_string('1KXrWXciRDZUpQwQmuM1DbwsKDLYAYsVLR')
+TX1 = '11' * 32
+TX2 = '22' * 32
+SIGNED_TXID = '5be81c4757eb478494eafefe974516bba91c5e3d05b93f669a220a4e9df5102b'
+V2_TXID = 'b97f9180173ab141b61b9f944d841e60feec691d6daab4d4d932b24dd36606fe'
+
+
+class FakeTransaction(object):
+
+    def __init__(self, inputs, outputs):
+        self._inputs = inputs
+        self._outputs = outputs
+
+    def inputs(self):
+        return self._inputs
+
+    def outputs(self):
+        return self._outputs
+
+
+def spend(prevout_hash, prevout_n, address):
+    return {'type': 'p2pkh', 'prevout_hash': prevout_hash, 'prevout_n': prevout_n,
+            'address': address}
+
+
+class TestTables(unittest.TestCase):
+
+    def test_txi_json_round_trip(self):
+        d = {TX2: {ADDRESS_A.to_string(): [[TX1 + ':0', 1000], [TX1 + ':3', 5]]}, TX1: {}}
+        table = TxRecordTable(TxInput)
+        table.load_json(d)
+        self.assertEqual(d, table.to_json())
+        self.assertEqual((), table.get(TX1))
+        self.assertIsNone(table.get('33' * 32))
+        self.assertFalse(table.has_records(TX1))
+        self.assertEqual([0, 3], [txin.prevout_n for txin in table.for_address(TX2, ADDRESS_A)])
+        self.assertEqual([], table.for_address(TX2, ADDRESS_B))
+
+    def test_txo_json_round_trip(self):
+        d = {TX1: {ADDRESS_A.to_string(): [[0, 1000, False]],
+                   ADDRESS_B.to_string(): [[1, 20, True]]}}
+        table = TxRecordTable(TxOutput)
+        table.load_json(d)
+        self.assertEqual(d, table.to_json())
+        self.assertEqual([ADDRESS_A, ADDRESS_B], list(table.addresses(TX1)))
+        self.assertIs(ADDRESS_A, table.get(TX1)[0].address)
+
+    def test_txi_spent_by_index(self):
+        table = TxInputTable()
+        table.load_json({TX2: {ADDRESS_A.to_string(): [[TX1 + ':0', 1000],
+                                                       ['33' * 32 + ':1', 5]]}})
+        self.assertEqual([TX2], table.spenders(TX1))
+        self.assertEqual([(0, TX2)], table.unspend(TX1))
+        self.assertEqual([], table.spenders(TX1))
+        self.assertEqual(['33' * 32 + ':1'],
+                         [txin.prevout_string() for txin in table.get(TX2)])
+        self.assertEqual([], table.unspend(TX1))
+        table.pop(TX2)
+        self.assertEqual([], table.spenders('33' * 32))
+
+    def test_pruned_txo(self):
+        table = PrunedTxoTable()
+        table.load_json({TX1 + ':2': TX2})
+        self.assertTrue(table.has_spender(TX2))
+        self.assertEqual({TX1 + ':2': TX2}, table.to_json())
+        self.assertIsNone(table.pop(TX1, 1))
+        self.assertEqual(TX2, table.pop(TX1, 2))
+        self.assertFalse(table.has_spender(TX2))
+        table.add(TX1, 0, TX2)
+        table.add(TX1, 1, TX2)
+        table.remove_spender(TX2)
+        self.assertEqual(0, len(table))
+        self.assertFalse(table.has_spender(TX2))
+
+    def test_address_history(self):
+        history = AddressHistory()
+        history.load_json({ADDRESS_A.to_string(): [[TX1, 100], [TX2, -1]],
+                           ADDRESS_B.to_string(): []})
+        self.assertEqual([(TX1, 100), (TX2, -1)], history[ADDRESS_A])
+        self.assertEqual([], history.get(ADDRESS_B))
+        self.assertTrue(history.is_empty(ADDRESS_B))
+        self.assertTrue(history.is_empty(OTHER))
+        self.assertEqual({ADDRESS_A.to_string(): [[TX1, 100], [TX2, -1]],
+                          ADDRESS_B.to_string(): []}, history.to_json())
+
+    def test_reverse_history(self):
+        reverse = ReverseHistory()
+        reverse.add(TX1, ADDRESS_A)
+        reverse.add(TX1, ADDRESS_B)
+        reverse.add(TX1, ADDRESS_A)
+        self.assertEqual((ADDRESS_A, ADDRESS_B), reverse.get(TX1))
+        self.assertFalse(reverse.remove(TX1, ADDRESS_A))
+        self.assertTrue(reverse.remove(TX1, ADDRESS_B))
+        self.assertNotIn(TX1, reverse)
+
+    def test_transaction_map(self):
+        transactions = TransactionMap()
+        transactions.load_json({SIGNED_TXID: signed_blob, V2_TXID: v2_blob})
+        self.assertEqual(2, len(transactions))
+        self.assertIn(V2_TXID, transactions)
+        self.assertIsNone(transactions.get(TX1))
+        tx = transactions[SIGNED_TXID]
+        self.assertIs(tx, transactions[SIGNED_TXID])
+        self.assertEqual(SIGNED_TXID, tx.txid())
+        del transactions[V2_TXID]
+        self.assertEqual({SIGNED_TXID: signed_blob}, transactions.to_json())
+        self.assertEqual([SIGNED_TXID], list(transactions))
+
+
+class TestWalletTransactions(unittest.TestCase):
+
+    def setUp(self):
+        self.user_dir = tempfile.mkdtemp()
+        storage = WalletStorage(os.path.join(self.user_dir, 'wallet'))
+        self.wallet = ImportedAddressWallet.from_text(
+            storage, ' '.join([ADDRESS_A.to_string(), ADDRESS_B.to_string()]))
+        # TX1 pays 1000 to A; TX2 spends it, paying 600 to B and 400 elsewhere
+        self.tx1 = FakeTransaction([spend('33' * 32, 0, OTHER)],
+                                   [(TYPE_ADDRESS, ADDRESS_A, 1000)])
+        self.tx2 = FakeTransaction([spend(TX1, 0, ADDRESS_A)],
+                                   [(TYPE_ADDRESS, ADDRESS_B, 600), (TYPE_ADDRESS, OTHER, 400)])
+
+    def tearDown(self):
+        shutil.rmtree(self.user_dir)
+
+    def test_spend_before_funding(self):
+        wallet = self.wallet
+        wallet.add_transaction(TX2, self.tx2)
+        self.assertEqual({TX1 + ':0': TX2}, wallet.pruned_txo.to_json())
+        self.assertIsNone(wallet.get_tx_delta(TX2, ADDRESS_A))
+
+        wallet.add_transaction(TX1, self.tx1)
+        self.assertEqual(0, len(wallet.pruned_txo))
+        self.assertEqual(-1000, wallet.get_tx_delta(TX2, ADDRESS_A))
+        self.assertEqual(600, wallet.get_tx_delta(TX2, ADDRESS_B))
+        self.assertEqual(1000, wallet.get_tx_delta(TX1, ADDRESS_A))
+
+        wallet.remove_transaction(TX1)
+        self.assertEqual({TX1 + ':0': TX2}, wallet.pruned_txo.to_json())
+        self.assertEqual([], wallet.txi.for_address(TX2, ADDRESS_A))
+
+    def test_addr_io_and_storage(self):
+        wallet = self.wallet
+        wallet.add_transaction(TX1, self.tx1)
+        wallet.add_transaction(TX2, self.tx2)
+        wallet._history[ADDRESS_A] = [(TX1, 100), (TX2, 101)]
+        received, sent = wallet.get_addr_io(ADDRESS_A)
+        self.assertEqual({TX1 + ':0': (100, 1000, False)}, received)
+        self.assertEqual({TX1 + ':0': 101}, sent)
+
+        wallet.save_transactions()
+        storage = wallet.storage
+        self.assertEqual({TX1: {}, TX2: {ADDRESS_A.to_string(): [[TX1 + ':0', 1000]]}},
+                         storage.get('txi'))
+        self.assertEqual({TX1: {ADDRESS_A.to_string(): [[0, 1000, False]]},
+                          TX2: {ADDRESS_B.to_string(): [[0, 600, False]]}},
+                         storage.get('txo'))
+        self.assertEqual([[TX1, 100], [TX2, 101]],
+                         storage.get('addr_history')[ADDRESS_A.to_string()])
+
+    def test_load_report(self):
+        wallet = self.wallet
+        self.assertEqual((), wallet.tx_addr_hist.get(TX1))
+        report = wallet.get_load_report()
+        self.assertTrue(report['complete'])
+        self.assertEqual(2, report['addresses'])
+        for phase in ('address_history', 'transactions', 'reverse_history', 'invoices'):
+            self.assertIn(phase, report['phases'])
+
+    def test_deferred_load_error(self):
+        error = ValueError('bad invoices')
+        with mock.patch('electrumsv.wallet.InvoiceStore', side_effect=error):
+            wallet = ImportedAddressWallet(self.wallet.storage)
+            with self.assertRaises(ValueError) as e:
+                wallet.invoices
+        self.assertIs(error, e.exception)
+        with self.assertRaises(ValueError):
+            wallet.tx_addr_hist
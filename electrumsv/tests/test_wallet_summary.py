@@ -0,0 +1,115 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from electrumsv import keystore
+from electrumsv.app_state import AppStateProxy
+from electrumsv.main import run_offline_command
+from electrumsv.simple_config import SimpleConfig
+from electrumsv.storage import WalletStorage
+from electrumsv.wallet import Standard_Wallet
+from electrumsv.wallet_summary import (
+    WalletSummary, can_answer, summary_path, write_summary
+)
+
+
+STANDARD_SEED = 'cycle rocket west magnet parrot shuffle foot correct salt library feed song'
+TX_HASH = 'aa' * 32
+
+
+def set_label(wallet, name, text):
+    # Wallet.set_label also syncs labels through the application
+    wallet.labels[name] = text
+    wallet.storage.put('labels', wallet.labels)
+
+
+class TestWalletSummary(unittest.TestCase):
+
+    def setUp(self):
+        self.user_dir = tempfile.mkdtemp()
+        self.config = SimpleConfig({'electrum_path': self.user_dir, 'cwd': self.user_dir})
+        AppStateProxy(self.config, 'cmdline')
+        self.path = os.path.join(self.user_dir, 'wallet')
+        storage = WalletStorage(self.path)
+        storage.put('keystore', keystore.from_seed(STANDARD_SEED, '', False).dump())
+        self.wallet = Standard_Wallet(storage)
+        self.wallet.synchronize()
+        self.wallet.set_frozen_state([self.wallet.get_receiving_addresses()[1]], True)
+        set_label(self.wallet, self.wallet.get_receiving_addresses()[0].to_string(), 'first')
+        storage.write()
+
+    def tearDown(self):
+        shutil.rmtree(self.user_dir)
+
+    def test_matches_wallet(self):
+        write_summary(self.wallet)
+        summary = WalletSummary.load(self.path)
+        addresses = self.wallet.get_addresses()
+        self.assertEqual(addresses, summary.get_addresses())
+        for address in addresses:
+            self.assertEqual(self.wallet.is_change(address), summary.is_change(address))
+            self.assertEqual(self.wallet.is_frozen(address), summary.is_frozen(address))
+            self.assertEqual(bool(self.wallet.is_used(address)), summary.is_used(address))
+            self.assertEqual(self.wallet.is_empty(address), summary.is_empty(address))
+            self.assertEqual(self.wallet.get_addr_balance(address),
+                             summary.get_addr_balance(address))
+        self.assertEqual(self.wallet.labels, summary.labels)
+        self.assertEqual(self.wallet.get_balance(), summary.get_balance())
+        self.assertEqual([], summary.get_utxos())
+
+    def test_history(self):
+        summary = WalletSummary({
+            'addresses': [], 'change': [], 'frozen_addresses': [], 'labels': {},
+            'balances': {}, 'balance': [0, 0, 0], 'utxos': [],
+            'history': [[TX_HASH, 100, 6, 1551441600, 5000, 5000, 'paid']],
+        })
+        item, = summary.export_history()
+        self.assertEqual(TX_HASH, item['txid'])
+        self.assertEqual('paid', item['label'])
+        self.assertEqual(100, item['height'])
+        self.assertEqual([], summary.export_history(from_timestamp=1551441601))
+
+    def test_stale(self):
+        self.assertIsNone(WalletSummary.load(self.path))
+        write_summary(self.wallet)
+        self.assertIsNotNone(WalletSummary.load(self.path))
+        set_label(self.wallet, TX_HASH, 'changed')
+        self.wallet.storage.write()
+        self.assertIsNone(WalletSummary.load(self.path))
+        with open(summary_path(self.path), 'w') as f:
+            f.write('junk')
+        self.assertIsNone(WalletSummary.load(self.path))
+
+    def test_encrypted_wallet(self):
+        self.wallet.update_password(None, 'secret', encrypt=True)
+        write_summary(self.wallet)
+        self.assertFalse(os.path.exists(summary_path(self.path)))
+
+    def test_stop_threads_refreshes(self):
+        self.wallet.stop_threads()
+        self.assertFalse(os.path.exists(summary_path(self.path)))
+        write_summary(self.wallet)
+        set_label(self.wallet, TX_HASH, 'changed')
+        self.wallet.stop_threads()
+        self.assertEqual('changed', WalletSummary.load(self.path).labels[TX_HASH])
+
+    def test_can_answer(self):
+        self.assertTrue(can_answer('listaddresses', self.config))
+        self.assertFalse(can_answer('signtransaction', self.config))
+        self.config.set_key('show_addresses', True)
+        self.assertFalse(can_answer('history', self.config))
+
+    def test_offline_command(self):
+        self.config.set_key('cmd', 'listaddresses')
+        self.config.set_key('wallet_path', 'wallet')
+        self.config.set_key('frozen', True)
+        expected = [self.wallet.get_receiving_addresses()[1].to_string()]
+        self.assertEqual(expected, run_offline_command(self.config, {}))
+        with open(summary_path(self.path)) as f:
+            self.assertEqual(self.wallet.get_balance(), tuple(json.load(f)['balance']))
+        # The summary answers without loading the wallet
+        with mock.patch('electrumsv.wallet.Wallet', side_effect=AssertionError):
+            self.assertEqual(expected, run_offline_command(self.config, {}))
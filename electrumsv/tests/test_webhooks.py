@@ -0,0 +1,139 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from electrumsv.webhooks import WebhookDispatcher
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        server = self.server
+        server.connections.add(self.client_address)
+        if server.failures:
+            server.failures -= 1
+            status = 500
+        else:
+            server.received.append(json.loads(body))
+            status = 200
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def wait_for(predicate, timeout=5):
+    end = time.time() + timeout
+    while time.time() < end:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestWebhookDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.httpd = HTTPServer(('127.0.0.1', 0), StubHandler)
+        self.httpd.received = []
+        self.httpd.failures = 0
+        self.httpd.connections = set()
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/hook' % self.httpd.server_address[1]
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'webhooks')
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_delivery_reuses_connection(self):
+        dispatcher = WebhookDispatcher(workers=1)
+        dispatcher.start()
+        for n in range(5):
+            self.assertTrue(dispatcher.post(self.url, {'n': n}))
+        self.assertTrue(wait_for(lambda: len(self.httpd.received) == 5))
+        dispatcher.stop()
+        self.assertEqual([{'n': n} for n in range(5)], self.httpd.received)
+        self.assertEqual(1, len(self.httpd.connections))
+        self.assertEqual(5, dispatcher.get_metrics()['urls'][self.url]['delivered'])
+
+    def test_retry_with_backoff(self):
+        self.httpd.failures = 2
+        dispatcher = WebhookDispatcher(workers=1, backoff=0.01)
+        dispatcher.start()
+        dispatcher.post(self.url, {'a': 1})
+        self.assertTrue(wait_for(lambda: self.httpd.received))
+        dispatcher.stop()
+        metrics = dispatcher.get_metrics()['urls'][self.url]
+        self.assertEqual(2, metrics['failed_attempts'])
+        self.assertEqual(1, metrics['delivered'])
+
+    def test_abandoned_after_max_attempts(self):
+        self.httpd.failures = 10
+        dispatcher = WebhookDispatcher(workers=1, backoff=0.01, max_attempts=2)
+        dispatcher.start()
+        dispatcher.post(self.url, {'a': 1})
+        self.assertTrue(wait_for(
+            lambda: dispatcher.get_metrics()['urls'].get(self.url, {}).get('abandoned') == 1))
+        dispatcher.stop()
+
+    def test_queue_full_drops(self):
+        dispatcher = WebhookDispatcher(queue_size=1)
+        self.assertTrue(dispatcher.post(self.url, {}))
+        self.assertFalse(dispatcher.post(self.url, {}))
+        self.assertEqual(1, dispatcher.get_metrics()['urls'][self.url]['dropped'])
+
+    def test_undelivered_persisted(self):
+        # Not started, so nothing is delivered before stop
+        dispatcher = WebhookDispatcher(self.path, workers=0)
+        dispatcher.post(self.url, {'a': 1})
+        dispatcher.stop()
+        self.assertTrue(os.path.exists(self.path))
+        dispatcher = WebhookDispatcher(self.path, workers=1)
+        dispatcher.start()
+        self.assertTrue(wait_for(lambda: self.httpd.received))
+        dispatcher.stop()
+        self.assertEqual([{'a': 1}], self.httpd.received)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_journal_survives_crash(self):
+        dispatcher = WebhookDispatcher(self.path, workers=1)
+        dispatcher.start()
+        dispatcher.post(self.url, {'a': 1})
+        self.assertTrue(wait_for(lambda: self.httpd.received))
+        # Stopped without closing the journal, like a killed daemon
+        dispatcher._close_journal = lambda: None
+        dispatcher.stop()
+        crashed = WebhookDispatcher(self.path, workers=0)
+        crashed.post(self.url, {'b': 2})
+        crashed.journal.write('{"id": 9, "url"')
+        crashed.journal.flush()
+        dispatcher = WebhookDispatcher(self.path, workers=1)
+        dispatcher.start()
+        self.assertTrue(wait_for(lambda: len(self.httpd.received) == 2))
+        dispatcher.stop()
+        self.assertEqual([{'a': 1}, {'b': 2}], self.httpd.received)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_journal_is_compacted(self):
+        dispatcher = WebhookDispatcher(self.path, workers=1)
+        dispatcher.start()
+        for n in range(30):
+            dispatcher.post(self.url, {'n': n})
+        self.assertTrue(wait_for(lambda: len(self.httpd.received) == 30))
+        dispatcher.stop()
+        self.assertFalse(os.path.exists(self.path))
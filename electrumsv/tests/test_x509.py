@@ -0,0 +1,163 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from electrumsv import paymentrequest, pem, x509
+
+
+# A test root, an intermediate it signed and a leaf certificate the intermediate signed,
+# valid from 2020 to 2045.
+ROOT_PEM = '''\
+-----BEGIN CERTIFICATE-----
+MIIC7DCCAdSgAwIBAgICEAAwDQYJKoZIhvcNAQELBQAwHzEdMBsGA1UEAwwURWxl
+Y3RydW1TViBUZXN0IFJvb3QwHhcNMjAwMTAxMDAwMDAwWhcNNDUxMjMxMDAwMDAw
+WjAfMR0wGwYDVQQDDBRFbGVjdHJ1bVNWIFRlc3QgUm9vdDCCASIwDQYJKoZIhvcN
+AQEBBQADggEPADCCAQoCggEBALYyopyon93DIVpYD9QGsF0KkKE+43VHey4mcy3B
+TADLQ37SsMdwq62EvzwRZblVpWVgh3PwOoZUR3a/5eu9AWC+hzfaPvpADxrAIKq3
+f+0Wh/fCpPIxyk795CI5YfwXosKpq2ux0XSLNNQgzJhbJtszwjpwCjxzrReJNJRJ
+ja4ibUclhKotDpgg18Xfj8S1QYZTs6jpIqFsytmedCY5QKJM3qrsIeyxJC+g2Pun
+PqPsQDwnYU3pMLwc82cC465wztkG5UzqLI+6dwO5G7ujvJpdsAiAkstxNK6nQ5v+
+/zDum0bVm4Q0BlIvTE8dYhkyYqQM3awal6gFFm1l+NVjKbcCAwEAAaMyMDAwDwYD
+VR0TAQH/BAUwAwEB/zAdBgNVHQ4EFgQU2r8/WKMzIHjgp8hc73LXmm6xq1owDQYJ
+KoZIhvcNAQELBQADggEBACN3DYlzLIMB2ZYg3w4zP7uMmPV8vqxfjIiriz1Y4Z6m
+TDIEqbo/vI4Yf+Gef3zY673twzOB62qyfyWV2QyqlEjWerDSDBIefV9PUOTrbuXX
+xz4YGWWBHVHnoK1Z8c6xjyIVkBP54QFBMotSp04z3su3ojh6guPY/lmRLhyJ2Viq
+jtan6CFJwiQJymCws6refyaXpuJC1Khtkjzr+F1vyVCvWbhpe0QkaXJfZ/zC373a
+zdT6fJypUsgIUUfJ080szzqyStgsBqTehFLP3fUu2IC0f5uhfrer62Za6Boj+q24
+omy7363p6dsgDfKaKhGzl/eW1Q852TUzjPTMovhtEY8=
+-----END CERTIFICATE-----
+'''
+INTERMEDIATE_PEM = '''\
+-----BEGIN CERTIFICATE-----
+MIIDFTCCAf2gAwIBAgICEAEwDQYJKoZIhvcNAQELBQAwHzEdMBsGA1UEAwwURWxl
+Y3RydW1TViBUZXN0IFJvb3QwHhcNMjAwMTAxMDAwMDAwWhcNNDUxMjMxMDAwMDAw
+WjAnMSUwIwYDVQQDDBxFbGVjdHJ1bVNWIFRlc3QgSW50ZXJtZWRpYXRlMIIBIjAN
+BgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEA7oR+CPvVheA0TYAl0zQ02NqoyEBG
+dBBoNkDEBpX1bLWrB7T2usA+vUMNKTOBQy6tiYuIILMBxK4N4gv/vLmmFC6sbOd8
+tVxDftscwpHfntEIE26nIFFqQJKpv4iERpgGCN3l3uQf+ErwtLzNelGUx4TJgCot
+ZefuqJBZBpMRwFQSnJRcf3Aumw4wCjSk0IyLYvhZPO8Tu70TWb2fJk3/xhhTOFkG
+OyhP21xAvYOptRYyAwFeo9DlVYnD+odzjszZttblLhJ5rI4l43Ik9PdChhI5Jlvf
+oOSeErQxjwHM5AOJXC7x8aaJF3IIwxXN3a8QcEAxy2iqVfIAP50UcciiSwIDAQAB
+o1MwUTAPBgNVHRMBAf8EBTADAQH/MB0GA1UdDgQWBBR5FUI9K4kkUc4AwBJKFQL+
+oeqX/zAfBgNVHSMEGDAWgBTavz9YozMgeOCnyFzvcteabrGrWjANBgkqhkiG9w0B
+AQsFAAOCAQEANx5BhUlIIbSrrKgT/usyoaVAwPOIuHlR87LYEw2l/n93vgOA+YG+
+3Mhz/eaaG1uBo5M12ZNOUd7xIojHHgG8FBu8x05kI3RA+YJNxfDXLw9DE/u8O3it
+0VoZIXiUsu+KWTquw63xFN+NHV4CHH5A18ZgDBHsQWW8FJctP1i3Gwe3zpNFXzmr
+J26P32aS8P4nJefEx6AebBPCAVSoQ01Flc0M7+nklCK852+W30k/4g6+9q1wGwI4
+CtS5/m/Le9oNRb5VZTDLxjXL/sTP8ECSPt1Vx/I5CIOUUld/nSdi5ipM+jNemSon
+wS8mGRjeoFuxQtHO7tRXb+XNM52fV4bsmQ==
+-----END CERTIFICATE-----
+'''
+LEAF_PEM = '''\
+-----BEGIN CERTIFICATE-----
+MIIDETCCAfmgAwIBAgICEAIwDQYJKoZIhvcNAQELBQAwJzElMCMGA1UEAwwcRWxl
+Y3RydW1TViBUZXN0IEludGVybWVkaWF0ZTAeFw0yMDAxMDEwMDAwMDBaFw00NTEy
+MzEwMDAwMDBaMCExHzAdBgNVBAMMFioubWVyY2hhbnQuZXhhbXBsZS5jb20wggEi
+MA0GCSqGSIb3DQEBAQUAA4IBDwAwggEKAoIBAQDsNAMQicZLOVSng1i5lCgUuy0p
+lojlhpQ/cw4gRzVeS6sCXDT1sNECACSxeHjhGmOVgGT094/0AaJG49QiW1axhoQZ
+QoUCDSfY+F7pvZc+vD2ZoWnKDSO+noQKEUDQpUDUdeZMjlY3BmYCpyj/Zzw5q4MT
+JCAoATI2qkUORoXWzQT7YBacwfRCWQhKBz3CYBmeXAQN029qRjZxF0ndy0zGKZvP
+ug0qOYBDj1M2m6D06ZLnALW0e1PoPCDbNMuHYScqhekdsLlaki9Y+yZC9h+HpCyY
+fOGdUMV9ayTrTVPolfli3+5o9h4pajqtU/CNoyi5oNZzEJjY/KJ1xELf3px9AgMB
+AAGjTTBLMAkGA1UdEwQCMAAwHQYDVR0OBBYEFFNwoHsBTMVLUvHEY789xzcowlMz
+MB8GA1UdIwQYMBaAFHkVQj0riSRRzgDAEkoVAv6h6pf/MA0GCSqGSIb3DQEBCwUA
+A4IBAQCFP6rcB43Hb/97gwYTVeytNMSuRZ1Fh3MEShZWemIMqUE9mOZ4b1vx9nRj
+Wkiz6To+10UonZ8ucnm+ozsQpaqgAccy6FAZDM8twsNfAyGFmgzCdFKgHNWymfQd
+db4Vgj08i6cBRdTT4tXMB9gHRMk+PeQtLjUNbM9Q5m3lS+F23WYCWwb+teyAyYJe
+tqp31afQ5MjKDmbhplPc7FPKy1IJHU7UJwcERJWm08OdC/N0bQQrwequsxcAdgBj
+ZUBZ/GbeC8F/OyGRp/pI0yz8w2tgGr5tpIBJ1cBggyyuq387gF8WYJKDHA6s3y7L
+JlolLDRwFGs2YQPZg99OBhfQdcsz
+-----END CERTIFICATE-----
+'''
+
+
+def der(s):
+    return pem.dePem(s, 'CERTIFICATE')
+
+
+class TestCertificateStore(unittest.TestCase):
+
+    def setUp(self):
+        self.user_dir = tempfile.mkdtemp()
+        self.ca_path = os.path.join(self.user_dir, 'cacert.pem')
+        self.cache_path = os.path.join(self.user_dir, 'ca_certificates.json')
+        with open(self.ca_path, 'w') as f:
+            f.write(ROOT_PEM)
+        self.store = x509.CertificateStore(self.ca_path, self.cache_path)
+        self._saved_store = paymentrequest._ca_store
+        paymentrequest._ca_store = self.store
+
+    def tearDown(self):
+        paymentrequest._ca_store = self._saved_store
+        shutil.rmtree(self.user_dir)
+
+    def test_load_and_cache(self):
+        root = x509.X509(der(ROOT_PEM))
+        self.assertEqual(1, len(self.store))
+        self.assertIn(root.getFingerprint(), self.store)
+        self.assertEqual(root.modulus, self.store.get_by_key_id(root.get_keyID()).modulus)
+        self.assertTrue(os.path.exists(self.cache_path))
+
+        store = x509.CertificateStore(self.ca_path, self.cache_path)
+        with mock.patch.object(store, '_parse_bundle') as parse_bundle:
+            store.load()
+        parse_bundle.assert_not_called()
+        cached = store.get_by_key_id(root.get_keyID())
+        self.assertEqual((root.modulus, root.exponent), (cached.modulus, cached.exponent))
+        self.assertEqual('ElectrumSV Test Root', cached.get_common_name())
+
+    def test_cache_invalidated_by_bundle_change(self):
+        self.store.load()
+        with open(self.ca_path, 'a') as f:
+            f.write('\n' + INTERMEDIATE_PEM)
+        store = x509.CertificateStore(self.ca_path, self.cache_path)
+        self.assertEqual(2, len(store))
+
+    def test_preload(self):
+        paymentrequest.preload_ca_store().join()
+        self.assertEqual(1, len(self.store._by_fingerprint))
+
+    def test_verify_chain(self):
+        chain = [der(LEAF_PEM), der(INTERMEDIATE_PEM)]
+        x, ca = paymentrequest.verify_cert_chain(chain)
+        self.assertEqual('*.merchant.example.com', x.get_common_name())
+        self.assertEqual('ElectrumSV Test Intermediate', ca.get_common_name())
+        intermediate = self.store.get_verified(bytes(chain[1]))
+        self.assertIsNotNone(intermediate)
+
+        # The memoized intermediate is reused and its signature not checked again
+        with mock.patch.object(x509, 'verify_rsa_signature',
+                               wraps=x509.verify_rsa_signature) as verify:
+            x, ca = paymentrequest.verify_cert_chain(chain)
+        self.assertIs(intermediate, ca)
+        self.assertEqual(1, verify.call_count)
+
+    def test_verify_chain_including_root(self):
+        chain = [der(LEAF_PEM), der(INTERMEDIATE_PEM), der(ROOT_PEM)]
+        x, ca = paymentrequest.verify_cert_chain(chain)
+        self.assertEqual('ElectrumSV Test Root', ca.get_common_name())
+
+    def test_verify_chain_failures(self):
+        # The leaf was not signed by the root
+        with self.assertRaises(Exception):
+            paymentrequest.verify_cert_chain([der(LEAF_PEM), der(ROOT_PEM)])
+        # The intermediate is not trusted without the root in the store
+        with open(self.ca_path, 'w') as f:
+            f.write(LEAF_PEM)
+        paymentrequest._ca_store = x509.CertificateStore(self.ca_path)
+        with self.assertRaises(Exception):
+            paymentrequest.verify_cert_chain([der(LEAF_PEM), der(INTERMEDIATE_PEM)])
+
+    def test_verify_rsa_signature(self):
+        leaf = x509.X509(der(LEAF_PEM))
+        intermediate = x509.X509(der(INTERMEDIATE_PEM))
+        algo, sig, data = leaf.get_signature()
+        self.assertTrue(x509.verify_rsa_signature(
+            intermediate.modulus, intermediate.exponent, algo, sig, data))
+        self.assertFalse(x509.verify_rsa_signature(
+            intermediate.modulus, intermediate.exponent, algo, sig, data + b'x'))
+        with self.assertRaises(x509.CertificateError):
+            x509.verify_rsa_signature(intermediate.modulus, intermediate.exponent,
+                                      x509.ALGO_ECDSA_SHA256, sig, data)
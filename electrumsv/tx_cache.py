@@ -0,0 +1,255 @@
+# Electrum SV - lightweight Bitcoin SV client
+# Copyright (C) 2019 The Electrum SV Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''A process-wide cache of raw transactions and verified merkle proofs.
+
+Raw transactions never change and a merkle proof only changes on a reorg, so
+both are kept keyed by txid for all wallets loaded in the process.  Recently
+used entries are held in memory; everything is also written to a directory on
+disk so it survives restarts.  Both are bounded and evict the least recently
+used entries first.
+'''
+
+from collections import OrderedDict
+import json
+import os
+import re
+import threading
+
+from .crypto import sha256d
+from .logs import logs
+from .util import bfh, bh2u
+
+
+logger = logs.get_logger("tx_cache")
+
+DEFAULT_MEMORY_BYTES = 32 * 1024 * 1024
+DEFAULT_DISK_ENTRIES = 50000
+DEFAULT_MERKLE_ENTRIES = 50000
+
+_TX_HASH_RE = re.compile('[0-9a-f]{64}')
+
+
+def raw_tx_hash(raw):
+    '''The txid of a raw transaction given in hex.'''
+    return bh2u(sha256d(bfh(raw))[::-1])
+
+
+def is_tx_hash(tx_hash):
+    return isinstance(tx_hash, str) and _TX_HASH_RE.fullmatch(tx_hash) is not None
+
+
+class TxCache(object):
+    '''LRU cache of raw transactions (hex strings) and merkle proofs (the dicts
+    returned by blockchain.transaction.get_merkle), keyed by txid.  If path is
+    None nothing is written to disk.  Thread-safe.
+    '''
+
+    def __init__(self, path=None, max_memory_bytes=DEFAULT_MEMORY_BYTES,
+                 max_disk_entries=DEFAULT_DISK_ENTRIES,
+                 max_merkle_entries=DEFAULT_MERKLE_ENTRIES):
+        self.path = path
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_entries = max_disk_entries
+        self.max_merkle_entries = max_merkle_entries
+        self.lock = threading.Lock()
+        self.txs = OrderedDict()
+        self.memory_bytes = 0
+        self.merkles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.disk_entries = 0
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            for name in os.listdir(path):
+                if name.endswith('.tx'):
+                    self.disk_entries += 1
+                elif '.tmp.' in name:
+                    # Left by a write that did not finish
+                    self._remove_file(os.path.join(path, name))
+
+    def _filename(self, tx_hash, suffix):
+        '''The file holding the entry, or None if it is not kept on disk.  Only
+        well-formed txids name files.'''
+        if self.path is None or not is_tx_hash(tx_hash):
+            return None
+        return os.path.join(self.path, tx_hash + suffix)
+
+    def _remove_file(self, filename):
+        try:
+            os.remove(filename)
+            return True
+        except OSError:
+            return False
+
+    def _remember_tx(self, tx_hash, raw):
+        old = self.txs.pop(tx_hash, None)
+        if old is not None:
+            self.memory_bytes -= len(old)
+        self.txs[tx_hash] = raw
+        self.memory_bytes += len(raw)
+        while self.memory_bytes > self.max_memory_bytes and len(self.txs) > 1:
+            _, evicted = self.txs.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def _read_disk(self, tx_hash, suffix):
+        filename = self._filename(tx_hash, suffix)
+        if filename is None:
+            return None
+        try:
+            with open(filename, 'r') as f:
+                data = f.read()
+            # Touch it so disk pruning is least-recently-used
+            os.utime(filename)
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError:
+            logger.exception("cannot read %s", filename)
+            return None
+
+    def _write_disk(self, tx_hash, suffix, data):
+        filename = self._filename(tx_hash, suffix)
+        if filename is None:
+            return
+        # Written whole or not at all, so a crash cannot leave a truncated entry
+        temp_path = "%s.tmp.%s" % (filename, os.getpid())
+        try:
+            is_new = not os.path.exists(filename)
+            with open(temp_path, 'w') as f:
+                f.write(data)
+            os.replace(temp_path, filename)
+        except OSError:
+            logger.exception("cannot write %s", filename)
+            self._remove_file(temp_path)
+            return
+        if is_new and suffix == '.tx':
+            self.disk_entries += 1
+            if self.disk_entries > self.max_disk_entries:
+                self._prune_disk()
+
+    def _prune_disk(self):
+        '''Remove the least recently used tenth of the raw transactions on disk,
+        and their proofs.'''
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.tx'):
+                entries.append((entry.stat().st_mtime, entry.name[:-3]))
+        entries.sort()
+        target = max(1, self.max_disk_entries * 9 // 10)
+        for _, tx_hash in entries[:max(0, len(entries) - target)]:
+            for suffix in ('.tx', '.merkle'):
+                self._remove_file(os.path.join(self.path, tx_hash + suffix))
+        self.disk_entries = min(len(entries), target)
+        logger.debug("pruned tx cache to %d entries", self.disk_entries)
+
+    def get_tx(self, tx_hash):
+        '''Returns the raw transaction in hex, or None.'''
+        with self.lock:
+            raw = self.txs.get(tx_hash)
+            if raw is not None:
+                self.txs.move_to_end(tx_hash)
+            else:
+                raw = self._read_disk_tx(tx_hash)
+                if raw is not None:
+                    self._remember_tx(tx_hash, raw)
+            if raw is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return raw
+
+    def _read_disk_tx(self, tx_hash):
+        raw = self._read_disk(tx_hash, '.tx')
+        if raw is None:
+            return None
+        try:
+            valid = raw_tx_hash(raw) == tx_hash
+        except ValueError:
+            valid = False
+        if valid:
+            return raw
+        # Damaged or altered on disk; never hand it out
+        logger.error("removing cached tx %s: hash mismatch", tx_hash)
+        if self._remove_file(self._filename(tx_hash, '.tx')):
+            self.disk_entries -= 1
+        return None
+
+    def put_tx(self, tx_hash, raw):
+        '''Cache a raw transaction in hex.  It is rejected if it does not hash to
+        tx_hash, so nothing a server sends can poison the cache.'''
+        try:
+            valid = raw_tx_hash(raw) == tx_hash
+        except ValueError:
+            valid = False
+        if not valid:
+            logger.error("not caching tx %s: hash mismatch", tx_hash)
+            return False
+        with self.lock:
+            if tx_hash not in self.txs:
+                self._write_disk(tx_hash, '.tx', raw)
+            self._remember_tx(tx_hash, raw)
+        return True
+
+    def get_merkle(self, tx_hash):
+        '''Returns the cached proof dict, or None.'''
+        with self.lock:
+            merkle = self.merkles.get(tx_hash)
+            if merkle is not None:
+                self.merkles.move_to_end(tx_hash)
+                return merkle
+            data = self._read_disk(tx_hash, '.merkle')
+            if data is None:
+                return None
+            try:
+                merkle = json.loads(data)
+            except ValueError:
+                merkle = None
+            if not isinstance(merkle, dict):
+                logger.error("removing cached proof %s: unreadable", tx_hash)
+                self._remove_file(self._filename(tx_hash, '.merkle'))
+                return None
+            self._remember_merkle(tx_hash, merkle)
+            return merkle
+
+    def _remember_merkle(self, tx_hash, merkle):
+        self.merkles[tx_hash] = merkle
+        self.merkles.move_to_end(tx_hash)
+        while len(self.merkles) > self.max_merkle_entries:
+            self.merkles.popitem(last=False)
+
+    def put_merkle(self, tx_hash, merkle):
+        '''Cache a proof.  Only proofs that verified against our headers should
+        be cached.'''
+        with self.lock:
+            self._remember_merkle(tx_hash, merkle)
+            self._write_disk(tx_hash, '.merkle', json.dumps(merkle))
+
+    def discard_merkle(self, tx_hash):
+        '''Forget a proof, for example after it failed verification following a
+        reorg.'''
+        with self.lock:
+            self.merkles.pop(tx_hash, None)
+            filename = self._filename(tx_hash, '.merkle')
+            if filename is not None:
+                self._remove_file(filename)
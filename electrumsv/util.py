@@ -22,6 +22,7 @@
 # SOFTWARE.
 
 import binascii
+from contextlib import contextmanager
 from decimal import Decimal
 from collections import defaultdict
 from datetime import datetime
@@ -37,6 +38,7 @@ import threading
 import time
 
 from .logs import logs
+from .metrics import metrics
 from .startup import package_dir
 from .version import PACKAGE_DATE
 
@@ -141,6 +143,59 @@ class DaemonThread(threading.Thread):
         self.logger.debug("stopped")
 
 
+class ReadWriteLock(object):
+    """A lock allowing any number of concurrent readers or a single writer.
+    Writers are preferred; once one is waiting new readers queue behind it.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def read_locked(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write_locked(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
 # Method decorator.  To be used for calculations that will always
 # deliver the same result.  The method cannot take any arguments
 # and should be accessed as an attribute.
@@ -175,17 +230,37 @@ def constant_time_compare(val1, val2):
     return hmac.compare_digest(to_bytes(val1, 'utf8'), to_bytes(val2, 'utf8'))
 
 
-# decorator that prints execution time
-def profiler(func):
-    def do_profile(func, args, kw_args):
-        n = func.__name__
-        logger = logs.get_logger("profiler")
+# decorator that records execution time in the function_seconds histogram
+profiler = metrics.timed('function_seconds', 'Time taken by profiled functions')
+
+
+class PhaseTimer(object):
+    '''Records how long each named phase of a multi-step operation takes, such
+    as loading a wallet, for reporting as JSON.  Phases may be timed from
+    several threads; a phase timed twice accumulates.'''
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.phases = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
         t0 = time.time()
-        o = func(*args, **kw_args)
-        t = time.time() - t0
-        logger.debug("%s %.4f", n, t)
-        return o
-    return lambda *args, **kw_args: do_profile(func, args, kw_args)
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - t0)
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def to_json(self):
+        with self.lock:
+            phases = {name: round(seconds, 6) for name, seconds in self.phases.items()}
+        return {'started': self.start_time, 'total': round(sum(phases.values()), 6),
+                'phases': phases}
 
 
 def android_ext_dir():
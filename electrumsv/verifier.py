@@ -26,6 +26,7 @@ from bitcoinx import hash_to_hex_str, MissingHeader
 from .bitcoin import hash_decode
 from .crypto import sha256d
 from .logs import logs
+from .metrics import metrics
 from .networks import Net
 from .transaction import Transaction
 from .util import ThreadJob, bh2u
@@ -33,6 +34,11 @@ from .util import ThreadJob, bh2u
 
 logger = logs.get_logger("verifier")
 
+backlog = metrics.gauge('spv_backlog', 'Transactions awaiting verification',
+                        ('wallet', 'state'))
+verifications = metrics.counter('spv_verifications', 'Merkle proofs checked',
+                                ('result', ))
+
 
 class InnerNodeOfSpvProofIsValidTx(Exception): pass
 
@@ -58,18 +64,19 @@ class SPV(ThreadJob):
 
         local_height = self.network.get_local_height()
         unverified = self.wallet.get_unverified_txs().copy()
-        for tx_hash, tx_height in unverified.items():
-            # do not request merkle branch if we already requested it
-            if tx_hash in self.requested_merkle or tx_hash in self.merkle_roots:
-                continue
-            # or before headers are available
-            if tx_height <= 0 or tx_height > local_height:
-                continue
-
-            # if it's in the checkpoint region, we still might not have the header
-            try:
-                blockchain.header_at_height(tx_height)
-            except MissingHeader:
+        # The path, as loaded wallets in different directories can share a name
+        wallet_path = self.wallet.storage.path
+        backlog.labels(wallet_path, 'unverified').set(len(unverified))
+        backlog.labels(wallet_path, 'requested').set(len(self.requested_merkle))
+        wanted = [(tx_hash, tx_height) for tx_hash, tx_height in unverified.items()
+                  # do not request merkle branch if we already requested it
+                  if tx_hash not in self.requested_merkle and tx_hash not in self.merkle_roots
+                  # or before headers are available
+                  and 0 < tx_height <= local_height]
+        # if it's in the checkpoint region, we still might not have the header
+        headers = blockchain.headers_at_heights([tx_height for _, tx_height in wanted])
+        for (tx_hash, tx_height), header in zip(wanted, headers):
+            if header is None:
                 if tx_height <= Net.VERIFICATION_BLOCK_HEIGHT:
                     # Per-header requests might be a lot heavier.
                     # Also, they're not supported as header requests are
@@ -87,6 +94,11 @@ class SPV(ThreadJob):
 
         self.maybe_switch_chain()
 
+    def release(self):
+        wallet_path = self.wallet.storage.path
+        for state in ('unverified', 'requested'):
+            backlog.remove(wallet_path, state)
+
     def verify_merkle(self, response):
         if self.wallet.verifier is None:
             return  # we have been killed, this was just an orphan callback
@@ -105,24 +117,31 @@ class SPV(ThreadJob):
         except InnerNodeOfSpvProofIsValidTx:
             logger.error("merkle verification failed for %s (inner node looks like tx)",
                              tx_hash)
+            verifications.labels('invalid').inc()
             return
 
         # FIXME: if verification fails below,
         # we should make a fresh connection to a server to
         # recover from this, as this TX will now never verify
         try:
-            header = self.network.blockchain().header_at_height(tx_height)
+            header = self.network.blockchain().header_info_at_height(tx_height)
         except MissingHeader:
             logger.error("merkle verification failed for %s (missing header %s)",
                          tx_hash, tx_height)
+            verifications.labels('missing_header').inc()
             return
         if header.merkle_root != merkle_root:
+            self.network.tx_cache.discard_merkle(tx_hash)
             logger.error("merkle verification failed for %s (merkle root mismatch %s != %s)",
                          tx_hash, hash_to_hex_str(header.merkle_root),
                          hash_to_hex_str(merkle_root))
+            verifications.labels('mismatch').inc()
             return
         # we passed all the tests
+        verifications.labels('verified').inc()
         self.merkle_roots[tx_hash] = merkle_root
+        if not response.get('cached'):
+            self.network.tx_cache.put_merkle(tx_hash, merkle)
 
         # note: we could pop in the beginning, but then we would request
         # this proof again in case of verification failure from the same server
@@ -46,25 +46,40 @@ from .app_state import app_state
 from .bitcoin import COINBASE_MATURITY, TYPE_ADDRESS, is_minikey
 from .contacts import Contacts
 from .crypto import sha256d
+from .events import WalletEventBus
 from .exceptions import NotEnoughFunds, ExcessiveFee, UserCancelled, InvalidPassword
 from .i18n import _
 from .keystore import (
-    load_keystore, Hardware_KeyStore, Imported_KeyStore, BIP32_KeyStore, xpubkey_to_address
+    load_keystore, Hardware_KeyStore, Imported_KeyStore, BIP32_KeyStore, Software_KeyStore,
+    xpubkey_to_address
 )
 from .logs import logs
+from .metrics import metrics
 from .paymentrequest import InvoiceStore
 from .paymentrequest import PR_PAID, PR_UNPAID, PR_UNKNOWN, PR_EXPIRED
 from .storage import multisig_type
 from .synchronizer import Synchronizer
 from .transaction import Transaction
-from .util import profiler, format_satoshis, bh2u, format_time, timestamp_to_datetime
+from .util import PhaseTimer, profiler, format_satoshis, bh2u, format_time
 from .verifier import SPV
+from .wallet_index import (
+    AddressHistory, PrunedTxoTable, ReverseHistory, TxInput, TxInputTable, TxOutput,
+    TransactionMap, TxRecordTable, hash_to_bytes
+)
 from .version import PACKAGE_VERSION
 from .web import create_URI
 
 
 logger = logs.get_logger("wallet")
 
+sign_input_seconds = metrics.histogram('wallet_sign_input_seconds',
+                                       'Time taken to sign a transaction, per input')
+transactions_added = metrics.counter('wallet_transactions_added',
+                                     'Transactions added to wallet histories')
+
+# History items built at a time by iter_export_history
+EXPORT_CHUNK_SIZE = 1000
+
 TX_STATUS = [
     _('Unconfirmed parent'),
     _('Unconfirmed'),
@@ -175,37 +190,49 @@ class Abstract_Wallet:
         # verifier (SPV) and synchronizer are started in start_threads
         self.synchronizer = None
         self.verifier = None
+        # Coalesced change notifications for the GUI and other consumers
+        self.events = WalletEventBus(self)
+
+        # Time spent in each step of loading, see get_load_report()
+        self.load_timer = PhaseTimer()
+        load_phase = self.load_timer.phase
 
         self.gap_limit_for_change = 6 # constant
         # saved fields
-        self.use_change            = storage.get('use_change', True)
-        self.multiple_change       = storage.get('multiple_change', False)
-        self.labels                = storage.get('labels', {})
+        with load_phase('settings'):
+            self.use_change            = storage.get('use_change', True)
+            self.multiple_change       = storage.get('multiple_change', False)
+            self.labels                = storage.get('labels', {})
         # Frozen addresses
-        frozen_addresses = storage.get('frozen_addresses',[])
-        self.frozen_addresses = set(Address.from_string(addr)
-                                    for addr in frozen_addresses)
-        # Frozen coins (UTXOs) -- note that we have 2 independent
-        # levels of "freezing": address-level and coin-level.  The two
-        # types of freezing are flagged independently of each other
-        # and 'spendable' is defined as a coin that satisfies BOTH
-        # levels of freezing.
-        self.frozen_coins = set(storage.get('frozen_coins', []))
+        with load_phase('frozen'):
+            frozen_addresses = storage.get('frozen_addresses',[])
+            self.frozen_addresses = set(Address.from_string(addr)
+                                        for addr in frozen_addresses)
+            # Frozen coins (UTXOs) -- note that we have 2 independent
+            # levels of "freezing": address-level and coin-level.  The two
+            # types of freezing are flagged independently of each other
+            # and 'spendable' is defined as a coin that satisfies BOTH
+            # levels of freezing.
+            self.frozen_coins = set(storage.get('frozen_coins', []))
         # address -> list(txid, height)
-        history = storage.get('addr_history',{})
-        self._history = self.to_Address_dict(history)
+        with load_phase('address_history'):
+            self._history = AddressHistory()
+            self._history.load_json(storage.get('addr_history', {}))
 
-        self.load_keystore()
-        self.load_addresses()
-        self.load_transactions()
-        self.build_reverse_history()
+        with load_phase('keystore'):
+            self.load_keystore()
+        with load_phase('addresses'):
+            self.load_addresses()
+        with load_phase('transactions'):
+            self.load_transactions()
 
         # load requests
-        requests = self.storage.get('payment_requests', {})
-        for key, req in requests.items():
-            req['address'] = Address.from_string(key)
-        self.receive_requests = {req['address']: req
-                                 for req in requests.values()}
+        with load_phase('payment_requests'):
+            requests = self.storage.get('payment_requests', {})
+            for key, req in requests.items():
+                req['address'] = Address.from_string(key)
+            self.receive_requests = {req['address']: req
+                                     for req in requests.values()}
 
         # Transactions pending verification.  A map from tx hash to transaction
         # height.  Access is not contended so no lock is needed.
@@ -213,7 +240,8 @@ class Abstract_Wallet:
 
         # Verified transactions.  Each value is a (height, timestamp,
         # block_pos) tuple.  Access with self.lock.
-        self.verified_tx = storage.get('verified_tx3', {})
+        with load_phase('verified_tx'):
+            self.verified_tx = storage.get('verified_tx3', {})
 
         # there is a difference between wallet.up_to_date and interface.is_up_to_date()
         # interface.is_up_to_date() returns true when all requests have been answered and processed
@@ -223,15 +251,62 @@ class Abstract_Wallet:
         self.lock = threading.RLock()
         self.transaction_lock = threading.RLock()
 
-        self.check_history()
+        with load_phase('check_history'):
+            self.check_history()
 
         # save wallet type the first time
         if self.storage.get('wallet_type') is None:
             self.storage.put('wallet_type', self.wallet_type)
 
-        # invoices and contacts
-        self.invoices = InvoiceStore(self.storage)
-        self.contacts = Contacts(self.storage)
+        with load_phase('contacts'):
+            self.contacts = Contacts(self.storage)
+
+        # The reverse history and invoices are not needed to open the wallet,
+        # so they are built in the background.  Accessing them waits for it.
+        self._deferred_loaded = threading.Event()
+        self._deferred_error = None
+        threading.Thread(target=self._load_deferred, name='wallet-load',
+                         daemon=True).start()
+
+    def _load_deferred(self):
+        try:
+            with self.load_timer.phase('reverse_history'):
+                self.build_reverse_history()
+            with self.load_timer.phase('invoices'):
+                self._invoices = InvoiceStore(self.storage)
+        except Exception as e:
+            self.logger.exception("deferred wallet load failed")
+            # Raised again wherever what it was building is used
+            self._deferred_error = e
+        finally:
+            self._deferred_loaded.set()
+        self.logger.debug("load report %s", json.dumps(self.get_load_report()))
+
+    def _wait_for_deferred_load(self):
+        self._deferred_loaded.wait()
+        if self._deferred_error is not None:
+            raise self._deferred_error
+
+    @property
+    def tx_addr_hist(self):
+        self._wait_for_deferred_load()
+        return self._tx_addr_hist
+
+    @property
+    def invoices(self):
+        self._wait_for_deferred_load()
+        return self._invoices
+
+    def get_load_report(self):
+        '''How long each step of loading the wallet took, in seconds.'''
+        report = self.load_timer.to_json()
+        report.update({
+            'wallet': self.basename(),
+            'complete': self._deferred_loaded.is_set(),
+            'addresses': len(self._history),
+            'transactions': len(self.transactions),
+        })
+        return report
 
     @classmethod
     def to_Address_dict(cls, d):
@@ -254,44 +329,34 @@ class Abstract_Wallet:
             if isinstance(keystore, Hardware_KeyStore):
                 keystore.plugin.replace_gui_handler(window, keystore)
 
-    @profiler
     def load_transactions(self):
-        txi = self.storage.get('txi', {})
-        self.txi = {tx_hash: self.to_Address_dict(value)
-                    for tx_hash, value in txi.items()}
-        txo = self.storage.get('txo', {})
-        self.txo = {tx_hash: self.to_Address_dict(value)
-                    for tx_hash, value in txo.items()}
+        self.txi = TxInputTable()
+        self.txi.load_json(self.storage.get('txi', {}))
+        self.txo = TxRecordTable(TxOutput)
+        self.txo.load_json(self.storage.get('txo', {}))
         self.tx_fees = self.storage.get('tx_fees', {})
-        self.pruned_txo = self.storage.get('pruned_txo', {})
+        self.pruned_txo = PrunedTxoTable()
+        self.pruned_txo.load_json(self.storage.get('pruned_txo', {}))
         tx_list = self.storage.get('transactions', {})
-        self.transactions = {}
-        for tx_hash, raw in tx_list.items():
-            tx = Transaction(raw)
-            self.transactions[tx_hash] = tx
-            if (self.txi.get(tx_hash) is None and
-                    self.txo.get(tx_hash) is None and
-                    tx_hash not in self.pruned_txo.values()):
+        for tx_hash in list(tx_list):
+            if (tx_hash not in self.txi and
+                    tx_hash not in self.txo and
+                    not self.pruned_txo.has_spender(tx_hash)):
                 self.logger.debug("removing unreferenced tx %s", tx_hash)
-                self.transactions.pop(tx_hash)
+                del tx_list[tx_hash]
+        # Transaction objects are created as they are looked up
+        self.transactions = TransactionMap()
+        self.transactions.load_json(tx_list)
 
     @profiler
     def save_transactions(self, write=False):
         with self.transaction_lock:
-            tx = {}
-            for k,v in self.transactions.items():
-                tx[k] = str(v)
-            self.storage.put('transactions', tx)
-            txi = {tx_hash: self.from_Address_dict(value)
-                   for tx_hash, value in self.txi.items()}
-            txo = {tx_hash: self.from_Address_dict(value)
-                   for tx_hash, value in self.txo.items()}
-            self.storage.put('txi', txi)
-            self.storage.put('txo', txo)
+            self.storage.put('transactions', self.transactions.to_json())
+            self.storage.put('txi', self.txi.to_json())
+            self.storage.put('txo', self.txo.to_json())
             self.storage.put('tx_fees', self.tx_fees)
-            self.storage.put('pruned_txo', self.pruned_txo)
-            history = self.from_Address_dict(self._history)
-            self.storage.put('addr_history', history)
+            self.storage.put('pruned_txo', self.pruned_txo.to_json())
+            self.storage.put('addr_history', self._history.to_json())
             if write:
                 self.storage.write()
 
@@ -303,25 +368,22 @@ class Abstract_Wallet:
 
     def clear_history(self):
         with self.transaction_lock:
-            self.txi = {}
-            self.txo = {}
+            self.txi.clear()
+            self.txo.clear()
             self.tx_fees = {}
-            self.pruned_txo = {}
+            self.pruned_txo.clear()
         self.save_transactions()
         with self.lock:
-            self._history = {}
-            self.tx_addr_hist = {}
+            self._history.clear()
+            self.tx_addr_hist.clear()
 
-    @profiler
     def build_reverse_history(self):
-        self.tx_addr_hist = {}
-        for addr, hist in self._history.items():
+        tx_addr_hist = ReverseHistory()
+        for addr, hist in self._history.snapshot():
             for tx_hash, h in hist:
-                s = self.tx_addr_hist.get(tx_hash, set())
-                s.add(addr)
-                self.tx_addr_hist[tx_hash] = s
+                tx_addr_hist.add(tx_hash, addr)
+        self._tx_addr_hist = tx_addr_hist
 
-    @profiler
     def check_history(self):
         save = False
         my_addrs = [addr for addr in self._history if self.is_mine(addr)]
@@ -334,9 +396,9 @@ class Abstract_Wallet:
             hist = self._history[addr]
 
             for tx_hash, tx_height in hist:
-                if (tx_hash in self.pruned_txo.values() or
-                        self.txi.get(tx_hash) or
-                        self.txo.get(tx_hash)):
+                if (self.pruned_txo.has_spender(tx_hash) or
+                        self.txi.has_records(tx_hash) or
+                        self.txo.has_records(tx_hash)):
                     continue
                 tx = self.transactions.get(tx_hash)
                 if tx is not None:
@@ -450,6 +512,7 @@ class Abstract_Wallet:
         with self.lock:
             self.verified_tx[tx_hash] = info  # (tx_height, timestamp, pos)
         height, conf, timestamp = self.get_tx_height(tx_hash)
+        self.events.note_height(tx_hash, height, conf, timestamp)
         self.network.trigger_callback('verified', tx_hash, height, conf, timestamp)
 
     def get_unverified_txs(self):
@@ -466,6 +529,8 @@ class Abstract_Wallet:
                     tx_hashes.add(tx_hash)
             for tx_hash in tx_hashes:
                 self.verified_tx.pop(tx_hash)
+        for tx_hash in tx_hashes:
+            self.events.note_transaction(tx_hash)
         return tx_hashes
 
     def get_local_height(self):
@@ -497,7 +562,7 @@ class Abstract_Wallet:
                 return (1e9+1, 0)
 
     def is_found(self):
-        return any(value for value in self._history.values())
+        return any(not self._history.is_empty(addr) for addr in self._history)
 
     def get_num_tx(self, address):
         """ return number of transactions where address is involved """
@@ -507,17 +572,15 @@ class Abstract_Wallet:
         "effect of tx on address"
         assert isinstance(address, Address)
         # pruned
-        if tx_hash in self.pruned_txo.values():
+        if self.pruned_txo.has_spender(tx_hash):
             return None
         delta = 0
         # substract the value of coins sent from address
-        d = self.txi.get(tx_hash, {}).get(address, [])
-        for n, v in d:
-            delta -= v
+        for txin in self.txi.for_address(tx_hash, address):
+            delta -= txin.value
         # add the value of the coins received at address
-        d = self.txo.get(tx_hash, {}).get(address, [])
-        for n, v, cb in d:
-            delta += v
+        for txout in self.txo.for_address(tx_hash, address):
+            delta += txout.value
         return delta
 
     def get_wallet_delta(self, tx):
@@ -533,10 +596,9 @@ class Abstract_Wallet:
             if addr in addresses:
                 is_mine = True
                 is_relevant = True
-                d = self.txo.get(item['prevout_hash'], {}).get(addr, [])
-                for n, v, cb in d:
-                    if n == item['prevout_n']:
-                        value = v
+                for txout in self.txo.for_address(item['prevout_hash'], addr):
+                    if txout.n == item['prevout_n']:
+                        value = txout.value
                         break
                 else:
                     value = None
@@ -623,23 +685,20 @@ class Abstract_Wallet:
         received = {}
         sent = {}
         for tx_hash, height in h:
-            l = self.txo.get(tx_hash, {}).get(address, [])
-            for n, v, is_cb in l:
-                received[tx_hash + ':%d'%n] = (height, v, is_cb)
+            for txout in self.txo.for_address(tx_hash, address):
+                received[tx_hash + ':%d' % txout.n] = (height, txout.value, txout.is_coinbase)
         for tx_hash, height in h:
-            l = self.txi.get(tx_hash, {}).get(address, [])
-            for txi, v in l:
-                sent[txi] = height
+            for txin in self.txi.for_address(tx_hash, address):
+                sent[txin.prevout_string()] = height
         return received, sent
 
     def get_addr_utxo(self, address):
         coins, spent = self.get_addr_io(address)
         for txi in spent:
             coins.pop(txi)
-            if txi in self.frozen_coins:
-                # cleanup/detect if the 'frozen coin' was spent and
-                # remove it from the frozen coin set
-                self.frozen_coins.remove(txi)
+            # cleanup/detect if the 'frozen coin' was spent and remove it from
+            # the frozen coin set; discard as concurrent readers may race here
+            self.frozen_coins.discard(txi)
         out = {}
         for txo, v in coins.items():
             tx_height, value, is_cb = v
@@ -751,71 +810,54 @@ class Abstract_Wallet:
         is_coinbase = tx.inputs()[0]['type'] == 'coinbase'
         with self.transaction_lock:
             # add inputs
-            self.txi[tx_hash] = d = {}
+            txins = []
             for txi in tx.inputs():
                 addr = txi.get('address')
                 if txi['type'] != 'coinbase':
                     prevout_hash = txi['prevout_hash']
                     prevout_n = txi['prevout_n']
-                    ser = prevout_hash + ':%d'%prevout_n
                 # find value from prev output
                 if self.is_mine(addr):
-                    dd = self.txo.get(prevout_hash, {})
-                    for n, v, is_cb in dd.get(addr, []):
-                        if n == prevout_n:
-                            if d.get(addr) is None:
-                                d[addr] = []
-                            d[addr].append((ser, v))
+                    for txout in self.txo.for_address(prevout_hash, addr):
+                        if txout.n == prevout_n:
+                            txins.append(TxInput(addr, hash_to_bytes(prevout_hash),
+                                                 prevout_n, txout.value))
                             break
                     else:
-                        self.pruned_txo[ser] = tx_hash
+                        self.pruned_txo.add(prevout_hash, prevout_n, tx_hash)
+            self.txi.set(tx_hash, txins)
 
             # add outputs
-            self.txo[tx_hash] = d = {}
+            txouts = []
             for n, txo in enumerate(tx.outputs()):
-                ser = tx_hash + ':%d'%n
                 _type, addr, v = txo
                 if self.is_mine(addr):
-                    if not addr in d:
-                        d[addr] = []
-                    d[addr].append((n, v, is_coinbase))
+                    txouts.append(TxOutput(addr, n, v, is_coinbase))
                 # give v to txi that spends me
-                next_tx = self.pruned_txo.get(ser)
-                if next_tx is not None:
-                    self.pruned_txo.pop(ser)
-                    dd = self.txi.get(next_tx, {})
-                    if dd.get(addr) is None:
-                        dd[addr] = []
-                    dd[addr].append((ser, v))
+                next_tx = self.pruned_txo.pop(tx_hash, n)
+                if next_tx is not None and next_tx in self.txi:
+                    self.txi.append(next_tx, TxInput(addr, hash_to_bytes(tx_hash), n, v))
+            self.txo.set(tx_hash, txouts)
             # save
             self.transactions[tx_hash] = tx
+            transactions_added.inc()
+            self.events.note_transaction(tx_hash, self.txi.addresses(tx_hash) |
+                                         self.txo.addresses(tx_hash))
 
     def remove_transaction(self, tx_hash):
         with self.transaction_lock:
             self.logger.debug("removing tx from history %s", tx_hash)
             #tx = self.transactions.pop(tx_hash)
-            for ser, hh in list(self.pruned_txo.items()):
-                if hh == tx_hash:
-                    self.pruned_txo.pop(ser)
+            self.pruned_txo.remove_spender(tx_hash)
             # add tx to pruned_txo, and undo the txi addition
-            for next_tx, dd in self.txi.items():
-                for addr, l in list(dd.items()):
-                    ll = l[:]
-                    for item in ll:
-                        ser, v = item
-                        prev_hash, prev_n = ser.split(':')
-                        if prev_hash == tx_hash:
-                            l.remove(item)
-                            self.pruned_txo[ser] = next_tx
-                    if l == []:
-                        dd.pop(addr)
-                    else:
-                        dd[addr] = l
+            for prevout_n, next_tx in self.txi.unspend(tx_hash):
+                self.pruned_txo.add(tx_hash, prevout_n, next_tx)
             try:
                 self.txi.pop(tx_hash)
                 self.txo.pop(tx_hash)
             except KeyError:
                 self.logger.error("tx was not in history %s", tx_hash)
+            self.events.note_transaction(tx_hash)
 
     def receive_tx_callback(self, tx_hash, tx, tx_height):
         self.add_transaction(tx_hash, tx)
@@ -827,8 +869,7 @@ class Abstract_Wallet:
             for tx_hash, height in old_hist:
                 if (tx_hash, height) not in hist:
                     # remove tx if it's not referenced in histories
-                    self.tx_addr_hist[tx_hash].remove(addr)
-                    if not self.tx_addr_hist[tx_hash]:
+                    if self.tx_addr_hist.remove(tx_hash, addr):
                         self.remove_transaction(tx_hash)
             self._history[addr] = hist
 
@@ -836,21 +877,18 @@ class Abstract_Wallet:
             # add it in case it was previously unconfirmed
             self.add_unverified_tx(tx_hash, tx_height)
             # add reference in tx_addr_hist
-            s = self.tx_addr_hist.get(tx_hash, set())
-            s.add(addr)
-            self.tx_addr_hist[tx_hash] = s
+            self.tx_addr_hist.add(tx_hash, addr)
             # if addr is new, we have to recompute txi and txo
             tx = self.transactions.get(tx_hash)
             if (tx is not None and
-                    self.txi.get(tx_hash, {}).get(addr) is None and
-                    self.txo.get(tx_hash, {}).get(addr) is None):
+                    not self.txi.for_address(tx_hash, addr) and
+                    not self.txo.for_address(tx_hash, addr)):
                 self.add_transaction(tx_hash, tx)
 
         # Store fees
         self.tx_fees.update(tx_fees)
 
-        if self.network:
-            self.network.trigger_callback('on_history')
+        self.events.note_address(addr)
 
     def get_history(self, domain=None):
         # get domain
@@ -892,14 +930,40 @@ class Abstract_Wallet:
 
     def export_history(self, domain=None, from_timestamp=None, to_timestamp=None,
                        show_addresses=False):
-        h = self.get_history(domain)
+        return list(self.iter_export_history(domain, from_timestamp, to_timestamp,
+                                             show_addresses))
+
+    def iter_export_history(self, domain=None, from_timestamp=None, to_timestamp=None,
+                            show_addresses=False, chunk_size=EXPORT_CHUNK_SIZE):
+        '''Yield the export_history items one at a time, oldest first.
+
+        Transactions outside the date range are dropped before any of their
+        fields are formatted.  Items are built a chunk at a time so the fiat
+        rates of a chunk can be looked up together, and nothing is kept once a
+        chunk is yielded, so writing the items to a file as they arrive uses
+        memory for a chunk and not for the whole history.
+        '''
         fx = app_state.fx
-        out = []
-        for tx_hash, height, conf, timestamp, value, balance in h:
-            if from_timestamp and timestamp < from_timestamp:
+        chunk = []
+        for row in self.get_history(domain):
+            timestamp = row[3]
+            if from_timestamp and (timestamp is None or timestamp < from_timestamp):
                 continue
-            if to_timestamp and timestamp >= to_timestamp:
+            if to_timestamp and (timestamp is None or timestamp >= to_timestamp):
                 continue
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield from self._export_history_chunk(chunk, show_addresses, fx)
+                chunk = []
+        if chunk:
+            yield from self._export_history_chunk(chunk, show_addresses, fx)
+
+    def _export_history_chunk(self, rows, show_addresses, fx):
+        if fx:
+            # Look up the rates together; most transactions share a day with another
+            rates = fx.rates_for_timestamps([time.time() if conf <= 0 else timestamp
+                                             for _, _, conf, timestamp, _, _ in rows])
+        for n, (tx_hash, height, conf, timestamp, value, balance) in enumerate(rows):
             item = {
                 'txid':tx_hash,
                 'height':height,
@@ -918,7 +982,8 @@ class Abstract_Wallet:
             item['date'] = date_str
             item['label'] = self.get_label(tx_hash)
             if show_addresses:
-                tx = self.transactions.get(tx_hash)
+                # Deserialize a copy so the wallet's transactions stay compact
+                tx = Transaction(str(self.transactions[tx_hash]))
                 tx.deserialize()
                 input_addresses = []
                 output_addresses = []
@@ -932,11 +997,9 @@ class Abstract_Wallet:
                 item['input_addresses'] = input_addresses
                 item['output_addresses'] = output_addresses
             if fx:
-                date = timestamp_to_datetime(time.time() if conf <= 0 else timestamp)
-                item['fiat_value'] = fx.historical_value_str(value, date)
-                item['fiat_balance'] = fx.historical_value_str(balance, date)
-            out.append(item)
-        return out
+                item['fiat_value'] = fx.value_str(value, rates[n])
+                item['fiat_balance'] = fx.value_str(balance, rates[n])
+            yield item
 
     def get_label(self, tx_hash):
         label = self.labels.get(tx_hash, '')
@@ -945,10 +1008,9 @@ class Abstract_Wallet:
         return label
 
     def get_default_label(self, tx_hash):
-        if self.txi.get(tx_hash) == {}:
-            d = self.txo.get(tx_hash, {})
+        if self.txi.get(tx_hash) == ():
             labels = []
-            for addr in d.keys():
+            for addr in self.txo.addresses(tx_hash):
                 label = self.labels.get(addr.to_string())
                 if label:
                     labels.append(label)
@@ -1146,23 +1208,32 @@ class Abstract_Wallet:
             self.prepare_for_verifier()
             self.verifier = SPV(self.network, self)
             self.synchronizer = Synchronizer(self, network)
-            network.add_jobs([self.verifier, self.synchronizer])
+            self.events.interval = network.config.get('wallet_event_interval',
+                                                      self.events.interval)
+            network.add_jobs([self.verifier, self.synchronizer, self.events])
         else:
             self.verifier = None
             self.synchronizer = None
 
     def stop_threads(self):
         if self.network:
-            self.network.remove_jobs([self.synchronizer, self.verifier])
+            self.network.remove_jobs([self.synchronizer, self.verifier, self.events])
             self.synchronizer.release()
+            self.verifier.release()
             self.synchronizer = None
             self.verifier = None
             # Now no references to the syncronizer or verifier
             # remain so they will be GC-ed
             self.storage.put('stored_height', self.get_local_height())
+        self.lock_keystores()
+        self.events.flush(force=True)
         self.save_transactions()
         self.save_verified_tx()
         self.storage.write()
+        # Keep any summary offline queries use current with the new wallet file
+        from .wallet_summary import summary_path, write_summary
+        if os.path.exists(summary_path(self.storage.path)):
+            write_summary(self)
 
     def wait_until_synchronized(self, callback=None):
         def wait_for_wallet():
@@ -1264,26 +1335,53 @@ class Abstract_Wallet:
         # First look up an input transaction in the wallet where it
         # will likely be.  If co-signing a transaction it may not have
         # all the input txs, in which case we ask the network.
-        tx = self.transactions.get(tx_hash)
-        if not tx and self.network:
-            request = ('blockchain.transaction.get', [tx_hash])
-            tx = Transaction(self.network.synchronous_get(request))
-        return tx
+        return self.get_input_txs([tx_hash]).get(tx_hash)
+
+    def get_input_txs(self, tx_hashes):
+        '''Returns a dictionary mapping each tx_hash to its transaction.  Those
+        that are not in the wallet or the network's shared cache are requested
+        from the server in one batch rather than one round trip each.'''
+        txs = {}
+        # In order of first use, with a set to check membership
+        missing = []
+        missing_set = set()
+        for tx_hash in tx_hashes:
+            if tx_hash in txs or tx_hash in missing_set:
+                continue
+            tx = self.transactions.get(tx_hash)
+            if not tx and self.network:
+                raw = self.network.tx_cache.get_tx(tx_hash)
+                if raw:
+                    tx = Transaction(raw)
+            if tx:
+                txs[tx_hash] = tx
+            else:
+                missing.append(tx_hash)
+                missing_set.add(tx_hash)
+        if missing and self.network:
+            requests = [('blockchain.transaction.get', [tx_hash]) for tx_hash in missing]
+            for tx_hash, raw in zip(missing, self.network.synchronous_get_many(requests)):
+                txs[tx_hash] = Transaction(raw)
+        return txs
 
     def add_input_values_to_tx(self, tx):
         """ add input values to the tx, for signing"""
+        input_txs = self.get_input_txs([txin['prevout_hash'] for txin in tx.inputs()
+                                        if 'value' not in txin])
         for txin in tx.inputs():
             if 'value' not in txin:
-                inputtx = self.get_input_tx(txin['prevout_hash'])
+                inputtx = input_txs.get(txin['prevout_hash'])
                 if inputtx is not None:
                     out_zero, out_addr, out_val = inputtx.outputs()[txin['prevout_n']]
                     txin['value'] = out_val
                     txin['prev_tx'] = inputtx   # may be needed by hardware wallets
 
     def add_hw_info(self, tx):
+        input_txs = self.get_input_txs([txin['prevout_hash'] for txin in tx.inputs()
+                                        if 'prev_tx' not in txin])
         for txin in tx.inputs():
             if 'prev_tx' not in txin:
-                txin['prev_tx'] = self.get_input_tx(txin['prevout_hash'])
+                txin['prev_tx'] = input_txs.get(txin['prevout_hash'])
         # add output info for hw wallets
         info = {}
         xpubs = self.get_master_public_keys()
@@ -1309,12 +1407,27 @@ class Abstract_Wallet:
                 for k in self.get_keystores()]):
             self.add_hw_info(tx)
         # sign
+        start = time.perf_counter()
         for k in self.get_keystores():
             try:
                 if k.can_sign(tx):
                     k.sign_transaction(tx, password)
             except UserCancelled:
                 continue
+        if tx.inputs():
+            sign_input_seconds.observe((time.perf_counter() - start) / len(tx.inputs()))
+
+    def unlock_keystores(self, password, timeout):
+        '''Keep the decrypted keys of the wallet's software keystores for timeout seconds, so
+        that signing with password is faster.  Raises InvalidPassword.'''
+        for k in self.get_keystores():
+            if isinstance(k, Software_KeyStore) and not k.is_watching_only():
+                k.unlock(password, timeout)
+
+    def lock_keystores(self):
+        for k in self.get_keystores():
+            if isinstance(k, Software_KeyStore):
+                k.lock()
 
     def get_unused_addresses(self):
         # fixme: use slots from expired requests
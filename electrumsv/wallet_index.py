@@ -0,0 +1,420 @@
+# Electrum SV - lightweight Bitcoin SV client
+# Copyright (C) 2019 The Electrum SV Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Compact in-memory tables of a wallet's transaction inputs, outputs and
+address histories.
+
+Transaction hashes are held as 32-byte binary strings rather than hex, and
+outpoints as (hash, index) pairs rather than "txid:n" strings.  Records are
+slotted objects referencing the wallet's Address objects, grouped in a tuple
+per transaction instead of a dict of lists.  An address history is a packed
+byte string.  The tables take and return hex transaction hashes, and convert
+to and from the dicts the wallet has always stored, so the storage format is
+unchanged.
+'''
+
+from collections.abc import MutableMapping
+import struct
+import threading
+
+from .address import Address
+from .transaction import Transaction
+
+
+def hash_to_bytes(tx_hash):
+    return bytes.fromhex(tx_hash)
+
+
+def bytes_to_hash(tx_hash_bytes):
+    return tx_hash_bytes.hex()
+
+
+class TxInput(object):
+    '''An input of a transaction spending one of the wallet's coins.'''
+
+    __slots__ = ('address', 'prevout_hash', 'prevout_n', 'value')
+
+    def __init__(self, address, prevout_hash, prevout_n, value):
+        self.address = address
+        self.prevout_hash = prevout_hash
+        self.prevout_n = prevout_n
+        self.value = value
+
+    def prevout_string(self):
+        return '{}:{}'.format(bytes_to_hash(self.prevout_hash), self.prevout_n)
+
+    def to_json(self):
+        return [self.prevout_string(), self.value]
+
+    @classmethod
+    def from_json(cls, address, item):
+        ser, value = item
+        prevout_hash, prevout_n = ser.split(':')
+        return cls(address, hash_to_bytes(prevout_hash), int(prevout_n), value)
+
+
+class TxOutput(object):
+    '''An output of a transaction paying one of the wallet's addresses.'''
+
+    __slots__ = ('address', 'n', 'value', 'is_coinbase')
+
+    def __init__(self, address, n, value, is_coinbase):
+        self.address = address
+        self.n = n
+        self.value = value
+        self.is_coinbase = is_coinbase
+
+    def to_json(self):
+        return [self.n, self.value, self.is_coinbase]
+
+    @classmethod
+    def from_json(cls, address, item):
+        n, value, is_coinbase = item
+        return cls(address, n, value, is_coinbase)
+
+
+class TxRecordTable(object):
+    '''Maps a transaction hash to the tuple of its TxInput or TxOutput records
+    that involve the wallet.  A transaction can be present with no records,
+    meaning it was processed and none of its inputs or outputs are ours.'''
+
+    def __init__(self, record_class):
+        self.record_class = record_class
+        self._records = {}
+
+    def __contains__(self, tx_hash):
+        return hash_to_bytes(tx_hash) in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def tx_hashes(self):
+        return [bytes_to_hash(key) for key in self._records]
+
+    def get(self, tx_hash):
+        '''The records of the transaction, or None if it is not present.'''
+        return self._records.get(hash_to_bytes(tx_hash))
+
+    def has_records(self, tx_hash):
+        return bool(self._records.get(hash_to_bytes(tx_hash)))
+
+    def for_address(self, tx_hash, address):
+        records = self._records.get(hash_to_bytes(tx_hash), ())
+        return [record for record in records if record.address == address]
+
+    def addresses(self, tx_hash):
+        '''The distinct addresses of the transaction's records, in order.'''
+        records = self._records.get(hash_to_bytes(tx_hash), ())
+        return dict.fromkeys(record.address for record in records).keys()
+
+    def _put(self, key, records):
+        self._records[key] = records
+
+    def _discard(self, key):
+        return self._records.pop(key)
+
+    def set(self, tx_hash, records):
+        key = hash_to_bytes(tx_hash)
+        if key in self._records:
+            self._discard(key)
+        self._put(key, tuple(records))
+
+    def append(self, tx_hash, record):
+        key = hash_to_bytes(tx_hash)
+        records = self._discard(key) if key in self._records else ()
+        self._put(key, records + (record, ))
+
+    def pop(self, tx_hash):
+        return self._discard(hash_to_bytes(tx_hash))
+
+    def clear(self):
+        self._records.clear()
+
+    def to_json(self):
+        result = {}
+        for key, records in self._records.items():
+            d = {}
+            for record in records:
+                d.setdefault(record.address.to_string(), []).append(record.to_json())
+            result[bytes_to_hash(key)] = d
+        return result
+
+    def load_json(self, d):
+        from_json = self.record_class.from_json
+        for tx_hash, addr_dict in d.items():
+            self._put(hash_to_bytes(tx_hash), tuple(
+                from_json(Address.from_string(text), item)
+                for text, items in addr_dict.items() for item in items))
+
+
+class TxInputTable(TxRecordTable):
+    '''A TxRecordTable of TxInput records that also indexes which of the
+    wallet's transactions spend each transaction, so the spends of a removed
+    transaction are found without scanning every input.'''
+
+    def __init__(self):
+        super().__init__(TxInput)
+        # prevout hash -> set of hashes of the transactions spending it
+        self._spent_by = {}
+
+    def _put(self, key, records):
+        super()._put(key, records)
+        for record in records:
+            self._spent_by.setdefault(record.prevout_hash, set()).add(key)
+
+    def _discard(self, key):
+        records = super()._discard(key)
+        for record in records:
+            spenders = self._spent_by.get(record.prevout_hash)
+            if spenders is not None:
+                spenders.discard(key)
+                if not spenders:
+                    del self._spent_by[record.prevout_hash]
+        return records
+
+    def clear(self):
+        super().clear()
+        self._spent_by.clear()
+
+    def spenders(self, tx_hash):
+        '''The hashes of the transactions with inputs spending tx_hash.'''
+        return [bytes_to_hash(key)
+                for key in self._spent_by.get(hash_to_bytes(tx_hash), ())]
+
+    def unspend(self, tx_hash):
+        '''Remove the inputs spending outputs of tx_hash.  Returns a list of
+        (prevout_n, spending tx_hash) pairs for the removed inputs.'''
+        prevout_hash = hash_to_bytes(tx_hash)
+        removed = []
+        for key in list(self._spent_by.get(prevout_hash, ())):
+            records = self._discard(key)
+            kept = []
+            for record in records:
+                if record.prevout_hash == prevout_hash:
+                    removed.append((record.prevout_n, bytes_to_hash(key)))
+                else:
+                    kept.append(record)
+            self._put(key, tuple(kept))
+        return removed
+
+
+class PrunedTxoTable(object):
+    '''Outpoints spent by a wallet transaction, whose funding transaction we do
+    not have yet.  Maps the outpoint to the hash of the spending transaction,
+    and indexes the outpoints by spending transaction.'''
+
+    _key = struct.Struct('<32sI')
+
+    def __init__(self):
+        self._spenders = {}
+        # spending tx hash -> set of outpoint keys
+        self._by_spender = {}
+
+    def __len__(self):
+        return len(self._spenders)
+
+    def _remove_key(self, key):
+        spender = self._spenders.pop(key, None)
+        if spender is not None:
+            keys = self._by_spender[spender]
+            keys.discard(key)
+            if not keys:
+                del self._by_spender[spender]
+        return spender
+
+    def add(self, prevout_hash, prevout_n, tx_hash):
+        key = self._key.pack(hash_to_bytes(prevout_hash), prevout_n)
+        spender = hash_to_bytes(tx_hash)
+        self._remove_key(key)
+        self._spenders[key] = spender
+        self._by_spender.setdefault(spender, set()).add(key)
+
+    def pop(self, prevout_hash, prevout_n):
+        '''Remove the outpoint, returning the hash of its spender or None.'''
+        spender = self._remove_key(self._key.pack(hash_to_bytes(prevout_hash), prevout_n))
+        return None if spender is None else bytes_to_hash(spender)
+
+    def has_spender(self, tx_hash):
+        return hash_to_bytes(tx_hash) in self._by_spender
+
+    def remove_spender(self, tx_hash):
+        '''Remove the outpoints spent by tx_hash.'''
+        for key in self._by_spender.pop(hash_to_bytes(tx_hash), ()):
+            del self._spenders[key]
+
+    def clear(self):
+        self._spenders.clear()
+        self._by_spender.clear()
+
+    def to_json(self):
+        unpack = self._key.unpack
+        result = {}
+        for key, spender in self._spenders.items():
+            prevout_hash, prevout_n = unpack(key)
+            result['{}:{}'.format(bytes_to_hash(prevout_hash), prevout_n)] = \
+                bytes_to_hash(spender)
+        return result
+
+    def load_json(self, d):
+        for ser, tx_hash in d.items():
+            prevout_hash, prevout_n = ser.split(':')
+            self.add(prevout_hash, int(prevout_n), tx_hash)
+
+
+class AddressHistory(MutableMapping):
+    '''Maps each Address to its history, a list of (tx_hash, height) pairs.
+    Each history is held packed as 36 bytes per entry.'''
+
+    _row = struct.Struct('<32si')
+
+    def __init__(self):
+        self._histories = {}
+
+    @classmethod
+    def _pack(cls, hist):
+        pack = cls._row.pack
+        return b''.join(pack(hash_to_bytes(tx_hash), height) for tx_hash, height in hist)
+
+    @classmethod
+    def _unpack(cls, packed):
+        return [(tx_hash.hex(), height) for tx_hash, height in cls._row.iter_unpack(packed)]
+
+    def __getitem__(self, address):
+        return self._unpack(self._histories[address])
+
+    def __setitem__(self, address, hist):
+        self._histories[address] = self._pack(hist)
+
+    def __delitem__(self, address):
+        del self._histories[address]
+
+    def __contains__(self, address):
+        return address in self._histories
+
+    def __iter__(self):
+        return iter(self._histories)
+
+    def __len__(self):
+        return len(self._histories)
+
+    def is_empty(self, address):
+        '''True if the address has no history; cheaper than unpacking it.'''
+        return not self._histories.get(address)
+
+    def snapshot(self):
+        '''A list of (address, history) pairs, safe to take while another thread
+        adds addresses.'''
+        return [(address, self._unpack(packed))
+                for address, packed in list(self._histories.items())]
+
+    def to_json(self):
+        return {address.to_string(): [list(entry) for entry in self[address]]
+                for address in self._histories}
+
+    def load_json(self, d):
+        for text, hist in d.items():
+            self[Address.from_string(text)] = hist
+
+
+class ReverseHistory(object):
+    '''Maps a transaction hash to the tuple of addresses whose history has it.'''
+
+    def __init__(self):
+        self._addresses = {}
+
+    def __contains__(self, tx_hash):
+        return hash_to_bytes(tx_hash) in self._addresses
+
+    def get(self, tx_hash):
+        return self._addresses.get(hash_to_bytes(tx_hash), ())
+
+    def add(self, tx_hash, address):
+        key = hash_to_bytes(tx_hash)
+        addresses = self._addresses.get(key, ())
+        if address not in addresses:
+            self._addresses[key] = addresses + (address, )
+
+    def remove(self, tx_hash, address):
+        '''Remove address from the transaction.  Returns True if no address
+        references the transaction any more.'''
+        key = hash_to_bytes(tx_hash)
+        addresses = tuple(a for a in self._addresses.get(key, ()) if a != address)
+        if addresses:
+            self._addresses[key] = addresses
+            return False
+        self._addresses.pop(key, None)
+        return True
+
+    def clear(self):
+        self._addresses.clear()
+
+
+class TransactionMap(MutableMapping):
+    '''Maps a transaction hash to its Transaction.  Transactions loaded from
+    storage are held as raw hex and only turned into Transaction objects when
+    first looked up.'''
+
+    def __init__(self):
+        self._raw = {}
+        self._txs = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, tx_hash):
+        tx = self._txs.get(tx_hash)
+        if tx is None:
+            with self._lock:
+                tx = self._txs.get(tx_hash)
+                if tx is None:
+                    tx = Transaction(self._raw.pop(tx_hash))
+                    self._txs[tx_hash] = tx
+        return tx
+
+    def __setitem__(self, tx_hash, tx):
+        with self._lock:
+            self._raw.pop(tx_hash, None)
+            self._txs[tx_hash] = tx
+
+    def __delitem__(self, tx_hash):
+        with self._lock:
+            if self._raw.pop(tx_hash, None) is None:
+                del self._txs[tx_hash]
+
+    def __contains__(self, tx_hash):
+        return tx_hash in self._txs or tx_hash in self._raw
+
+    def __iter__(self):
+        with self._lock:
+            tx_hashes = list(self._txs) + list(self._raw)
+        return iter(tx_hashes)
+
+    def __len__(self):
+        return len(self._txs) + len(self._raw)
+
+    def to_json(self):
+        with self._lock:
+            result = dict(self._raw)
+            result.update((tx_hash, str(tx)) for tx_hash, tx in self._txs.items())
+        return result
+
+    def load_json(self, d):
+        self._raw.update(d)
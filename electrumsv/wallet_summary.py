@@ -0,0 +1,196 @@
+# Electrum SV - lightweight Bitcoin SV client
+# Copyright (C) 2019 The Electrum SV Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Precomputed summaries of wallets for fast offline queries.
+
+Opening a wallet reads and indexes the whole wallet file before it can answer
+anything, which is most of the time taken by an offline query of a large
+wallet.  When such a query loads the full wallet, a summary of what the
+queries need is written next to the wallet file: its addresses and their
+balances, its unspent outputs and its history.  Later offline queries read
+the summary instead of the wallet, for as long as the wallet file has not
+changed since the summary was written.
+
+WalletSummary answers the parts of the wallet interface the summarised
+commands use, so the commands run unchanged against it.  Summaries are only
+written for wallets whose files are not encrypted, as they are not encrypted
+themselves.
+'''
+
+import json
+import os
+
+from .address import Address
+from .logs import logs
+from .wallet import Abstract_Wallet
+
+
+logger = logs.get_logger("wallet_summary")
+
+SUMMARY_VERSION = 1
+
+# Offline commands a summary can answer
+SUMMARY_COMMANDS = {'getbalance', 'history', 'listaddresses', 'listunspent'}
+
+
+def summary_path(wallet_path):
+    return wallet_path + '.summary'
+
+
+def can_answer(cmdname, config):
+    '''Whether a summary can answer the offline command with its options.'''
+    if cmdname not in SUMMARY_COMMANDS:
+        return False
+    # Input and output addresses need the transactions themselves
+    return not (cmdname == 'history' and config.get('show_addresses'))
+
+
+def _file_state(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def write_summary(wallet):
+    '''Write the summary of wallet, whose storage must be written first.  Does
+    nothing for encrypted wallets.'''
+    storage = wallet.storage
+    if storage.is_encrypted() or not storage.file_exists():
+        return
+    addresses = wallet.get_addresses()
+    balances = {}
+    for address in addresses:
+        history = wallet.get_address_history(address)
+        if history:
+            balances[address.to_string()] = [len(history)] + list(
+                wallet.get_addr_balance(address))
+    utxos = []
+    for utxo in wallet.get_utxos(exclude_frozen=False):
+        utxo = dict(utxo)
+        utxo['address'] = utxo['address'].to_string()
+        utxos.append(utxo)
+    history = [[tx_hash, height, conf, timestamp, value, balance, wallet.get_label(tx_hash)]
+               for tx_hash, height, conf, timestamp, value, balance in wallet.get_history()]
+    data = {
+        'version': SUMMARY_VERSION,
+        'wallet_file': _file_state(storage.path),
+        'addresses': [address.to_string() for address in addresses],
+        'change': [address.to_string() for address in addresses
+                   if wallet.is_change(address)],
+        'frozen_addresses': [address.to_string() for address in wallet.frozen_addresses],
+        'labels': wallet.labels,
+        'balances': balances,
+        'balance': list(wallet.get_balance()),
+        'utxos': utxos,
+        'history': history,
+    }
+    path = summary_path(storage.path)
+    temp_path = "%s.tmp.%s" % (path, os.getpid())
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        # As private as the wallet file
+        os.chmod(temp_path, os.stat(storage.path).st_mode)
+        os.replace(temp_path, path)
+    except OSError:
+        logger.exception("unable to write summary of %s", storage.path)
+
+
+class WalletSummary(object):
+    '''A read-only stand-in for a wallet, answering from its summary.'''
+
+    # The history is formatted just as the wallet formats it
+    iter_export_history = Abstract_Wallet.iter_export_history
+    export_history = Abstract_Wallet.export_history
+    _export_history_chunk = Abstract_Wallet._export_history_chunk
+
+    def __init__(self, data):
+        self.addresses = Address.from_strings(data['addresses'])
+        self.change_addresses = set(Address.from_strings(data['change']))
+        self.frozen_addresses = set(Address.from_strings(data['frozen_addresses']))
+        self.labels = data['labels']
+        self.balances = data['balances']
+        self.balance = tuple(data['balance'])
+        self.utxos = data['utxos']
+        self.history = data['history']
+        self.tx_labels = {row[0]: row[6] for row in self.history}
+
+    @classmethod
+    def load(cls, wallet_path):
+        '''The summary of the wallet at wallet_path, or None if there is none or
+        the wallet has changed since it was written.'''
+        path = summary_path(wallet_path)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if (data.get('version') != SUMMARY_VERSION or
+                    data.get('wallet_file') != _file_state(wallet_path)):
+                return None
+            return cls(data)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.exception("ignoring unreadable summary %s", path)
+            return None
+
+    def get_addresses(self):
+        return list(self.addresses)
+
+    def is_change(self, address):
+        return address in self.change_addresses
+
+    def is_frozen(self, address):
+        return address in self.frozen_addresses
+
+    def _entry(self, address):
+        return self.balances.get(address.to_string(), (0, 0, 0, 0))
+
+    def get_address_history_count(self, address):
+        return self._entry(address)[0]
+
+    def get_addr_balance(self, address):
+        return tuple(self._entry(address)[1:])
+
+    def is_used(self, address):
+        return bool(self.get_address_history_count(address)) and not self.is_empty(address)
+
+    def is_empty(self, address):
+        return any(self.get_addr_balance(address))
+
+    def get_balance(self):
+        return self.balance
+
+    def get_utxos(self, exclude_frozen=False):
+        assert not exclude_frozen
+        utxos = []
+        for utxo in self.utxos:
+            utxo = dict(utxo)
+            utxo['address'] = Address.from_string(utxo['address'])
+            utxos.append(utxo)
+        return utxos
+
+    def get_history(self, domain=None):
+        assert domain is None
+        return [tuple(row[:6]) for row in self.history]
+
+    def get_label(self, tx_hash):
+        return self.tx_labels.get(tx_hash, '')
@@ -0,0 +1,363 @@
+# Electrum SV - lightweight Bitcoin SV client
+# Copyright (C) 2019 The Electrum SV Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Asynchronous delivery of webhook notifications.
+
+Callers hand an event to the dispatcher and return immediately; a pool of
+worker threads POSTs it as JSON, reusing HTTP connections per host, and
+retries failures with exponential backoff.  With a path, each event is
+appended to a journal there when it is queued, and marked done when it is
+delivered, abandoned or dropped.  Events the journal shows as undelivered, for
+example after a crash, are queued again when a dispatcher is next created.
+The journal is rewritten with only the undelivered events when it grows and
+when the dispatcher stops.
+'''
+
+from collections import defaultdict
+import heapq
+import http.client
+import json
+import os
+import queue
+import threading
+import time
+from urllib.parse import urlsplit
+
+from .logs import logs
+
+
+logger = logs.get_logger("webhooks")
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF = 2.0
+DEFAULT_TIMEOUT = 5
+# Journal entries beyond the undelivered events before it is rewritten
+JOURNAL_SLACK = 1000
+
+
+class WebhookEvent(object):
+
+    def __init__(self, url, payload, attempts=0, event_id=None):
+        self.url = url
+        self.payload = payload
+        self.attempts = attempts
+        self.event_id = event_id
+
+    def to_json(self):
+        return {'id': self.event_id, 'url': self.url, 'payload': self.payload,
+                'attempts': self.attempts}
+
+    @classmethod
+    def from_json(cls, d):
+        return cls(d['url'], d['payload'], d.get('attempts', 0), d['id'])
+
+
+class URLMetrics(object):
+
+    def __init__(self):
+        self.delivered = 0
+        self.failed_attempts = 0
+        self.abandoned = 0
+        self.dropped = 0
+        self.total_time = 0.0
+        self.last_error = None
+
+    def to_json(self):
+        return {
+            'delivered': self.delivered,
+            'failed_attempts': self.failed_attempts,
+            'abandoned': self.abandoned,
+            'dropped': self.dropped,
+            'mean_time': self.total_time / self.delivered if self.delivered else 0.0,
+            'last_error': self.last_error,
+        }
+
+
+class WebhookDispatcher(object):
+    '''Delivers webhook events without blocking the caller.
+
+    path         --- journal file of undelivered events, or None.
+    workers      --- number of delivery threads.
+    queue_size   --- events beyond this many waiting are dropped.
+    max_attempts --- an event is abandoned after failing this many times.
+    backoff      --- delay before the first retry, doubling for each retry.
+    '''
+
+    def __init__(self, path=None, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, backoff=DEFAULT_BACKOFF,
+                 timeout=DEFAULT_TIMEOUT):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.timeout = timeout
+        self.queue = queue.Queue(queue_size)
+        self.metrics = defaultdict(URLMetrics)
+        self.lock = threading.Lock()
+        # Heap of (due_time, sequence, event) awaiting retry
+        self.retries = []
+        self.retry_sequence = 0
+        self.retry_cond = threading.Condition(self.lock)
+        self.threads = []
+        self.local = threading.local()
+        self.running = False
+        # Undelivered events by id, in the order they were first queued
+        self.pending = {}
+        self.next_event_id = 0
+        self.journal = None
+        self.journal_entries = 0
+        self._load()
+
+    def start(self):
+        self.running = True
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'webhook-{n}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        thread = threading.Thread(target=self._retrier, name='webhook-retry', daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def stop(self):
+        '''Stop the threads.  Undelivered events stay in the journal.'''
+        with self.lock:
+            self.running = False
+            self.retry_cond.notify_all()
+        for _ in range(self.workers):
+            # Wake the workers; they exit on seeing None
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self._close_journal()
+
+    def post(self, url, payload):
+        '''Queue payload, a JSON-serializable object, to be POSTed to url.  Never
+        blocks; returns False if the queue is full and the event was dropped.'''
+        with self.lock:
+            event = WebhookEvent(url, payload, event_id=self.next_event_id)
+            self.next_event_id += 1
+            # Journaled before a worker can deliver it
+            self._record_locked(event)
+        return self._enqueue(event)
+
+    def get_metrics(self):
+        '''Per-URL delivery statistics.'''
+        with self.lock:
+            metrics = {url: m.to_json() for url, m in self.metrics.items()}
+            pending = len(self.retries)
+        return {'queued': self.queue.qsize(), 'retrying': pending, 'urls': metrics}
+
+    def _enqueue(self, event):
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            logger.error("webhook queue full, dropping event for %s", event.url)
+            with self.lock:
+                self.metrics[event.url].dropped += 1
+                self._record_done_locked(event)
+            return False
+
+    def _connection(self, url):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        connections = getattr(self.local, 'connections', None)
+        if connections is None:
+            connections = self.local.connections = {}
+        conn = connections.get(key)
+        if conn is None:
+            if parts.scheme == 'https':
+                conn = http.client.HTTPSConnection(parts.netloc, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(parts.netloc, timeout=self.timeout)
+            connections[key] = conn
+        return key, conn
+
+    def _deliver(self, event):
+        parts = urlsplit(event.url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        body = json.dumps(event.payload).encode()
+        headers = {'Content-Type': 'application/json'}
+        key, conn = self._connection(event.url)
+        try:
+            conn.request('POST', path, body, headers)
+            response = conn.getresponse()
+            response.read()
+        except Exception:
+            # Drop the connection; the next attempt reconnects
+            conn.close()
+            del self.local.connections[key]
+            raise
+        if response.status >= 300:
+            raise Exception(f'HTTP status {response.status}')
+
+    def _worker(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                break
+            if not self.running:
+                # Left in the journal for the next dispatcher
+                continue
+            start = time.time()
+            try:
+                self._deliver(event)
+            except Exception as e:
+                self._failed(event, e)
+            else:
+                with self.lock:
+                    metrics = self.metrics[event.url]
+                    metrics.delivered += 1
+                    metrics.total_time += time.time() - start
+                    self._record_done_locked(event)
+                logger.debug("delivered webhook to %s", event.url)
+        for conn in getattr(self.local, 'connections', {}).values():
+            conn.close()
+
+    def _failed(self, event, error):
+        event.attempts += 1
+        with self.lock:
+            metrics = self.metrics[event.url]
+            metrics.failed_attempts += 1
+            metrics.last_error = str(error)
+            if event.attempts >= self.max_attempts:
+                metrics.abandoned += 1
+                logger.error("abandoning webhook to %s after %d attempts: %s",
+                             event.url, event.attempts, error)
+                self._record_done_locked(event)
+                return
+            # Keeps the attempt count across restarts
+            self._record_locked(event)
+            delay = self.backoff * 2 ** (event.attempts - 1)
+            self.retry_sequence += 1
+            heapq.heappush(self.retries, (time.time() + delay, self.retry_sequence, event))
+            self.retry_cond.notify()
+        logger.debug("webhook to %s failed (%s), retrying in %.1fs", event.url, error, delay)
+
+    def _retrier(self):
+        with self.lock:
+            while self.running:
+                if not self.retries:
+                    self.retry_cond.wait()
+                    continue
+                due = self.retries[0][0] - time.time()
+                if due > 0:
+                    self.retry_cond.wait(due)
+                    continue
+                _, _, event = heapq.heappop(self.retries)
+                self.lock.release()
+                try:
+                    self._enqueue(event)
+                finally:
+                    self.lock.acquire()
+
+    def _write_journal_locked(self, entry):
+        if self.journal is None:
+            return
+        try:
+            self.journal.write(json.dumps(entry) + '\n')
+            self.journal.flush()
+            self.journal_entries += 1
+            if self.journal_entries > len(self.pending) + JOURNAL_SLACK:
+                self._rewrite_journal_locked()
+        except (OSError, TypeError, ValueError):
+            logger.exception("cannot write webhook journal %s", self.path)
+
+    def _record_locked(self, event):
+        self.pending[event.event_id] = event
+        self._write_journal_locked(event.to_json())
+
+    def _record_done_locked(self, event):
+        if self.pending.pop(event.event_id, None) is not None:
+            self._write_journal_locked({'done': event.event_id})
+
+    def _rewrite_journal_locked(self, reopen=True):
+        '''Replace the journal with one holding just the undelivered events.'''
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if not self.pending:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        else:
+            temp_path = "%s.tmp.%s" % (self.path, os.getpid())
+            with open(temp_path, 'w') as f:
+                for event in self.pending.values():
+                    f.write(json.dumps(event.to_json()) + '\n')
+            os.replace(temp_path, self.path)
+        if reopen:
+            self.journal = open(self.path, 'a')
+        self.journal_entries = len(self.pending)
+
+    def _load(self):
+        if not self.path:
+            return
+        events = {}
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            # The last line of a journal cut short by a crash
+                            continue
+                        if 'done' in entry:
+                            events.pop(entry['done'], None)
+                        else:
+                            event = WebhookEvent.from_json(entry)
+                            events[event.event_id] = event
+            self.pending = events
+            self.next_event_id = max(events, default=-1) + 1
+            self._rewrite_journal_locked()
+        except Exception:
+            logger.exception("cannot read undelivered webhooks from %s", self.path)
+            return
+        if events:
+            logger.info("queueing %d undelivered webhooks", len(events))
+        for event in list(events.values()):
+            self._enqueue(event)
+
+    def _close_journal(self):
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        with self.lock:
+            self.retries = []
+            if self.journal is None:
+                return
+            try:
+                self._rewrite_journal_locked(reopen=False)
+            except (OSError, TypeError, ValueError):
+                logger.exception("cannot write webhook journal %s", self.path)
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+            self.pending = {}
@@ -24,13 +24,28 @@
 # SOFTWARE.
 
 import hashlib
+import json
+import os
+import threading
+import time
 
 import ecdsa
 
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding, rsa
+except ImportError:
+    rsa = None
+
 from .logs import logs
 from .util import profiler, bh2u
 
 
+logger = logs.get_logger("x509")
+
+
 # algo OIDs
 ALGO_RSA_SHA1 = '1.2.840.113549.1.1.5'
 ALGO_RSA_SHA256 = '1.2.840.113549.1.1.11'
@@ -67,6 +82,18 @@ ASN1_TYPES = {
     'UTF8String'       : 0x0C,
 }
 
+HASH_NAMES = {
+    ALGO_RSA_SHA1: 'sha1',
+    ALGO_RSA_SHA256: 'sha256',
+    ALGO_RSA_SHA384: 'sha384',
+    ALGO_RSA_SHA512: 'sha512',
+}
+PREFIXES = {
+    ALGO_RSA_SHA256: PREFIX_RSA_SHA256,
+    ALGO_RSA_SHA384: PREFIX_RSA_SHA384,
+    ALGO_RSA_SHA512: PREFIX_RSA_SHA512,
+}
+
 
 class CertificateError(Exception):
     pass
@@ -299,12 +326,16 @@ class X509(object):
     def check_ca(self):
         return self.CA
 
-    def check_date(self):
-        import time
-        now = time.time()
+    def validity(self):
+        '''The not before and not after times as timestamps.'''
         TIMESTAMP_FMT = '%y%m%d%H%M%SZ'
         not_before = time.mktime(time.strptime(self.notBefore.decode('ascii'), TIMESTAMP_FMT))
         not_after = time.mktime(time.strptime(self.notAfter.decode('ascii'), TIMESTAMP_FMT))
+        return not_before, not_after
+
+    def check_date(self):
+        now = time.time()
+        not_before, not_after = self.validity()
         if not_before > now:
             raise CertificateError('Certificate has not entered its valid date range. (%s)' %
                                    self.get_common_name())
@@ -341,6 +372,178 @@ def load_certificates(ca_path):
     return ca_list, ca_keyID
 
 
+def verify_rsa_signature(modulus, exponent, algo, signature, data):
+    '''Whether signature is a PKCS#1 v1.5 signature of data by the RSA public key, using the
+    cryptography package if it is installed and the pure Python rsakey module otherwise.'''
+    hash_name = HASH_NAMES.get(algo)
+    if hash_name is None:
+        raise CertificateError("Algorithm not supported")
+    if rsa is not None:
+        public_key = rsa.RSAPublicNumbers(exponent, modulus).public_key(default_backend())
+        try:
+            public_key.verify(bytes(signature), bytes(data), padding.PKCS1v15(),
+                              getattr(hashes, hash_name.upper())())
+            return True
+        except InvalidSignature:
+            # Old SHA-1 signatures may omit the NULL digest parameters; rsakey accepts those
+            if algo != ALGO_RSA_SHA1:
+                return False
+    from .rsakey import RSAKey
+    public_key = RSAKey(modulus, exponent)
+    if algo == ALGO_RSA_SHA1:
+        return public_key.hashAndVerify(bytearray(signature), bytearray(data))
+    digest = hashlib.new(hash_name, bytes(data)).digest()
+    return public_key.verify(bytearray(signature), PREFIXES[algo] + bytearray(digest))
+
+
+class TrustedCertificate(object):
+    '''The parts of a trusted root certificate used to verify a chain ending with it.'''
+
+    __slots__ = ('fingerprint', 'key_id', 'modulus', 'exponent', 'not_before', 'not_after',
+                 'common_name')
+
+    def __init__(self, fingerprint, key_id, modulus, exponent, not_before, not_after,
+                 common_name):
+        self.fingerprint = fingerprint
+        self.key_id = key_id
+        self.modulus = modulus
+        self.exponent = exponent
+        self.not_before = not_before
+        self.not_after = not_after
+        self.common_name = common_name
+
+    @classmethod
+    def from_x509(cls, x):
+        not_before, not_after = x.validity()
+        return cls(x.getFingerprint(), x.get_keyID(), x.modulus, x.exponent,
+                   int(not_before), int(not_after), x.get_common_name())
+
+    def getFingerprint(self):
+        return self.fingerprint
+
+    def get_common_name(self):
+        return self.common_name
+
+    def to_json(self):
+        return [self.fingerprint.hex(), self.key_id, '%x' % self.modulus, self.exponent,
+                self.not_before, self.not_after, self.common_name]
+
+    @classmethod
+    def from_json(cls, item):
+        fingerprint, key_id, modulus, exponent, not_before, not_after, common_name = item
+        return cls(bytes.fromhex(fingerprint), key_id, int(modulus, 16), exponent,
+                   not_before, not_after, common_name)
+
+
+class CertificateStore(object):
+    '''The trusted root certificates of a CA bundle, indexed by fingerprint and subject key
+    ID, and the intermediate certificates verified to chain to one of them.
+
+    Parsing a bundle takes tens of milliseconds, so the roots are cached at cache_path in a
+    compact form and reparsed only if the bundle's path, size or modification time change.
+    The store is loaded on first use or by calling load().
+    '''
+
+    CACHE_VERSION = 1
+    MAX_VERIFIED = 1000
+
+    def __init__(self, ca_path, cache_path=None):
+        self.ca_path = ca_path
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._by_fingerprint = None
+        self._by_key_id = None
+        # Intermediate certificates known to chain to a root, by fingerprint
+        self._verified = {}
+
+    def load(self):
+        with self._lock:
+            if self._by_fingerprint is not None:
+                return
+            source = self._source()
+            certificates = self._read_cache(source)
+            if certificates is None:
+                certificates = self._parse_bundle()
+                self._write_cache(source, certificates)
+            now = time.time()
+            certificates = [cert for cert in certificates
+                            if cert.not_before <= now < cert.not_after]
+            self._by_key_id = {cert.key_id: cert for cert in certificates}
+            self._by_fingerprint = {cert.fingerprint: cert for cert in certificates}
+
+    def __len__(self):
+        self.load()
+        return len(self._by_fingerprint)
+
+    def __contains__(self, fingerprint):
+        self.load()
+        return fingerprint in self._by_fingerprint
+
+    def get_by_key_id(self, key_id):
+        self.load()
+        return self._by_key_id.get(key_id)
+
+    def get_verified(self, der):
+        '''The parsed intermediate certificate with the given DER encoding if it was verified
+        to chain to a trusted root, otherwise None.'''
+        return self._verified.get(hashlib.sha1(der).digest())
+
+    def add_verified(self, x):
+        if len(self._verified) >= self.MAX_VERIFIED:
+            self._verified.clear()
+        self._verified[x.getFingerprint()] = x
+
+    def _source(self):
+        st = os.stat(self.ca_path)
+        return [os.path.abspath(self.ca_path), st.st_size, st.st_mtime]
+
+    def _parse_bundle(self):
+        from . import pem
+        with open(self.ca_path, 'r', encoding='utf-8') as f:
+            bList = pem.dePemList(f.read(), "CERTIFICATE")
+        certificates = []
+        for b in bList:
+            try:
+                x = X509(b)
+                if x.public_key_algo == '1.2.840.10045.2.1':
+                    # EC keys cannot verify a chain
+                    continue
+                certificates.append(TrustedCertificate.from_x509(x))
+            except Exception as e:
+                logger.error("cert error %s", e)
+        logger.debug("parsed %d certificates from %s", len(certificates), self.ca_path)
+        return certificates
+
+    def _read_cache(self, source):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path, 'r') as f:
+                d = json.load(f)
+            if d.get('version') != self.CACHE_VERSION or d.get('source') != source:
+                return None
+            return [TrustedCertificate.from_json(item) for item in d['certificates']]
+        except Exception:
+            logger.exception("unable to read the certificate cache %s", self.cache_path)
+            return None
+
+    def _write_cache(self, source, certificates):
+        if not self.cache_path:
+            return
+        d = {
+            'version': self.CACHE_VERSION,
+            'source': source,
+            'certificates': [cert.to_json() for cert in certificates],
+        }
+        tmp_path = self.cache_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(d, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            logger.exception("unable to write the certificate cache %s", self.cache_path)
+
+
 if __name__ == "__main__":
     import requests
 